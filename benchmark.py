@@ -0,0 +1,481 @@
+"""
+Benchmarks for the gravity solvers in main.py
+
+Usage:
+    python benchmark.py theta [-n 1000,5000] [--thetas 0.2,0.5,0.8]
+                              [--backends native,numpy] [--seed SEED]
+    python benchmark.py fmm [-n 1000,5000] [--thetas 0.5,0.7] [--orders 2,4,6]
+                            [--backends native,numpy] [--seed SEED]
+    python benchmark.py matrix [--integrators rk4,ias15] [--backends native,numpy]
+                               [--scenarios figure_8] [--tolerances 1e-6,1e-9]
+                               [--repeat 3] [-o results.json]
+    python benchmark.py scaling [-n 100,1000,10000] [--problem plummer]
+                                [--backends native,numpy] [-i leapfrog]
+                                [-o results.json]
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+
+import headless
+import main
+
+# Simulation time (days) and time step of the fixed step size integrators
+# for each scenario of the matrix benchmark
+MATRIX_SCENARIOS = {
+    "solar_system": (3652.5, 0.1),
+    "figure_8": (10.0, 1e-3),
+    "pyth_3_body": (10.0, 1e-4),
+}
+FIXED_STEP_SIZE_INTEGRATORS = [
+    "euler", "euler_cromer", "rk4", "leapfrog", "forest_ruth", "yoshida6", "whfast", "saba4", "sbab4",
+    "block_leapfrog",
+]
+# The Wisdom-Holman integrators need a dominant central object, so they
+# only run on the hierarchical scenarios
+WISDOM_HOLMAN_INTEGRATORS = ["whfast", "saba4", "sbab4"]
+HIERARCHICAL_SCENARIOS = ["solar_system"]
+
+# Minimum wall time (s) of each measurement of the scaling benchmark
+SCALING_MIN_TIME = 0.2
+
+
+def theta_report(objects_counts, thetas, backends, seed=0, G=1.0, orders=None):
+    """
+    Compare the Barnes-Hut acceleration, or the FMM acceleration for each
+    expansion order if orders is given, against the direct sum for each
+    number of objects, opening angle and backend. The relative errors are
+    measured against the direct sum of the first backend, and the speedup
+    against the direct sum of the same backend. Every method is timed over
+    at least SCALING_MIN_TIME.
+    """
+    c_libs = {}
+    for backend in backends:
+        if backend == "numpy":
+            c_libs[backend] = None
+            continue
+
+        c_lib, _ = main.load_c_lib(backend)
+        if c_lib is None or isinstance(c_lib, main.Legacy_c_lib):
+            print(f"System message: {backend} backend is not available, skipped.")
+            continue
+        c_libs[backend] = c_lib
+
+    print(
+        f"{'N':>7} {'theta':>6} {'order':>6} {'backend':>8} {'median err':>12}"
+        f" {'99% err':>12} {'max err':>12} {'time (s)':>10} {'speedup':>8}"
+    )
+    for objects_count in objects_counts:
+        x, _, m = main.uniform_sphere(objects_count, seed)
+
+        a_reference = None
+        for backend, c_lib in c_libs.items():
+            direct = functools.partial(force_acceleration, c_lib, "direct", x, m, G)
+            a_direct = direct()
+            direct_time = time_per_call(direct)
+            if a_reference is None:
+                a_reference = a_direct
+                a_reference_norm = np.linalg.norm(a_reference, axis=1)
+            print(
+                f"{objects_count:>7} {'-':>6} {'-':>6} {backend:>8} {'direct':>12}"
+                f" {'':>12} {'':>12} {direct_time:>10.4f} {1.0:>8.2f}"
+            )
+
+            for theta in thetas:
+                for order in orders if orders is not None else [None]:
+                    if order is None:
+                        method = functools.partial(
+                            force_acceleration, c_lib, "barnes_hut", x, m, G, theta
+                        )
+                    else:
+                        method = functools.partial(
+                            force_acceleration, c_lib, "fmm", x, m, G, theta, order
+                        )
+                    a = method()
+                    run_time = time_per_call(method)
+
+                    error = np.linalg.norm(a - a_reference, axis=1) / a_reference_norm
+                    print(
+                        f"{objects_count:>7} {theta:>6g}"
+                        f" {order if order is not None else '-':>6} {backend:>8}"
+                        f" {np.median(error):>12.3e} {np.percentile(error, 99):>12.3e}"
+                        f" {np.max(error):>12.3e} {run_time:>10.4f}"
+                        f" {direct_time / run_time:>8.2f}"
+                    )
+
+
+def force_acceleration(c_lib, method, x, m, G, theta=0.5, order=4):
+    """
+    Compute the acceleration with a force method of main.FORCE_METHODS,
+    with c_lib or with numpy if c_lib is None
+
+    :rtype: numpy.ndarray
+    """
+    objects_count = len(m)
+    if c_lib is None:
+        match method:
+            case "direct":
+                return main.direct_acceleration(objects_count, x, m, G)
+            case "barnes_hut":
+                return main.barnes_hut_acceleration(objects_count, x, m, G, theta)
+            case "fmm":
+                return main.fmm_acceleration(objects_count, x, m, G, theta, order)
+
+    a = np.zeros((objects_count, 3))
+    c_lib.set_force_method(main.Simulator.C_LIB_FORCE_METHODS[method], theta, order)
+    c_lib.acceleration(objects_count, x.ctypes.data, a.ctypes.data, m.ctypes.data, G)
+    return a
+
+
+def matrix_report(
+    integrators, backends, scenarios, tolerances, tf_scale=1.0, repeat=1, output=None
+):
+    """
+    Run every integrator x backend x scenario combination to a fixed
+    simulation time, print a table and optionally save the results as JSON.
+    Adaptive step size integrators run once per tolerance, and the
+    WISDOM_HOLMAN_INTEGRATORS only on the HIERARCHICAL_SCENARIOS. The
+    fastest of repeat runs is kept.
+
+    :rtype: list
+    """
+    results = []
+    print(
+        f"{'scenario':>13} {'integrator':>12} {'backend':>8} {'dt / tol':>9}"
+        f" {'steps':>9} {'force evals':>11} {'time (s)':>10} {'energy err':>11}"
+    )
+    for backend in backends:
+        grav_sim = headless.Headless_grav_sim(backend)
+        if not grav_sim.backend.startswith(backend):
+            print(f"System message: {backend} backend is not available, skipped.")
+            continue
+
+        for scenario in scenarios:
+            tf, dt = MATRIX_SCENARIOS[scenario]
+            tf *= tf_scale
+            for integrator in integrators:
+                if (
+                    integrator in WISDOM_HOLMAN_INTEGRATORS
+                    and scenario not in HIERARCHICAL_SCENARIOS
+                ):
+                    print(
+                        f"System message: {integrator} needs a hierarchical "
+                        f"system, {scenario} skipped."
+                    )
+                    continue
+
+                if integrator in FIXED_STEP_SIZE_INTEGRATORS:
+                    cases = [(dt, None)]
+                else:
+                    cases = [(None, tolerance) for tolerance in tolerances]
+
+                for case_dt, tolerance in cases:
+                    # Calls into the integrators in batches of about 1 % of
+                    # the steps, or 100 adaptive steps
+                    if case_dt is not None:
+                        grav_sim.settings.dt = case_dt
+                        grav_sim.settings.time_speed = math.ceil(tf / case_dt / 100)
+                    if tolerance is not None:
+                        grav_sim.settings.tolerance = tolerance
+                    headless.set_batch(grav_sim.settings, 100)
+
+                    best = None
+                    for _ in range(repeat):
+                        grav_sim.set_integrator(integrator)
+                        grav_sim.load_problem(scenario)
+                        result = headless.run(grav_sim, tf)
+                        if best is None or result["wall_time"] < best["wall_time"]:
+                            best = result
+
+                    energy_error = best["energy_error"]
+                    record = {
+                        "scenario": scenario,
+                        "objects_count": best["objects_count"],
+                        "integrator": integrator,
+                        "backend": backend,
+                        "artifact": best["backend"],
+                        "num_threads": grav_sim.simulator.num_threads,
+                        "dt": case_dt,
+                        "tolerance": tolerance,
+                        "tf": tf,
+                        "simulation_time": best["simulation_time"],
+                        "completed": best["simulation_time"] >= tf * (1 - 1e-12),
+                        "steps": best["steps"],
+                        "acceleration_count": best["acceleration_count"],
+                        "wall_time": best["wall_time"],
+                        # NaN is not valid JSON
+                        "energy_error": energy_error if math.isfinite(energy_error) else None,
+                    }
+                    results.append(record)
+                    print(
+                        f"{scenario:>13} {integrator:>12} {backend:>8}"
+                        f" {case_dt if case_dt is not None else tolerance:>9.0e}"
+                        f" {record['steps']:>9} {record['acceleration_count']:>11}"
+                        f" {record['wall_time']:>10.4f} {energy_error:>11.3e}"
+                        + ("" if record["completed"] else " (stopped)")
+                    )
+
+    if output is not None:
+        save_results(output, results, repeat=repeat)
+
+    return results
+
+
+def time_per_call(function, min_time=SCALING_MIN_TIME):
+    """
+    Call function until min_time has passed, at least once
+
+    :return: Mean wall time per call
+    :rtype: float
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        wall_time = time.perf_counter() - start
+        if wall_time >= min_time:
+            return wall_time / calls
+
+
+def scaling_report(
+    objects_counts, backends, problem, integrator, dt=1e-3, seed=0, output=None
+):
+    """
+    Sweep the number of objects of a generated problem and time the force
+    evaluation, the energy computation and the integrator for each backend.
+    The integrator is timed without the energy diagnostics, over about
+    SCALING_MIN_TIME of steps, and reported in body-steps per second.
+
+    :rtype: list
+    """
+    results = []
+    print(
+        f"{'N':>7} {'backend':>8} {'accel (s)':>10} {'energy (s)':>10}"
+        f" {'steps':>6} {'step (s)':>10} {'body-steps/s':>12}"
+    )
+    for backend in backends:
+        grav_sim = headless.Headless_grav_sim(backend)
+        if not grav_sim.backend.startswith(backend):
+            print(f"System message: {backend} backend is not available, skipped.")
+            continue
+
+        simulator = grav_sim.simulator
+        settings = grav_sim.settings
+        settings.dt = dt
+        for objects_count in objects_counts:
+            grav_sim.set_integrator(integrator)
+            grav_sim.load_problem(problem, objects_count, seed)
+            simulator.initialize_problem(grav_sim)
+            simulator.update_force_method()
+
+            if grav_sim.is_c_lib:
+                acceleration = lambda: grav_sim.c_lib.acceleration(
+                    objects_count,
+                    simulator.c_lib_pointer("x", simulator.x),
+                    simulator.c_lib_pointer("a", simulator.a),
+                    simulator.c_lib_pointer("m", simulator.m),
+                    main.Grav_obj.G,
+                )
+            else:
+                acceleration = lambda: main.acceleration(
+                    objects_count, simulator.x, simulator.m, main.Grav_obj.G
+                )
+            acceleration_time = time_per_call(acceleration)
+            energy_time = time_per_call(simulator.compute_total_energy)
+
+            # A single step initializes the integrator and sizes the batch
+            settings.time_speed = 1
+            headless.set_batch(settings, 1)
+            step_time = time_per_call(simulator.integrate, 0.0)
+            steps = max(1, min(settings.MAX_TIME_SPEED, math.ceil(SCALING_MIN_TIME / step_time)))
+            settings.time_speed = steps
+            headless.set_batch(settings, steps)
+            start = time.perf_counter()
+            steps = simulator.integrate()
+            wall_time = time.perf_counter() - start
+
+            record = {
+                "problem": problem,
+                "objects_count": objects_count,
+                "integrator": integrator,
+                "backend": backend,
+                "artifact": grav_sim.backend,
+                "num_threads": simulator.num_threads,
+                "acceleration_time": acceleration_time,
+                "energy_time": energy_time,
+                "steps": steps,
+                "wall_time": wall_time,
+                "body_steps_per_second": objects_count * steps / wall_time,
+            }
+            results.append(record)
+            print(
+                f"{objects_count:>7} {backend:>8} {acceleration_time:>10.3e}"
+                f" {energy_time:>10.3e} {steps:>6} {wall_time / steps:>10.3e}"
+                f" {record['body_steps_per_second']:>12.4g}"
+            )
+
+    if output is not None:
+        save_results(output, results)
+
+    return results
+
+
+def save_results(output, results, **metadata):
+    """Save the results of a benchmark as JSON with the platform details"""
+    with open(output, "w") as file:
+        json.dump(
+            {
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                **metadata,
+                "results": results,
+            },
+            file,
+            indent=4,
+        )
+    print(f"System message: Results saved to {output}.")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    theta_parser = subparsers.add_parser(
+        "theta", help="Barnes-Hut accuracy against the direct sum"
+    )
+    theta_parser.add_argument(
+        "-n", default="5000", help="comma separated numbers of bodies"
+    )
+    theta_parser.add_argument(
+        "--thetas",
+        default="0.0,0.2,0.3,0.5,0.7,1.0",
+        help="comma separated opening angles",
+    )
+    theta_parser.add_argument(
+        "--backends", default="native,numpy", help="comma separated backends"
+    )
+    theta_parser.add_argument("--seed", type=int, default=0)
+
+    fmm_parser = subparsers.add_parser(
+        "fmm", help="Fast multipole method accuracy against the direct sum"
+    )
+    fmm_parser.add_argument(
+        "-n", default="5000", help="comma separated numbers of bodies"
+    )
+    fmm_parser.add_argument(
+        "--thetas", default="0.3,0.5,0.7", help="comma separated opening angles"
+    )
+    fmm_parser.add_argument(
+        "--orders", default="1,2,4,6", help="comma separated expansion orders"
+    )
+    fmm_parser.add_argument(
+        "--backends", default="native,numpy", help="comma separated backends"
+    )
+    fmm_parser.add_argument("--seed", type=int, default=0)
+
+    matrix_parser = subparsers.add_parser(
+        "matrix", help="Every integrator x backend x scenario to a fixed time"
+    )
+    matrix_parser.add_argument(
+        "--integrators",
+        default=",".join(headless.INTEGRATORS),
+        help="comma separated integrators",
+    )
+    matrix_parser.add_argument(
+        "--backends", default="native,numpy", help="comma separated backends"
+    )
+    matrix_parser.add_argument(
+        "--scenarios",
+        default=",".join(MATRIX_SCENARIOS),
+        help="comma separated scenarios",
+    )
+    matrix_parser.add_argument(
+        "--tolerances",
+        default="1e-6,1e-9",
+        help="comma separated tolerances of the adaptive step size integrators",
+    )
+    matrix_parser.add_argument(
+        "--tf-scale",
+        type=float,
+        default=1.0,
+        help="scale the simulation time of every scenario",
+    )
+    matrix_parser.add_argument("--repeat", type=int, default=1)
+    matrix_parser.add_argument("-o", "--output", help="JSON file for the results")
+
+    scaling_parser = subparsers.add_parser(
+        "scaling", help="Throughput against the number of bodies of a generated problem"
+    )
+    scaling_parser.add_argument(
+        "-n", default="100,300,1000,3000", help="comma separated numbers of bodies"
+    )
+    scaling_parser.add_argument(
+        "--problem", choices=list(main.INITIAL_CONDITIONS), default="plummer"
+    )
+    scaling_parser.add_argument(
+        "--backends", default="native,numpy", help="comma separated backends"
+    )
+    scaling_parser.add_argument(
+        "-i", "--integrator", choices=headless.INTEGRATORS, default="leapfrog"
+    )
+    scaling_parser.add_argument(
+        "--dt", type=float, default=1e-3,
+        help="time step of the fixed step size integrators",
+    )
+    scaling_parser.add_argument("--seed", type=int, default=0)
+    scaling_parser.add_argument("-o", "--output", help="JSON file for the results")
+
+    args = parser.parse_args()
+    match args.benchmark:
+        case "theta":
+            theta_report(
+                [int(objects_count) for objects_count in args.n.split(",")],
+                [float(theta) for theta in args.thetas.split(",")],
+                args.backends.split(","),
+                args.seed,
+            )
+        case "fmm":
+            theta_report(
+                [int(objects_count) for objects_count in args.n.split(",")],
+                [float(theta) for theta in args.thetas.split(",")],
+                args.backends.split(","),
+                args.seed,
+                orders=[int(order) for order in args.orders.split(",")],
+            )
+        case "matrix":
+            matrix_report(
+                args.integrators.split(","),
+                args.backends.split(","),
+                args.scenarios.split(","),
+                [float(tolerance) for tolerance in args.tolerances.split(",")],
+                args.tf_scale,
+                args.repeat,
+                args.output,
+            )
+        case "scaling":
+            scaling_report(
+                [int(objects_count) for objects_count in args.n.split(",")],
+                args.backends.split(","),
+                args.problem,
+                args.integrator,
+                args.dt,
+                args.seed,
+                args.output,
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,13 +3,23 @@
  * 
  * To compile this library with Emscripten, use the following command:
  * emcc -O3 -s WASM=1 -s SIDE_MODULE=1 -o c_lib.wasm c_lib.c
+ *
+ * To compile a multi-threaded native library on Linux, use the following command:
+ * gcc -O3 -fopenmp -shared -fPIC -o c_lib.so c_lib.c -lm
+ *
+ * Both are also available as "make wasm" and "make" (see Makefile).
  */
 
+#include <float.h>
 #include <math.h>
 #include <stdlib.h>
 #include <string.h>
 // #include <stdio.h> // For testing
 
+#ifdef _OPENMP
+    #include <omp.h>
+#endif
+
 #ifdef WIN32DLL_EXPORTS
     #define WIN32DLL_API __declspec(dllexport)
 #else
@@ -18,6 +28,76 @@
 
 #define real double
 
+// Force evaluation methods for acceleration(), see set_force_method()
+#define FORCE_METHOD_DIRECT 0
+#define FORCE_METHOD_BARNES_HUT 1
+#define FORCE_METHOD_FMM 2
+
+// Maximum number of objects in a leaf of the octree. The FMM leaves are
+// larger since its near field is cheap compared to the M2L translations
+#define BARNES_HUT_LEAF_SIZE 8
+#define FMM_LEAF_SIZE 32
+// Deeper nodes are turned into leaves, which protects the tree build
+// against (nearly) coincident objects
+#define OCTREE_MAX_DEPTH 64
+
+// Loops over fewer objects run on a single thread, since the overhead
+// of starting the threads would dominate
+#define OPENMP_MIN_OBJECTS 128
+
+// Maximum expansion order of the fast multipole method and the number of
+// Cartesian multi-indices n with |n| <= FMM_MAX_ORDER
+#define FMM_MAX_ORDER 8
+#define FMM_MAX_SIZE 165
+
+// Softening kernels of set_softening()
+#define SOFTENING_NONE 0
+#define SOFTENING_PLUMMER 1
+#define SOFTENING_SPLINE 2
+
+// Newton iterations of the regularized time of ks_kepler_step()
+#define KS_MAX_ITERATION 64
+
+// The spline kernel is Newtonian beyond SPLINE_SOFTENING_RATIO times the
+// softening length, and then has the Plummer potential at zero separation
+#define SPLINE_SOFTENING_RATIO 2.8
+
+typedef struct OctreeNode
+{
+    real com[3];
+    real mass;
+    real size;  // Side length
+    // The node contains the objects octree_index[start:end]
+    int start;
+    int end;
+    int children[8];
+    int children_count;
+} OctreeNode;
+
+/*
+ * Scratch memory of the integrators, created once per problem with
+ * create_workspace() and passed to every call. The buffer only grows,
+ * so the integrators do not allocate memory after the first call.
+ * Passing NULL instead of a workspace allocates a temporary one.
+ */
+typedef struct Workspace
+{
+    real *buffer;
+    size_t capacity;
+    size_t used;
+} Workspace;
+
+// A close pair of the Kustaanheimo-Stiefel regularization, see
+// select_regularized_pairs()
+typedef struct RegularizedPair
+{
+    real r_square;
+    int i;
+    int j;
+} RegularizedPair;
+
+Workspace *create_workspace(int objects_count);
+void free_workspace(Workspace *workspace);
 real abs_max_vec(const real *restrict vec, int vec_length);
 real abs_max_vec_array(const real (*restrict arr)[3], int objects_count);
 real vec_norm(const real *restrict vec, int vec_length);
@@ -28,6 +108,27 @@ real compute_energy(
     const real *restrict m, 
     real G
 );
+real potential_energy(
+    int objects_count, 
+    const real (*restrict x)[3],
+    const real *restrict m, 
+    real G
+);
+int find_collisions(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real *restrict R,
+    int (*restrict pairs)[2],
+    int max_pairs,
+    Workspace *workspace
+);
+void set_num_threads(int num_threads);
+int get_num_threads(void);
+void set_force_method(int method, real theta, int order);
+void set_softening(int kernel, real length);
+void set_regularization(real radius);
+long long get_acceleration_count(void);
+long long get_rejected_step_count(void);
 void acceleration(
     int objects_count, 
     const real (*restrict x)[3], 
@@ -35,6 +136,37 @@ void acceleration(
     const real *restrict m, 
     real G
 );
+real acceleration_potential(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G
+);
+void direct_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G
+);
+void barnes_hut_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    real theta
+);
+void fmm_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    real theta,
+    int order
+);
 void euler(
     int objects_count, 
     real (*restrict x)[3], 
@@ -42,7 +174,8 @@ void euler(
     const real *restrict m, 
     real G, 
     real dt,
-    int time_speed
+    int time_speed,
+    Workspace *workspace
 );
 void euler_cromer(
     int objects_count, 
@@ -51,7 +184,8 @@ void euler_cromer(
     const real *restrict m, 
     real G, 
     real dt,
-    int time_speed
+    int time_speed,
+    Workspace *workspace
 );
 void rk4(
     int objects_count, 
@@ -60,7 +194,8 @@ void rk4(
     const real *restrict m, 
     real G, 
     real dt,
-    int time_speed
+    int time_speed,
+    Workspace *workspace
 );
 void leapfrog(
     int objects_count, 
@@ -70,7 +205,93 @@ void leapfrog(
     const real *restrict m, 
     real G, 
     real dt,
-    int time_speed
+    int time_speed,
+    real *restrict potential,
+    Workspace *workspace
+);
+void leapfrog_composition(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    int stages,
+    const real *restrict drift_coeff,
+    const real *restrict kick_coeff,
+    real *restrict potential
+);
+long long block_leapfrog(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    int *restrict levels,
+    real eta,
+    Workspace *workspace
+);
+void whfast(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    int stages,
+    const real *restrict drift_coeff,
+    const real *restrict kick_coeff,
+    Workspace *workspace
+);
+void acceleration_jerk(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    const real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    real (*restrict jerk)[3], 
+    const real *restrict m, 
+    real G
+);
+void hermite(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    real (*restrict jerk)[3], 
+    const real *restrict m, 
+    real G, 
+    real *restrict t, 
+    real *restrict dt, 
+    real expected_time_scale, 
+    int *restrict count, 
+    real eta,
+    int max_iteration,
+    int min_iteration,
+    Workspace *workspace
+);
+void bulirsch_stoer(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G, 
+    real expected_time_scale,
+    real *restrict t, 
+    real *restrict dt,
+    int *restrict column,
+    int *restrict count,
+    int max_iteration,
+    int min_iteration,
+    real abs_tolerance,
+    real rel_tolerance,
+    Workspace *workspace
 );
 void rk_embedded(
     int objects_count, 
@@ -81,6 +302,7 @@ void rk_embedded(
     real expected_time_scale,
     real *restrict t, 
     real *restrict dt,
+    int *restrict count,
     int power,
     int power_test,
     int len_coeff,
@@ -91,7 +313,8 @@ void rk_embedded(
     int max_iteration,
     int min_iteration,
     real abs_tolerance,
-    real rel_tolerance
+    real rel_tolerance,
+    Workspace *workspace
 );
 void ias15(
     int objects_count, 
@@ -118,7 +341,9 @@ void ias15(
     real exponent,
     int *restrict ias15_refine_flag,
     int max_iteration,
-    int min_iteration
+    int min_iteration,
+    real *restrict potential,
+    Workspace *workspace
 );
 void ias15_step(
     int objects_count,
@@ -152,7 +377,8 @@ void ias15_step(
     real (*restrict a)[3],
     real *restrict delta_b7,
     real *restrict F,
-    real *restrict delta_aux_b
+    real *restrict delta_aux_b,
+    real *restrict potential
 );
 void ias15_approx_pos(
     int objects_count,
@@ -240,6 +466,149 @@ WIN32DLL_API real vec_norm(const real *restrict vec, int vec_length)
     return sqrt(sum);
 }
 
+// Create a workspace with room for the arrays of the fixed step size
+// integrators. It grows on demand for the other integrators.
+WIN32DLL_API Workspace *create_workspace(int objects_count)
+{
+    Workspace *workspace = malloc(sizeof(Workspace));
+    workspace->capacity = (size_t) 11 * objects_count * 3;
+    workspace->buffer = malloc(workspace->capacity * sizeof(real));
+    workspace->used = 0;
+
+    return workspace;
+}
+
+WIN32DLL_API void free_workspace(Workspace *workspace)
+{
+    if (workspace != NULL)
+    {
+        free(workspace->buffer);
+        free(workspace);
+    }
+}
+
+// Make room for size reals and release the previous arrays. Must be
+// called before workspace_alloc(), since growing moves the buffer.
+static void workspace_reserve(Workspace *workspace, size_t size)
+{
+    if (size > workspace->capacity)
+    {
+        free(workspace->buffer);
+        workspace->capacity = size;
+        workspace->buffer = malloc(size * sizeof(real));
+    }
+    workspace->used = 0;
+}
+
+static void *workspace_alloc(Workspace *workspace, size_t size)
+{
+    real *array = &workspace->buffer[workspace->used];
+    workspace->used += size;
+
+    return array;
+}
+
+static int softening_kernel = SOFTENING_NONE;
+static real softening_length = 0.0;
+
+/*
+ * Softened 1 / r^3 of a pair at the squared separation r_square, so that
+ * the acceleration is -G m R / r^3. The spline kernel is the one of
+ * Monaghan & Lattanzio (1985) as in GADGET-2 (Springel 2005).
+ */
+static inline real softened_inv_r3(real r_square)
+{
+    switch (softening_kernel)
+    {
+        case SOFTENING_PLUMMER:
+        {
+            real s_square = r_square + softening_length * softening_length;
+            return 1.0 / (s_square * sqrt(s_square));
+        }
+        case SOFTENING_SPLINE:
+        {
+            real h = SPLINE_SOFTENING_RATIO * softening_length;
+            real r = sqrt(r_square);
+            if (r >= h)
+            {
+                return 1.0 / (r_square * r);
+            }
+            real u = r / h;
+            real h_inv_cube = 1.0 / (h * h * h);
+            if (u < 0.5)
+            {
+                return h_inv_cube * (32.0 / 3.0 + u * u * (32.0 * u - 38.4));
+            }
+            return h_inv_cube * (
+                64.0 / 3.0 - 48.0 * u + 38.4 * u * u - 32.0 / 3.0 * u * u * u
+                - 1.0 / (15.0 * u * u * u)
+            );
+        }
+        default:
+            return 1.0 / (r_square * sqrt(r_square));
+    }
+}
+
+// Softened 1 / r of a pair, so that the potential energy is -G m_1 m_2 / r
+static inline real softened_inv_r(real r_square)
+{
+    switch (softening_kernel)
+    {
+        case SOFTENING_PLUMMER:
+            return 1.0 / sqrt(r_square + softening_length * softening_length);
+        case SOFTENING_SPLINE:
+        {
+            real h = SPLINE_SOFTENING_RATIO * softening_length;
+            real r = sqrt(r_square);
+            if (r >= h)
+            {
+                return 1.0 / r;
+            }
+            real u = r / h;
+            if (u < 0.5)
+            {
+                return (2.8 - u * u * (16.0 / 3.0 + u * u * (6.4 * u - 9.6))) / h;
+            }
+            return (
+                3.2 - 1.0 / (15.0 * u)
+                - u * u * (32.0 / 3.0 + u * (-16.0 + u * (9.6 - 32.0 / 15.0 * u)))
+            ) / h;
+        }
+        default:
+            return 1.0 / sqrt(r_square);
+    }
+}
+
+/*
+ * Factor g of the jerk -G m / r^3 (V - g (R . V) R) of a pair, given
+ * inv_r3 = softened_inv_r3(r_square). It is 3 / r^2 without softening.
+ */
+static inline real softened_jerk_factor(real r_square, real inv_r3)
+{
+    switch (softening_kernel)
+    {
+        case SOFTENING_PLUMMER:
+            return 3.0 / (r_square + softening_length * softening_length);
+        case SOFTENING_SPLINE:
+        {
+            real h = SPLINE_SOFTENING_RATIO * softening_length;
+            if (r_square >= h * h)
+            {
+                return 3.0 / r_square;
+            }
+            real u = sqrt(r_square) / h;
+            real h_inv_5 = 1.0 / (h * h * h * h * h);
+            if (u < 0.5)
+            {
+                return h_inv_5 * (76.8 - 96.0 * u) / inv_r3;
+            }
+            return h_inv_5 * (48.0 - 76.8 * u + 32.0 * u * u - 0.2 / (u * u * u * u)) / (u * inv_r3);
+        }
+        default:
+            return 3.0 / r_square;
+    }
+}
+
 WIN32DLL_API real compute_energy(
     int objects_count, 
     const real (*restrict x)[3],
@@ -248,25 +617,34 @@ WIN32DLL_API real compute_energy(
     real G
 )
 {
-    real temp_vec[3], energy = 0.0, norm;
+    real energy = 0.0;
+
+    // KE
+    for (int i = 0; i < objects_count; i++)
+    {
+        energy += 0.5 * m[i] * (v[i][0] * v[i][0] + v[i][1] * v[i][1] + v[i][2] * v[i][2]);
+    }
+
+    return energy + potential_energy(objects_count, x, m, G);
+}
+
+// Return the potential energy, or NaN if two objects have the same position
+// without softening
+WIN32DLL_API real potential_energy(
+    int objects_count, 
+    const real (*restrict x)[3],
+    const real *restrict m, 
+    real G
+)
+{
+    real energy = 0.0;
+    int is_nan = 0;
 
+    #pragma omp parallel for schedule(dynamic, 16) reduction(+:energy) reduction(|:is_nan) if (objects_count >= OPENMP_MIN_OBJECTS)
     for (int i = 0; i < objects_count; i++)
     {   
-        // KE
-        norm = vec_norm(v[i], 3);
-        if (norm != 0)
-        {
-            energy += (
-                0.5 * m[i] 
-                * pow(norm, 2)
-            );
-        }
-        else
-        {
-            return NAN;
-        }
+        real temp_vec[3], norm_square;
 
-        // PE
         for (int j = i + 1; j < objects_count; j++)
         {
             temp_vec[0] = (
@@ -282,265 +660,2590 @@ WIN32DLL_API real compute_energy(
                 - x[j][2]
             );
 
-            norm = vec_norm(temp_vec, 3);
-            if (norm != 0)
+            norm_square = temp_vec[0] * temp_vec[0] + temp_vec[1] * temp_vec[1] + temp_vec[2] * temp_vec[2];
+            if (norm_square != 0 || softening_kernel != SOFTENING_NONE)
             {
                 energy -= (
                     G * m[i] * m[j]
-                    / norm
+                    * softened_inv_r(norm_square)
                 );
             }
             else
             {
-                return NAN;
+                is_nan = 1;
+            }
+        }
+    }
+
+    if (is_nan)
+    {
+        return NAN;
+    }
+
+    return energy;
+}
+
+// Spatial hash of a grid cell, with the primes of Teschner et al. (2003)
+static inline unsigned long long collision_cell_key(const long long *cell)
+{
+    return (
+        ((unsigned long long) cell[0] * 73856093ULL)
+        ^ ((unsigned long long) cell[1] * 19349663ULL)
+        ^ ((unsigned long long) cell[2] * 83492791ULL)
+    );
+}
+
+/*
+ * Find the pairs of overlapping objects, |x_i - x_j| < R_i + R_j, as
+ * find_collisions() in main.py. The objects are counting sorted into a hash
+ * table of grid cells as large as the largest diameter, and only the
+ * buckets of the neighbouring cells of each object are searched. The first
+ * max_pairs pairs i < j are written to pairs.
+ *
+ * Return the number of overlapping pairs, which may exceed max_pairs.
+ */
+WIN32DLL_API int find_collisions(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real *restrict R,
+    int (*restrict pairs)[2],
+    int max_pairs,
+    Workspace *workspace
+)
+{
+    real R_max = 0.0;
+    for (int i = 0; i < objects_count; i++)
+    {
+        if (R[i] > R_max)
+        {
+            R_max = R[i];
+        }
+    }
+    if (objects_count < 2 || !(R_max > 0.0))
+    {
+        return 0;
+    }
+    real cell_size = 2.0 * R_max;
+
+    int table_size = 1;
+    while (table_size < 2 * objects_count)
+    {
+        table_size *= 2;
+    }
+
+    // The integer arrays take one real per element
+    workspace_reserve(workspace, (size_t) objects_count * 5 + table_size + 1);
+    long long (*cells)[3] = workspace_alloc(workspace, objects_count * 3);
+    int *bucket = workspace_alloc(workspace, objects_count);
+    int *sorted = workspace_alloc(workspace, objects_count);
+    int *bucket_start = workspace_alloc(workspace, table_size + 1);
+
+    memset(bucket_start, 0, (table_size + 1) * sizeof(int));
+    for (int i = 0; i < objects_count; i++)
+    {
+        for (int k = 0; k < 3; k++)
+        {
+            real cell = floor(x[i][k] / cell_size);
+            // Keep the cell in the range of long long
+            cell = fmax(-4503599627370496.0, fmin(4503599627370496.0, cell));
+            cells[i][k] = (long long) cell;
+        }
+        bucket[i] = (int) (collision_cell_key(cells[i]) & (table_size - 1));
+        bucket_start[bucket[i] + 1]++;
+    }
+    for (int b = 0; b < table_size; b++)
+    {
+        bucket_start[b + 1] += bucket_start[b];
+    }
+    // Counting sort, with bucket_start shifted back by one bucket afterwards
+    for (int i = 0; i < objects_count; i++)
+    {
+        sorted[bucket_start[bucket[i]]++] = i;
+    }
+    for (int b = table_size; b > 0; b--)
+    {
+        bucket_start[b] = bucket_start[b - 1];
+    }
+    bucket_start[0] = 0;
+
+    int count = 0;
+    for (int i = 0; i < objects_count; i++)
+    {
+        // The cell itself and 13 of its neighbours, one of each opposite pair
+        for (int offset = 13; offset < 27; offset++)
+        {
+            long long cell[3] = {
+                cells[i][0] + offset / 9 - 1,
+                cells[i][1] + (offset / 3) % 3 - 1,
+                cells[i][2] + offset % 3 - 1,
+            };
+            int b = (int) (collision_cell_key(cell) & (table_size - 1));
+            for (int k = bucket_start[b]; k < bucket_start[b + 1]; k++)
+            {
+                int j = sorted[k];
+                // Other cells may share the bucket
+                if (
+                    cells[j][0] != cell[0] || cells[j][1] != cell[1] || cells[j][2] != cell[2]
+                    || (offset == 13 && j <= i)
+                )
+                {
+                    continue;
+                }
+
+                real R_ij[3] = {x[j][0] - x[i][0], x[j][1] - x[i][1], x[j][2] - x[i][2]};
+                real R_sum = R[i] + R[j];
+                if (R_ij[0] * R_ij[0] + R_ij[1] * R_ij[1] + R_ij[2] * R_ij[2] < R_sum * R_sum)
+                {
+                    if (count < max_pairs)
+                    {
+                        pairs[count][0] = i < j ? i : j;
+                        pairs[count][1] = i < j ? j : i;
+                    }
+                    count++;
+                }
+            }
+        }
+    }
+
+    return count;
+}
+
+static int force_method = FORCE_METHOD_DIRECT;
+static real opening_angle = 0.5;
+static int fmm_order = 4;
+
+// Number of calls to acceleration(), for benchmarks
+static long long acceleration_count = 0;
+
+// Number of steps rejected by the adaptive step size integrators
+static long long rejected_step_count = 0;
+
+// Octree buffers for the tree methods. They only grow, so repeated
+// force evaluations do not allocate memory.
+static OctreeNode *octree_nodes = NULL;
+static int octree_nodes_capacity = 0;
+static int octree_nodes_count = 0;
+static int *octree_index = NULL;
+static int *octree_temp_index = NULL;
+static int octree_objects_capacity = 0;
+
+// Radius of the Kustaanheimo-Stiefel regularization of leapfrog() and
+// leapfrog_composition(), see set_regularization()
+static real regularization_radius = 0.0;
+
+// Buffers of select_regularized_pairs(). They only grow.
+static real *regularization_R = NULL;
+static int *regularization_partner = NULL;
+static int regularization_objects_capacity = 0;
+static Workspace *regularization_workspace = NULL;
+static int (*regularization_candidates)[2] = NULL;
+static RegularizedPair *regularized_pairs = NULL;
+static int regularization_pairs_capacity = 0;
+
+#ifdef _OPENMP
+// Thread-private accumulators of direct_acceleration_potential()
+static real *thread_a = NULL;
+static size_t thread_a_capacity = 0;
+#endif
+
+// Set the number of threads used by the parallel kernels
+WIN32DLL_API void set_num_threads(int num_threads)
+{
+#ifdef _OPENMP
+    omp_set_num_threads(num_threads);
+#else
+    (void) num_threads;
+#endif
+}
+
+// Return the number of threads used by the parallel kernels, which is
+// 1 if the library is compiled without OpenMP
+WIN32DLL_API int get_num_threads(void)
+{
+#ifdef _OPENMP
+    return omp_get_max_threads();
+#else
+    return 1;
+#endif
+}
+
+// Select the force evaluation method used by acceleration()
+WIN32DLL_API void set_force_method(int method, real theta, int order)
+{
+    force_method = method;
+    opening_angle = theta;
+    fmm_order = order;
+}
+
+// Select the softening of the pair interactions of every force and energy
+// kernel. A zero length turns the softening off.
+WIN32DLL_API void set_softening(int kernel, real length)
+{
+    softening_kernel = length > 0.0 ? kernel : SOFTENING_NONE;
+    softening_length = length;
+}
+
+// Select the radius of the Kustaanheimo-Stiefel regularization, see
+// select_regularized_pairs(). It is off with softening or a zero radius.
+WIN32DLL_API void set_regularization(real radius)
+{
+    regularization_radius = radius;
+}
+
+WIN32DLL_API long long get_acceleration_count(void)
+{
+    return acceleration_count;
+}
+
+WIN32DLL_API long long get_rejected_step_count(void)
+{
+    return rejected_step_count;
+}
+
+WIN32DLL_API void acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G
+)
+{
+    acceleration_count++;
+    switch (force_method)
+    {
+        case FORCE_METHOD_BARNES_HUT:
+            barnes_hut_acceleration(objects_count, x, a, m, G, opening_angle);
+            break;
+        case FORCE_METHOD_FMM:
+            fmm_acceleration(objects_count, x, a, m, G, opening_angle, fmm_order);
+            break;
+        default:
+            direct_acceleration(objects_count, x, a, m, G);
+            break;
+    }
+}
+
+// Accumulate the interactions of object i with the objects j > i and
+// return their potential energy if is_potential is set
+static inline real direct_acceleration_row(
+    int i,
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    int is_potential
+)
+{
+    real R_norm_square, temp_value, temp_vec[3], R[3];
+    real potential = 0.0;
+
+    for(int j = i + 1; j < objects_count; j++)
+    {
+        // Calculate \vec{R} and its norm
+        R[0] = x[i][0] - x[j][0];
+        R[1] = x[i][1] - x[j][1];
+        R[2] = x[i][2] - x[j][2];
+        R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+
+        // Calculate the acceleration
+        temp_value = G * softened_inv_r3(R_norm_square);
+        temp_vec[0] = temp_value * R[0];
+        temp_vec[1] = temp_value * R[1];
+        temp_vec[2] = temp_value * R[2];
+        a[i][0] -= temp_vec[0] * m[j];
+        a[i][1] -= temp_vec[1] * m[j];
+        a[i][2] -= temp_vec[2] * m[j];
+        a[j][0] += temp_vec[0] * m[i];
+        a[j][1] += temp_vec[1] * m[i];
+        a[j][2] += temp_vec[2] * m[i];
+
+        if (is_potential)
+        {
+            if (softening_kernel == SOFTENING_NONE)
+            {
+                // G / R from the same separation
+                potential -= temp_value * R_norm_square * m[j];
+            }
+            else
+            {
+                potential -= G * softened_inv_r(R_norm_square) * m[j];
+            }
+        }
+    }
+
+    return potential * m[i];
+}
+
+// Direct sum of the acceleration, which also returns the potential energy
+// if is_potential is set. The calls with a constant is_potential are
+// inlined without the extra work when it is not set.
+static inline real direct_acceleration_potential(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    int is_potential
+)
+{   
+    real potential = 0.0;
+
+    // Empty the input array
+    memset(a, 0, objects_count * 3 * sizeof(real));
+
+#ifdef _OPENMP
+    // Every thread accumulates into its own array, which are summed up at
+    // the end, so the pairs (i, j) can be split across threads
+    int max_threads = omp_get_max_threads();
+    if (max_threads > 1 && objects_count >= OPENMP_MIN_OBJECTS)
+    {
+        size_t size = (size_t) max_threads * objects_count * 3;
+        if (size > thread_a_capacity)
+        {
+            free(thread_a);
+            thread_a = malloc(size * sizeof(real));
+            thread_a_capacity = size;
+        }
+
+        #pragma omp parallel
+        {
+            int threads_count = omp_get_num_threads();
+            real (*restrict a_thread)[3] = (real (*)[3]) &thread_a[(size_t) omp_get_thread_num() * objects_count * 3];
+            memset(a_thread, 0, objects_count * 3 * sizeof(real));
+
+            // The rows get shorter with i, so they are handed out dynamically
+            #pragma omp for schedule(dynamic, 16) reduction(+:potential)
+            for (int i = 0; i < objects_count; i++)
+            {
+                potential += direct_acceleration_row(i, objects_count, x, a_thread, m, G, is_potential);
+            }
+
+            #pragma omp for
+            for (int i = 0; i < objects_count; i++)
+            {
+                for (int thread = 0; thread < threads_count; thread++)
+                {
+                    const real *restrict a_i = &thread_a[((size_t) thread * objects_count + i) * 3];
+                    a[i][0] += a_i[0];
+                    a[i][1] += a_i[1];
+                    a[i][2] += a_i[2];
+                }
+            }
+        }
+        return potential;
+    }
+#endif
+
+    for(int i = 0; i < objects_count; i++)
+    {
+        potential += direct_acceleration_row(i, objects_count, x, a, m, G, is_potential);
+    }
+
+    return potential;
+}
+
+WIN32DLL_API void direct_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G
+)
+{
+    direct_acceleration_potential(objects_count, x, a, m, G, 0);
+}
+
+// acceleration() that also returns the potential energy. The direct sum
+// computes both in one pass over the pairs, the tree methods need a
+// separate pass for the potential energy.
+WIN32DLL_API real acceleration_potential(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G
+)
+{
+    if (force_method == FORCE_METHOD_DIRECT)
+    {
+        acceleration_count++;
+        return direct_acceleration_potential(objects_count, x, a, m, G, 1);
+    }
+
+    acceleration(objects_count, x, a, m, G);
+    return potential_energy(objects_count, x, m, G);
+}
+
+static int octree_new_node(void)
+{
+    if (octree_nodes_count == octree_nodes_capacity)
+    {
+        octree_nodes_capacity = (octree_nodes_capacity > 0) ? 2 * octree_nodes_capacity : 1024;
+        octree_nodes = realloc(octree_nodes, octree_nodes_capacity * sizeof(OctreeNode));
+    }
+
+    return octree_nodes_count++;
+}
+
+static int octree_octant(const real *restrict pos, const real *restrict center)
+{
+    return (pos[0] >= center[0]) + 2 * (pos[1] >= center[1]) + 4 * (pos[2] >= center[2]);
+}
+
+// Build the subtree of node with the objects octree_index[start:end]
+static void octree_build(
+    int node,
+    const real (*restrict x)[3],
+    const real *restrict m,
+    int start,
+    int end,
+    const real *restrict center,
+    real half,
+    int depth,
+    int leaf_size
+)
+{
+    // Compute mass and center of mass
+    real mass = 0.0, com[3] = {0.0, 0.0, 0.0};
+    for (int i = start; i < end; i++)
+    {
+        int j = octree_index[i];
+        mass += m[j];
+        com[0] += m[j] * x[j][0];
+        com[1] += m[j] * x[j][1];
+        com[2] += m[j] * x[j][2];
+    }
+    if (mass > 0.0)
+    {
+        com[0] /= mass;
+        com[1] /= mass;
+        com[2] /= mass;
+    }
+    else
+    {
+        memcpy(com, center, 3 * sizeof(real));
+    }
+
+    // Note: octree_new_node() may move octree_nodes, so the node is
+    // always accessed by its index
+    memcpy(octree_nodes[node].com, com, 3 * sizeof(real));
+    octree_nodes[node].mass = mass;
+    octree_nodes[node].size = 2.0 * half;
+    octree_nodes[node].start = start;
+    octree_nodes[node].end = end;
+    octree_nodes[node].children_count = 0;
+
+    if (end - start <= leaf_size || depth >= OCTREE_MAX_DEPTH)
+    {
+        return;
+    }
+
+    // Sort the objects by octant
+    int counts[8] = {0}, offsets[8];
+    for (int i = start; i < end; i++)
+    {
+        counts[octree_octant(x[octree_index[i]], center)]++;
+    }
+    offsets[0] = start;
+    for (int i = 1; i < 8; i++)
+    {
+        offsets[i] = offsets[i - 1] + counts[i - 1];
+    }
+    for (int i = start; i < end; i++)
+    {
+        int j = octree_index[i];
+        octree_temp_index[offsets[octree_octant(x[j], center)]++] = j;
+    }
+    memcpy(&octree_index[start], &octree_temp_index[start], (end - start) * sizeof(int));
+
+    // Build the children
+    int child_start = start;
+    real child_center[3];
+    for (int i = 0; i < 8; i++)
+    {
+        if (counts[i] == 0)
+        {
+            continue;
+        }
+        child_center[0] = center[0] + ((i & 1) ? 0.5 : -0.5) * half;
+        child_center[1] = center[1] + (((i >> 1) & 1) ? 0.5 : -0.5) * half;
+        child_center[2] = center[2] + (((i >> 2) & 1) ? 0.5 : -0.5) * half;
+
+        int child = octree_new_node();
+        octree_nodes[node].children[octree_nodes[node].children_count++] = child;
+        octree_build(child, x, m, child_start, child_start + counts[i], child_center, 0.5 * half, depth + 1, leaf_size);
+        child_start += counts[i];
+    }
+}
+
+// Build the octree of all objects, with the root at octree_nodes[0]
+static void octree_construct(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real *restrict m,
+    int leaf_size
+)
+{
+    if (objects_count > octree_objects_capacity)
+    {
+        octree_objects_capacity = objects_count;
+        octree_index = realloc(octree_index, objects_count * sizeof(int));
+        octree_temp_index = realloc(octree_temp_index, objects_count * sizeof(int));
+    }
+
+    // Bounding cube of the root node
+    real x_min[3], x_max[3], center[3], half = 0.0;
+    memcpy(x_min, x[0], 3 * sizeof(real));
+    memcpy(x_max, x[0], 3 * sizeof(real));
+    for (int i = 0; i < objects_count; i++)
+    {
+        octree_index[i] = i;
+        for (int k = 0; k < 3; k++)
+        {
+            x_min[k] = fmin(x_min[k], x[i][k]);
+            x_max[k] = fmax(x_max[k], x[i][k]);
+        }
+    }
+    for (int k = 0; k < 3; k++)
+    {
+        center[k] = 0.5 * (x_min[k] + x_max[k]);
+        half = fmax(half, 0.5 * (x_max[k] - x_min[k]));
+    }
+    half = half * (1.0 + 1e-10) + 1e-300;
+
+    octree_nodes_count = 0;
+    octree_build(octree_new_node(), x, m, 0, objects_count, center, half, 0, leaf_size);
+}
+
+/*
+ * Calculate acceleration with the Barnes-Hut tree code
+ * A node of side length s at distance d from the center of mass
+ * is treated as a point mass if s / d < theta
+ *
+ * Reference: Barnes & Hut (1986), Nature 324, 446
+ */
+WIN32DLL_API void barnes_hut_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    real theta
+)
+{
+    memset(a, 0, objects_count * 3 * sizeof(real));
+    if (objects_count < 2)
+    {
+        return;
+    }
+
+    octree_construct(objects_count, x, m, BARNES_HUT_LEAF_SIZE);
+
+    // Walk the tree for every object, in tree order for better cache locality
+    real theta_square = theta * theta;
+    #pragma omp parallel for schedule(dynamic, 64) if (objects_count >= OPENMP_MIN_OBJECTS)
+    for (int ii = 0; ii < objects_count; ii++)
+    {
+        int stack[8 * (OCTREE_MAX_DEPTH + 1)];
+        int i = octree_index[ii];
+        real a_i[3] = {0.0, 0.0, 0.0}, R[3], R_norm_square, temp_value;
+        int stack_size = 0;
+        stack[stack_size++] = 0;
+        while (stack_size > 0)
+        {
+            const OctreeNode *restrict node = &octree_nodes[stack[--stack_size]];
+
+            // Leaf: direct summation
+            if (node->children_count == 0)
+            {
+                for (int k = node->start; k < node->end; k++)
+                {
+                    int j = octree_index[k];
+                    if (j == i)
+                    {
+                        continue;
+                    }
+                    R[0] = x[i][0] - x[j][0];
+                    R[1] = x[i][1] - x[j][1];
+                    R[2] = x[i][2] - x[j][2];
+                    R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+                    temp_value = m[j] * softened_inv_r3(R_norm_square);
+                    a_i[0] -= temp_value * R[0];
+                    a_i[1] -= temp_value * R[1];
+                    a_i[2] -= temp_value * R[2];
+                }
+                continue;
+            }
+
+            R[0] = x[i][0] - node->com[0];
+            R[1] = x[i][1] - node->com[1];
+            R[2] = x[i][2] - node->com[2];
+            R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+            int is_inside = (ii >= node->start && ii < node->end);
+
+            if (!is_inside && node->size * node->size < theta_square * R_norm_square)
+            {
+                temp_value = node->mass * softened_inv_r3(R_norm_square);
+                a_i[0] -= temp_value * R[0];
+                a_i[1] -= temp_value * R[1];
+                a_i[2] -= temp_value * R[2];
+            }
+            else
+            {
+                for (int k = 0; k < node->children_count; k++)
+                {
+                    stack[stack_size++] = node->children[k];
+                }
+            }
+        }
+
+        a[i][0] = G * a_i[0];
+        a[i][1] = G * a_i[1];
+        a[i][2] = G * a_i[2];
+    }
+}
+
+// Number of (n, k) pairs with k <= n, |n| <= FMM_MAX_ORDER, which bounds
+// the number of terms of every FMM translation
+#define FMM_MAX_TERMS 3003
+
+typedef struct FMMTerm
+{
+    // out[out_idx] += coef * in[in_idx] * power[power_idx]
+    int out_idx;
+    int in_idx;
+    int power_idx;
+    real coef;
+} FMMTerm;
+
+// Index tables of the Cartesian multi-indices for fmm_acceleration(),
+// rebuilt by fmm_tables() when the order changes
+static int fmm_tables_order = -1;
+static int fmm_size;
+static int fmm_lookup[FMM_MAX_ORDER + 1][FMM_MAX_ORDER + 1][FMM_MAX_ORDER + 1];
+static int fmm_norm[FMM_MAX_SIZE];
+static real fmm_parity[FMM_MAX_SIZE];
+// y^n = y^(n - e_i) * y_i with i = fmm_power_axis[n]
+static int fmm_power_parent[FMM_MAX_SIZE];
+static int fmm_power_axis[FMM_MAX_SIZE];
+// Indices of n - e_i and n - 2 e_i for the recurrence of the Taylor coefficients
+static int fmm_first[FMM_MAX_SIZE][3];
+static int fmm_second[FMM_MAX_SIZE][3];
+static FMMTerm fmm_m2m[FMM_MAX_TERMS], fmm_m2l[FMM_MAX_TERMS], fmm_l2l[FMM_MAX_TERMS];
+static FMMTerm fmm_gradient[3 * FMM_MAX_SIZE];
+static int fmm_m2m_count, fmm_m2l_count, fmm_l2l_count, fmm_gradient_count;
+
+// Expansions of the octree nodes, fmm_size reals per node
+static real *fmm_multipoles = NULL;
+static real *fmm_locals = NULL;
+static size_t fmm_expansions_capacity = 0;
+static real *fmm_radius = NULL;
+static int fmm_nodes_capacity = 0;
+
+static int fmm_binomial(int n, int k)
+{
+    int result = 1;
+    for (int i = 1; i <= k; i++)
+    {
+        result = result * (n - k + i) / i;
+    }
+    return result;
+}
+
+static void fmm_tables(int order)
+{
+    int n[FMM_MAX_SIZE][3];
+    fmm_size = 0;
+    for (int norm = 0; norm <= order; norm++)
+    {
+        for (int i = norm; i >= 0; i--)
+        {
+            for (int j = norm - i; j >= 0; j--)
+            {
+                n[fmm_size][0] = i;
+                n[fmm_size][1] = j;
+                n[fmm_size][2] = norm - i - j;
+                fmm_lookup[i][j][norm - i - j] = fmm_size;
+                fmm_norm[fmm_size] = norm;
+                fmm_parity[fmm_size] = (norm % 2 == 0) ? 1.0 : -1.0;
+                fmm_size++;
+            }
+        }
+    }
+
+    for (int idx = 1; idx < fmm_size; idx++)
+    {
+        for (int i = 0; i < 3; i++)
+        {
+            int shifted[3] = {n[idx][0], n[idx][1], n[idx][2]};
+            shifted[i] -= 1;
+            fmm_first[idx][i] = (shifted[i] >= 0) ? fmm_lookup[shifted[0]][shifted[1]][shifted[2]] : -1;
+            if (shifted[i] >= 0)
+            {
+                fmm_power_parent[idx] = fmm_first[idx][i];
+                fmm_power_axis[idx] = i;
+            }
+            shifted[i] -= 1;
+            fmm_second[idx][i] = (shifted[i] >= 0) ? fmm_lookup[shifted[0]][shifted[1]][shifted[2]] : -1;
+        }
+    }
+
+    // The expansions are centered at the center of mass, so the dipole terms
+    // of the multipoles vanish and are skipped
+    fmm_m2m_count = 0;
+    fmm_m2l_count = 0;
+    fmm_l2l_count = 0;
+    for (int idx_n = 0; idx_n < fmm_size; idx_n++)
+    {
+        const int *restrict ni = n[idx_n];
+        for (int idx_k = 0; idx_k < fmm_size; idx_k++)
+        {
+            const int *restrict k = n[idx_k];
+            if (k[0] <= ni[0] && k[1] <= ni[1] && k[2] <= ni[2])
+            {
+                int power_idx = fmm_lookup[ni[0] - k[0]][ni[1] - k[1]][ni[2] - k[2]];
+                real coef = fmm_binomial(ni[0], k[0]) * fmm_binomial(ni[1], k[1]) * fmm_binomial(ni[2], k[2]);
+
+                // Q_n += C(n, k) Q_k d^(n - k)
+                if (fmm_norm[idx_k] != 1)
+                {
+                    fmm_m2m[fmm_m2m_count++] = (FMMTerm) {idx_n, idx_k, power_idx, coef};
+                }
+                // L_k += C(n, k) L_n d^(n - k)
+                fmm_l2l[fmm_l2l_count++] = (FMMTerm) {idx_k, idx_n, power_idx, coef};
+            }
+            if (fmm_norm[idx_n] + fmm_norm[idx_k] <= order && fmm_norm[idx_n] != 1)
+            {
+                // L_k += (-1)^|n| C(n + k, k) Q_n T_(n + k)
+                real coef = fmm_parity[idx_n];
+                for (int i = 0; i < 3; i++)
+                {
+                    coef *= fmm_binomial(ni[i] + k[i], k[i]);
+                }
+                fmm_m2l[fmm_m2l_count++] = (FMMTerm) {
+                    idx_k, idx_n, fmm_lookup[ni[0] + k[0]][ni[1] + k[1]][ni[2] + k[2]], coef
+                };
+            }
+        }
+    }
+
+    // Gradient of the local expansion: dL/dy_i = sum_k k_i L_k y^(k - e_i)
+    fmm_gradient_count = 0;
+    for (int idx = 1; idx < fmm_size; idx++)
+    {
+        for (int i = 0; i < 3; i++)
+        {
+            if (n[idx][i] >= 1)
+            {
+                fmm_gradient[fmm_gradient_count++] = (FMMTerm) {i, idx, fmm_first[idx][i], n[idx][i]};
+            }
+        }
+    }
+
+    fmm_tables_order = order;
+}
+
+// Compute the monomials y^n
+static void fmm_powers(const real *restrict y, real *restrict powers)
+{
+    powers[0] = 1.0;
+    for (int idx = 1; idx < fmm_size; idx++)
+    {
+        powers[idx] = powers[fmm_power_parent[idx]] * y[fmm_power_axis[idx]];
+    }
+}
+
+/*
+ * Compute the Taylor coefficients T_n = D^n (1 / r) / n! at R by
+ * |n| r^2 T_n = -(2|n| - 1) sum_i R_i T_(n - e_i) - (|n| - 1) sum_i T_(n - 2 e_i)
+ */
+static void fmm_derivatives(const real *restrict R, real *restrict T)
+{
+    real R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+    T[0] = 1.0 / sqrt(R_norm_square);
+    for (int idx = 1; idx < fmm_size; idx++)
+    {
+        int norm = fmm_norm[idx];
+        real value = 0.0;
+        for (int i = 0; i < 3; i++)
+        {
+            if (fmm_first[idx][i] >= 0)
+            {
+                value += R[i] * T[fmm_first[idx][i]];
+            }
+        }
+        value *= 2 * norm - 1;
+        for (int i = 0; i < 3; i++)
+        {
+            if (fmm_second[idx][i] >= 0)
+            {
+                value += (norm - 1) * T[fmm_second[idx][i]];
+            }
+        }
+        T[idx] = -value / (norm * R_norm_square);
+    }
+}
+
+// Apply the translation terms out += sum coef * in * powers
+static void fmm_translate(
+    const FMMTerm *restrict terms,
+    int terms_count,
+    const real *restrict in,
+    const real *restrict powers,
+    real *restrict out
+)
+{
+    for (int i = 0; i < terms_count; i++)
+    {
+        out[terms[i].out_idx] += terms[i].coef * in[terms[i].in_idx] * powers[terms[i].power_idx];
+    }
+}
+
+// Direct summation between two leaves, in both directions if they differ
+static void fmm_near_field(
+    const OctreeNode *restrict node_1,
+    const OctreeNode *restrict node_2,
+    const real (*restrict x)[3],
+    real (*restrict a)[3],
+    const real *restrict m
+)
+{
+    real R[3], R_norm_square, temp_value;
+    for (int ii = node_1->start; ii < node_1->end; ii++)
+    {
+        int i = octree_index[ii];
+        int jj_start = (node_1 == node_2) ? ii + 1 : node_2->start;
+        for (int jj = jj_start; jj < node_2->end; jj++)
+        {
+            int j = octree_index[jj];
+            R[0] = x[i][0] - x[j][0];
+            R[1] = x[i][1] - x[j][1];
+            R[2] = x[i][2] - x[j][2];
+            R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+            temp_value = softened_inv_r3(R_norm_square);
+            a[i][0] -= temp_value * m[j] * R[0];
+            a[i][1] -= temp_value * m[j] * R[1];
+            a[i][2] -= temp_value * m[j] * R[2];
+            a[j][0] += temp_value * m[i] * R[0];
+            a[j][1] += temp_value * m[i] * R[1];
+            a[j][2] += temp_value * m[i] * R[2];
+        }
+    }
+}
+
+// Dual tree walk over the unordered node pairs. Every accepted pair
+// interacts in both directions.
+static void fmm_interact(
+    int node_1,
+    int node_2,
+    const real (*restrict x)[3],
+    real (*restrict a)[3],
+    const real *restrict m,
+    real theta
+)
+{
+    const OctreeNode *restrict node_1_ptr = &octree_nodes[node_1];
+    const OctreeNode *restrict node_2_ptr = &octree_nodes[node_2];
+
+    // Open a node on itself into the pairs of its children
+    if (node_1 == node_2)
+    {
+        if (node_1_ptr->children_count == 0)
+        {
+            fmm_near_field(node_1_ptr, node_1_ptr, x, a, m);
+            return;
+        }
+        for (int i = 0; i < node_1_ptr->children_count; i++)
+        {
+            for (int j = i; j < node_1_ptr->children_count; j++)
+            {
+                fmm_interact(node_1_ptr->children[i], node_1_ptr->children[j], x, a, m, theta);
+            }
+        }
+        return;
+    }
+
+    real R[3];
+    R[0] = node_1_ptr->com[0] - node_2_ptr->com[0];
+    R[1] = node_1_ptr->com[1] - node_2_ptr->com[1];
+    R[2] = node_1_ptr->com[2] - node_2_ptr->com[2];
+    real radius_1 = fmm_radius[node_1], radius_2 = fmm_radius[node_2];
+
+    // M2L, using T_n(-R) = (-1)^|n| T_n(R) for the opposite direction
+    if (radius_1 + radius_2 < theta * vec_norm(R, 3))
+    {
+        real T[FMM_MAX_SIZE];
+        fmm_derivatives(R, T);
+
+        const real *restrict multipole_1 = &fmm_multipoles[(size_t) node_1 * fmm_size];
+        const real *restrict multipole_2 = &fmm_multipoles[(size_t) node_2 * fmm_size];
+        real *restrict local_1 = &fmm_locals[(size_t) node_1 * fmm_size];
+        real *restrict local_2 = &fmm_locals[(size_t) node_2 * fmm_size];
+        for (int i = 0; i < fmm_m2l_count; i++)
+        {
+            const FMMTerm *restrict term = &fmm_m2l[i];
+            real temp_value = term->coef * T[term->power_idx];
+            local_1[term->out_idx] += temp_value * multipole_2[term->in_idx];
+            local_2[term->out_idx] += temp_value * fmm_parity[term->power_idx] * multipole_1[term->in_idx];
+        }
+        return;
+    }
+
+    int is_leaf_1 = (node_1_ptr->children_count == 0);
+    int is_leaf_2 = (node_2_ptr->children_count == 0);
+    if (is_leaf_1 && is_leaf_2)
+    {
+        fmm_near_field(node_1_ptr, node_2_ptr, x, a, m);
+    }
+    // Open the larger node
+    else if (!is_leaf_1 && (is_leaf_2 || radius_1 >= radius_2))
+    {
+        for (int i = 0; i < node_1_ptr->children_count; i++)
+        {
+            fmm_interact(node_1_ptr->children[i], node_2, x, a, m, theta);
+        }
+    }
+    else
+    {
+        for (int i = 0; i < node_2_ptr->children_count; i++)
+        {
+            fmm_interact(node_1, node_2_ptr->children[i], x, a, m, theta);
+        }
+    }
+}
+
+/*
+ * Calculate acceleration with the fast multipole method
+ * Multipole and local expansions of 1/r are Cartesian Taylor series of
+ * the given order about the center of mass of each octree node. Two nodes
+ * with expansion radii r_1, r_2 interact through their expansions if
+ * r_1 + r_2 < theta * d, otherwise the larger one is opened
+ *
+ * Reference: Dehnen (2002), J. Comput. Phys. 179, 27
+ */
+WIN32DLL_API void fmm_acceleration(
+    int objects_count, 
+    const real (*restrict x)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G,
+    real theta,
+    int order
+)
+{
+    memset(a, 0, objects_count * 3 * sizeof(real));
+    if (objects_count < 2)
+    {
+        return;
+    }
+
+    if (order != fmm_tables_order)
+    {
+        fmm_tables(order);
+    }
+
+    octree_construct(objects_count, x, m, FMM_LEAF_SIZE);
+
+    if (octree_nodes_count > fmm_nodes_capacity)
+    {
+        fmm_nodes_capacity = octree_nodes_capacity;
+        fmm_radius = realloc(fmm_radius, fmm_nodes_capacity * sizeof(real));
+    }
+    if ((size_t) octree_nodes_count * fmm_size > fmm_expansions_capacity)
+    {
+        fmm_expansions_capacity = (size_t) octree_nodes_capacity * fmm_size;
+        fmm_multipoles = realloc(fmm_multipoles, fmm_expansions_capacity * sizeof(real));
+        fmm_locals = realloc(fmm_locals, fmm_expansions_capacity * sizeof(real));
+    }
+
+    real y[3], powers[FMM_MAX_SIZE];
+
+    // P2M and M2M. Children are created after their parents, so every
+    // child is complete before its parent is visited.
+    memset(fmm_multipoles, 0, (size_t) octree_nodes_count * fmm_size * sizeof(real));
+    for (int node = octree_nodes_count - 1; node >= 0; node--)
+    {
+        const OctreeNode *restrict node_ptr = &octree_nodes[node];
+        real *restrict multipole = &fmm_multipoles[(size_t) node * fmm_size];
+        real radius = 0.0;
+        if (node_ptr->children_count == 0)
+        {
+            for (int ii = node_ptr->start; ii < node_ptr->end; ii++)
+            {
+                int i = octree_index[ii];
+                y[0] = x[i][0] - node_ptr->com[0];
+                y[1] = x[i][1] - node_ptr->com[1];
+                y[2] = x[i][2] - node_ptr->com[2];
+                fmm_powers(y, powers);
+                for (int idx = 0; idx < fmm_size; idx++)
+                {
+                    multipole[idx] += m[i] * powers[idx];
+                }
+                radius = fmax(radius, vec_norm(y, 3));
+            }
+        }
+        else
+        {
+            for (int k = 0; k < node_ptr->children_count; k++)
+            {
+                int child = node_ptr->children[k];
+                y[0] = octree_nodes[child].com[0] - node_ptr->com[0];
+                y[1] = octree_nodes[child].com[1] - node_ptr->com[1];
+                y[2] = octree_nodes[child].com[2] - node_ptr->com[2];
+                fmm_powers(y, powers);
+                fmm_translate(fmm_m2m, fmm_m2m_count, &fmm_multipoles[(size_t) child * fmm_size], powers, multipole);
+                radius = fmax(radius, vec_norm(y, 3) + fmm_radius[child]);
+            }
+        }
+        fmm_radius[node] = radius;
+    }
+
+    // M2L and P2P
+    memset(fmm_locals, 0, (size_t) octree_nodes_count * fmm_size * sizeof(real));
+    fmm_interact(0, 0, x, a, m, theta);
+
+    // L2L and L2P, from the root downwards
+    for (int node = 0; node < octree_nodes_count; node++)
+    {
+        const OctreeNode *restrict node_ptr = &octree_nodes[node];
+        const real *restrict local = &fmm_locals[(size_t) node * fmm_size];
+        if (node_ptr->children_count == 0)
+        {
+            for (int ii = node_ptr->start; ii < node_ptr->end; ii++)
+            {
+                int i = octree_index[ii];
+                y[0] = x[i][0] - node_ptr->com[0];
+                y[1] = x[i][1] - node_ptr->com[1];
+                y[2] = x[i][2] - node_ptr->com[2];
+                fmm_powers(y, powers);
+                fmm_translate(fmm_gradient, fmm_gradient_count, local, powers, a[i]);
+            }
+        }
+        else
+        {
+            for (int k = 0; k < node_ptr->children_count; k++)
+            {
+                int child = node_ptr->children[k];
+                y[0] = octree_nodes[child].com[0] - node_ptr->com[0];
+                y[1] = octree_nodes[child].com[1] - node_ptr->com[1];
+                y[2] = octree_nodes[child].com[2] - node_ptr->com[2];
+                fmm_powers(y, powers);
+                fmm_translate(fmm_l2l, fmm_l2l_count, local, powers, &fmm_locals[(size_t) child * fmm_size]);
+            }
+        }
+    }
+
+    for (int i = 0; i < objects_count; i++)
+    {
+        a[i][0] *= G;
+        a[i][1] *= G;
+        a[i][2] *= G;
+    }
+}
+
+WIN32DLL_API void euler(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    Workspace *workspace
+)
+{   
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, objects_count * 3);
+    real (*a)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    // Main Loop
+    for(int count = 0; count < time_speed; count++)
+    {   
+        acceleration(objects_count, x, a, m, G);
+        for (int j = 0; j < objects_count; j++)
+        {
+            // Calculation
+            x[j][0] += v[j][0] * dt;
+            x[j][1] += v[j][1] * dt;
+            x[j][2] += v[j][2] * dt;
+            v[j][0] += a[j][0] * dt;
+            v[j][1] += a[j][1] * dt;
+            v[j][2] += a[j][2] * dt;
+        }    
+    }
+
+    free_workspace(temp_workspace);
+}
+
+WIN32DLL_API void euler_cromer(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    Workspace *workspace
+)
+{   
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, objects_count * 3);
+    real (*a)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    // Main Loop
+    for(int count = 0; count < time_speed; count++)
+    {   
+        acceleration(objects_count, x, a, m, G);
+        for (int j = 0; j < objects_count; j++)
+        {
+            // Calculation
+            v[j][0] += a[j][0] * dt;
+            v[j][1] += a[j][1] * dt;
+            v[j][2] += a[j][2] * dt;
+            x[j][0] += v[j][0] * dt;
+            x[j][1] += v[j][1] * dt;
+            x[j][2] += v[j][2] * dt;
+        }    
+    }
+    
+    free_workspace(temp_workspace);
+}
+
+WIN32DLL_API void rk4(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    Workspace *workspace
+)
+{
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, 11 * objects_count * 3);
+
+    real (*temp_x)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*temp_v)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    real (*a)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    real (*vk1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*vk2)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*vk3)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*vk4)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*xk1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*xk2)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*xk3)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*xk4)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    // Main Loop
+    for(int count = 0; count < time_speed; count++)
+    {   
+        acceleration(objects_count, x, a, m, G);
+        memcpy(vk1, a, objects_count * 3 * sizeof(real));
+        memcpy(xk1, v, objects_count * 3 * sizeof(real));
+
+        for (int j = 0; j < objects_count; j++)
+        {
+            temp_x[j][0] = x[j][0] + 0.5 * xk1[j][0] * dt;
+            temp_x[j][1] = x[j][1] + 0.5 * xk1[j][1] * dt;
+            temp_x[j][2] = x[j][2] + 0.5 * xk1[j][2] * dt;
+            temp_v[j][0] = v[j][0] + 0.5 * vk1[j][0] * dt;
+            temp_v[j][1] = v[j][1] + 0.5 * vk1[j][1] * dt;
+            temp_v[j][2] = v[j][2] + 0.5 * vk1[j][2] * dt;
+        }
+        acceleration(objects_count, temp_x, a, m, G);
+        memcpy(vk2, a, objects_count * 3 * sizeof(real));
+        memcpy(xk2, temp_v, objects_count * 3 * sizeof(real));
+
+        for (int j = 0; j < objects_count; j++)
+        {
+            temp_x[j][0] = x[j][0] + 0.5 * xk2[j][0] * dt;
+            temp_x[j][1] = x[j][1] + 0.5 * xk2[j][1] * dt;
+            temp_x[j][2] = x[j][2] + 0.5 * xk2[j][2] * dt;
+            temp_v[j][0] = v[j][0] + 0.5 * vk2[j][0] * dt;
+            temp_v[j][1] = v[j][1] + 0.5 * vk2[j][1] * dt;
+            temp_v[j][2] = v[j][2] + 0.5 * vk2[j][2] * dt;
+        }
+        acceleration(objects_count, temp_x, a, m, G);
+        memcpy(vk3, a, objects_count * 3 * sizeof(real));
+        memcpy(xk3, temp_v, objects_count * 3 * sizeof(real));
+
+        for (int j = 0; j < objects_count; j++)
+        {
+            temp_x[j][0] = x[j][0] + xk3[j][0] * dt;
+            temp_x[j][1] = x[j][1] + xk3[j][1] * dt;
+            temp_x[j][2] = x[j][2] + xk3[j][2] * dt;
+            temp_v[j][0] = v[j][0] + vk3[j][0] * dt;
+            temp_v[j][1] = v[j][1] + vk3[j][1] * dt;
+            temp_v[j][2] = v[j][2] + vk3[j][2] * dt;
+        }
+        acceleration(objects_count, temp_x, a, m, G);
+        memcpy(vk4, a, objects_count * 3 * sizeof(real));
+        memcpy(xk4, temp_v, objects_count * 3 * sizeof(real));
+
+
+        for (int j = 0; j < objects_count; j++)
+        {
+            // Calculation
+            v[j][0] += (vk1[j][0] + 2 * vk2[j][0] + 2 * vk3[j][0] + vk4[j][0]) * dt / 6.0;
+            v[j][1] += (vk1[j][1] + 2 * vk2[j][1] + 2 * vk3[j][1] + vk4[j][1]) * dt / 6.0;
+            v[j][2] += (vk1[j][2] + 2 * vk2[j][2] + 2 * vk3[j][2] + vk4[j][2]) * dt / 6.0;
+            x[j][0] += (xk1[j][0] + 2 * xk2[j][0] + 2 * xk3[j][0] + xk4[j][0]) * dt / 6.0;
+            x[j][1] += (xk1[j][1] + 2 * xk2[j][1] + 2 * xk3[j][1] + xk4[j][1]) * dt / 6.0;
+            x[j][2] += (xk1[j][2] + 2 * xk2[j][2] + 2 * xk3[j][2] + xk4[j][2]) * dt / 6.0;
+        }    
+    } 
+
+    free_workspace(temp_workspace);
+}
+
+static void kepler_g_functions(real beta, real s, real *restrict g);
+
+static int compare_regularized_pairs(const void *a, const void *b)
+{
+    real r_square_a = ((const RegularizedPair *) a)->r_square;
+    real r_square_b = ((const RegularizedPair *) b)->r_square;
+
+    return (r_square_a > r_square_b) - (r_square_a < r_square_b);
+}
+
+/*
+ * Select the pairs whose relative motion is integrated exactly by
+ * regularized_drift(), as regularized_pairs() in main.py: the pairs closer
+ * than regularization_radius, closest first, with every object in
+ * at most one pair. The pairs are found with find_collisions() and written
+ * to regularized_pairs, and regularization_partner is the other object of
+ * the pair of every object, or -1.
+ *
+ * Return the number of pairs, which is 0 if the regularization is off
+ */
+static int select_regularized_pairs(int objects_count, const real (*restrict x)[3])
+{
+    if (!(regularization_radius > 0.0) || softening_kernel != SOFTENING_NONE || objects_count < 2)
+    {
+        return 0;
+    }
+
+    if (objects_count > regularization_objects_capacity)
+    {
+        regularization_objects_capacity = objects_count;
+        regularization_R = realloc(regularization_R, objects_count * sizeof(real));
+        regularization_partner = realloc(regularization_partner, objects_count * sizeof(int));
+        free_workspace(regularization_workspace);
+        regularization_workspace = create_workspace(objects_count);
+    }
+    for (int i = 0; i < objects_count; i++)
+    {
+        regularization_R[i] = 0.5 * regularization_radius;
+        regularization_partner[i] = -1;
+    }
+
+    int count;
+    while (1)
+    {
+        count = find_collisions(
+            objects_count, x, regularization_R, regularization_candidates,
+            regularization_pairs_capacity, regularization_workspace
+        );
+        if (count <= regularization_pairs_capacity)
+        {
+            break;
+        }
+        regularization_pairs_capacity = count;
+        regularization_candidates = realloc(regularization_candidates, count * sizeof(int[2]));
+        regularized_pairs = realloc(regularized_pairs, count * sizeof(RegularizedPair));
+    }
+
+    int candidates_count = 0;
+    for (int k = 0; k < count; k++)
+    {
+        int i = regularization_candidates[k][0];
+        int j = regularization_candidates[k][1];
+        real R[3] = {x[i][0] - x[j][0], x[i][1] - x[j][1], x[i][2] - x[j][2]};
+        real r_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+        if (r_square > 0.0)
+        {
+            regularized_pairs[candidates_count++] = (RegularizedPair) {r_square, i, j};
+        }
+    }
+    qsort(regularized_pairs, candidates_count, sizeof(RegularizedPair), compare_regularized_pairs);
+
+    int pairs_count = 0;
+    for (int k = 0; k < candidates_count; k++)
+    {
+        int i = regularized_pairs[k].i;
+        int j = regularized_pairs[k].j;
+        if (regularization_partner[i] < 0 && regularization_partner[j] < 0)
+        {
+            regularization_partner[i] = j;
+            regularization_partner[j] = i;
+            regularized_pairs[pairs_count++] = regularized_pairs[k];
+        }
+    }
+
+    return pairs_count;
+}
+
+// Undo the kick by dt of the mutual acceleration of the regularized pairs,
+// which leaves the perturbations of the other objects
+static void remove_pair_kick(
+    int pairs_count,
+    const real (*restrict x)[3],
+    real (*restrict v)[3],
+    const real *restrict m,
+    real G,
+    real dt
+)
+{
+    for (int k = 0; k < pairs_count; k++)
+    {
+        int i = regularized_pairs[k].i;
+        int j = regularized_pairs[k].j;
+        real R[3] = {x[i][0] - x[j][0], x[i][1] - x[j][1], x[i][2] - x[j][2]};
+        real r_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+        real temp_value = G * dt / (r_square * sqrt(r_square));
+        for (int l = 0; l < 3; l++)
+        {
+            v[i][l] += m[j] * temp_value * R[l];
+            v[j][l] -= m[i] * temp_value * R[l];
+        }
+    }
+}
+
+/*
+ * Advance the relative position R and velocity V of a pair with
+ * G (m_i + m_j) = gm by dt, as ks_kepler_step() in main.py. In the
+ * Kustaanheimo-Stiefel variables u, with R = L(u) u and dt = r ds, the
+ * two-body motion is u'' = h u / 2 in the time s, which stays regular
+ * through r = 0. It is solved with kepler_g_functions(), and the time s of
+ * dt from the closed form of t(s).
+ *
+ * Reference: Stiefel & Scheifele (1971), Linear and Regular Celestial
+ * Mechanics
+ */
+static void ks_kepler_step(real *restrict R, real *restrict V, real gm, real dt)
+{
+    real r = sqrt(R[0] * R[0] + R[1] * R[1] + R[2] * R[2]);
+
+    // u with L(u) u = R, from the larger of r + x and r - x
+    real u[4], du[4];
+    real u_max = sqrt(0.5 * (r + fabs(R[0])));
+    if (R[0] >= 0.0)
+    {
+        u[0] = u_max;
+        u[1] = 0.5 * R[1] / u_max;
+        u[2] = 0.5 * R[2] / u_max;
+        u[3] = 0.0;
+    }
+    else
+    {
+        u[0] = 0.5 * R[1] / u_max;
+        u[1] = u_max;
+        u[2] = 0.0;
+        u[3] = 0.5 * R[2] / u_max;
+    }
+    // du / ds = L(u)^T V / 2
+    du[0] = 0.5 * (u[0] * V[0] + u[1] * V[1] + u[2] * V[2]);
+    du[1] = 0.5 * (-u[1] * V[0] + u[0] * V[1] + u[3] * V[2]);
+    du[2] = 0.5 * (-u[2] * V[0] - u[3] * V[1] + u[0] * V[2]);
+    du[3] = 0.5 * (u[3] * V[0] - u[2] * V[1] + u[1] * V[2]);
+
+    // u'' = -beta u with beta = -h / 2, for bound and unbound pairs alike
+    real beta = 0.5 * gm / r - 0.25 * (V[0] * V[0] + V[1] * V[1] + V[2] * V[2]);
+    real A = 0.0, B = 0.0, C = 0.0;
+    for (int k = 0; k < 4; k++)
+    {
+        A += u[k] * u[k];
+        B += du[k] * du[k];
+        C += u[k] * du[k];
+    }
+
+    // t(s) = (A (2s + G_1) + 2 C G_2 + B G_3) / 4 with G_k(2s), and t is
+    // within D of r_mean s for beta > 0. Otherwise r'' = gm - 4 beta r >= gm
+    // gives t(s) >= gm s^3 / 24.
+    real s, s_min, s_max;
+    if (beta > 0.0)
+    {
+        real omega = sqrt(beta);
+        real r_mean = 0.5 * (A + B / beta);
+        real D = fabs(A - B / beta) / (4.0 * omega) + fabs(C) / beta;
+        s_min = (dt - D) / r_mean;
+        s_max = (dt + D) / r_mean;
+        s = dt / r_mean;
+    }
+    else
+    {
+        real s_bound = cbrt(24.0 * fabs(dt) / gm);
+        s_min = (dt < 0.0) ? -s_bound : 0.0;
+        s_max = (dt > 0.0) ? s_bound : 0.0;
+        s = fmin(fmax(dt / A, s_min), s_max);
+    }
+
+    real g[4];
+    real ds = s_max - s_min;
+    real ds_old = ds;
+    for (int iteration = 0; iteration < KS_MAX_ITERATION; iteration++)
+    {
+        kepler_g_functions(beta, 2.0 * s, g);
+        real t = 0.25 * (A * (2.0 * s + g[1]) + 2.0 * C * g[2] + B * g[3]);
+        // dt / ds = r(s)
+        real r_s = 0.5 * (A * (1.0 + g[0]) + 2.0 * C * g[1] + B * g[2]);
+        if (t < dt)
+        {
+            s_min = s;
+        }
+        else if (t > dt)
+        {
+            s_max = s;
+        }
+        real s_new = s - (t - dt) / r_s;
+        // Bisection when Newton leaves the bracket or converges slower than
+        // it, e.g. down the exponential t(s) of a hyperbolic pair
+        if (!(s_new > s_min && s_new < s_max && fabs(s_new - s) < 0.5 * ds_old))
+        {
+            s_new = 0.5 * (s_min + s_max);
+        }
+        ds_old = ds;
+        ds = fabs(s_new - s);
+        s = s_new;
+        if (ds <= 4.0 * DBL_EPSILON * fabs(s))
+        {
+            break;
+        }
+    }
+
+    kepler_g_functions(beta, s, g);
+    for (int k = 0; k < 4; k++)
+    {
+        real u_k = u[k];
+        u[k] = g[0] * u_k + g[1] * du[k];
+        du[k] = g[0] * du[k] - beta * g[1] * u_k;
+    }
+
+    // R = L(u) u and V = 2 L(u) du / r
+    r = u[0] * u[0] + u[1] * u[1] + u[2] * u[2] + u[3] * u[3];
+    R[0] = u[0] * u[0] - u[1] * u[1] - u[2] * u[2] + u[3] * u[3];
+    R[1] = 2.0 * (u[0] * u[1] - u[2] * u[3]);
+    R[2] = 2.0 * (u[0] * u[2] + u[1] * u[3]);
+    V[0] = 2.0 / r * (u[0] * du[0] - u[1] * du[1] - u[2] * du[2] + u[3] * du[3]);
+    V[1] = 2.0 / r * (u[1] * du[0] + u[0] * du[1] - u[3] * du[2] - u[2] * du[3]);
+    V[2] = 2.0 / r * (u[2] * du[0] + u[3] * du[1] + u[0] * du[2] + u[1] * du[3]);
+}
+
+// Drift the objects by dt. The regularized pairs move along their exact
+// two-body orbits around their center of mass, see ks_kepler_step().
+static void regularized_drift(
+    int objects_count,
+    real (*restrict x)[3],
+    real (*restrict v)[3],
+    const real *restrict m,
+    real G,
+    real dt,
+    int pairs_count
+)
+{
+    for (int j = 0; j < objects_count; j++)
+    {
+        if (regularization_partner[j] < 0)
+        {
+            x[j][0] += v[j][0] * dt;
+            x[j][1] += v[j][1] * dt;
+            x[j][2] += v[j][2] * dt;
+        }
+    }
+
+    for (int k = 0; k < pairs_count; k++)
+    {
+        int i = regularized_pairs[k].i;
+        int j = regularized_pairs[k].j;
+        real pair_mass = m[i] + m[j];
+        real R[3], V[3], x_cm[3], v_cm[3];
+        for (int l = 0; l < 3; l++)
+        {
+            R[l] = x[i][l] - x[j][l];
+            V[l] = v[i][l] - v[j][l];
+            x_cm[l] = (m[i] * x[i][l] + m[j] * x[j][l]) / pair_mass;
+            v_cm[l] = (m[i] * v[i][l] + m[j] * v[j][l]) / pair_mass;
+        }
+        ks_kepler_step(R, V, G * pair_mass, dt);
+        for (int l = 0; l < 3; l++)
+        {
+            x[i][l] = x_cm[l] + v_cm[l] * dt + m[j] / pair_mass * R[l];
+            x[j][l] = x_cm[l] + v_cm[l] * dt - m[i] / pair_mass * R[l];
+            v[i][l] = v_cm[l] + m[j] / pair_mass * V[l];
+            v[j][l] = v_cm[l] - m[i] / pair_mass * V[l];
+        }
+    }
+}
+
+WIN32DLL_API void leapfrog(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    real (*restrict a)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    real *restrict potential,
+    Workspace *workspace
+)
+{   
+    // The regularized drifts need the kick-drift-kick form
+    if (regularization_radius > 0.0 && softening_kernel == SOFTENING_NONE)
+    {
+        const real drift_coeff[1] = {1.0};
+        const real kick_coeff[2] = {0.5, 0.5};
+        leapfrog_composition(
+            objects_count, x, v, a, m, G, dt, time_speed, 1, drift_coeff, kick_coeff, potential
+        );
+        return;
+    }
+
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, 2 * objects_count * 3);
+    real (*a_0)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*a_1)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    memcpy(a_1, a, objects_count * 3 * sizeof(real));
+
+    // Main Loop
+    for(int count = 0; count < time_speed; count++)
+    {       
+        // Use a_1 from last iteration as a_0
+        memcpy(a_0, a_1, objects_count * 3 * sizeof(real));
+        
+        for (int j = 0; j < objects_count; j++)
+        {
+            // Calculation
+            x[j][0] += v[j][0] * dt + 0.5 * a_0[j][0] * dt * dt;
+            x[j][1] += v[j][1] * dt + 0.5 * a_0[j][1] * dt * dt;
+            x[j][2] += v[j][2] * dt + 0.5 * a_0[j][2] * dt * dt;
+        }    
+        // The potential energy is a by-product of the last force evaluation
+        if (potential != NULL && count == time_speed - 1)
+        {
+            *potential = acceleration_potential(objects_count, x, a_1, m, G);
+        }
+        else
+        {
+            acceleration(objects_count, x, a_1, m, G);
+        }
+        for (int j = 0; j < objects_count; j++)
+        {
+            // Calculation
+            v[j][0] += 0.5 * (a_0[j][0] + a_1[j][0]) * dt;
+            v[j][1] += 0.5 * (a_0[j][1] + a_1[j][1]) * dt;
+            v[j][2] += 0.5 * (a_0[j][2] + a_1[j][2]) * dt;
+        }    
+    }
+
+    memcpy(a, a_1, objects_count * 3 * sizeof(real));
+
+    free_workspace(temp_workspace);
+}
+
+/*
+ * Symplectic composition of kick-drift-kick leapfrog steps, e.g. the
+ * Forest-Ruth and Yoshida schemes. Every step is
+ * K(d_0) D(c_0) K(d_1) ... D(c_{stages - 1}) K(d_stages) with the kick
+ * coefficients d and drift coefficients c. The first kick of a step uses
+ * the force of the last kick of the previous step (FSAL), so a must be the
+ * acceleration at x and the steps cost stages force evaluations each.
+ * The pairs of select_regularized_pairs() are chosen at the start of every
+ * step, and their mutual force is integrated exactly by the drifts instead
+ * of the kicks.
+ */
+WIN32DLL_API void leapfrog_composition(
+    int objects_count,
+    real (*restrict x)[3],
+    real (*restrict v)[3],
+    real (*restrict a)[3],
+    const real *restrict m,
+    real G,
+    real dt,
+    int time_speed,
+    int stages,
+    const real *restrict drift_coeff,
+    const real *restrict kick_coeff,
+    real *restrict potential
+)
+{
+    // Main Loop
+    for (int count = 0; count < time_speed; count++)
+    {
+        int pairs_count = select_regularized_pairs(objects_count, x);
+        for (int stage = 0; stage <= stages; stage++)
+        {
+            if (stage > 0)
+            {
+                real drift_dt = drift_coeff[stage - 1] * dt;
+                if (pairs_count > 0)
+                {
+                    regularized_drift(objects_count, x, v, m, G, drift_dt, pairs_count);
+                }
+                else
+                {
+                    for (int j = 0; j < objects_count; j++)
+                    {
+                        x[j][0] += v[j][0] * drift_dt;
+                        x[j][1] += v[j][1] * drift_dt;
+                        x[j][2] += v[j][2] * drift_dt;
+                    }
+                }
+
+                // The potential energy is a by-product of the last force evaluation
+                if (potential != NULL && count == time_speed - 1 && stage == stages)
+                {
+                    *potential = acceleration_potential(objects_count, x, a, m, G);
+                }
+                else
+                {
+                    acceleration(objects_count, x, a, m, G);
+                }
+            }
+
+            real kick_dt = kick_coeff[stage] * dt;
+            for (int j = 0; j < objects_count; j++)
+            {
+                v[j][0] += a[j][0] * kick_dt;
+                v[j][1] += a[j][1] * kick_dt;
+                v[j][2] += a[j][2] * kick_dt;
+            }
+            remove_pair_kick(pairs_count, x, v, m, G, kick_dt);
+        }
+    }
+}
+
+// Maximum level of block_leapfrog(), whose time steps are dt / 2^level
+#define BLOCK_MAX_LEVEL 30
+
+/*
+ * Direct sum of the acceleration of the active objects, and their time
+ * steps, in the order of active, eta * min_j min(sqrt(r^3 / G (m_i + m_j)), r / |v_i - v_j|) from
+ * the free-fall and flyby times of every pair. With softening, r^3 is
+ * 1 / softened_inv_r3() and r^2 in the flyby time is r^2 + epsilon^2.
+ */
+static void block_acceleration(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real (*restrict v)[3],
+    real (*restrict a)[3],
+    const real *restrict m,
+    real G,
+    const int *restrict active,
+    int active_count,
+    real eta,
+    real *restrict timestep
+)
+{
+    #pragma omp parallel for schedule(dynamic, 16) if ((long long) active_count * objects_count >= OPENMP_MIN_OBJECTS * OPENMP_MIN_OBJECTS)
+    for (int n = 0; n < active_count; n++)
+    {
+        int i = active[n];
+        real a_i[3] = {0.0, 0.0, 0.0};
+        // Square of the shortest free-fall or flyby time
+        real min_time_square = HUGE_VAL;
+        for (int j = 0; j < objects_count; j++)
+        {
+            if (j == i)
+            {
+                continue;
+            }
+
+            real R[3] = {x[j][0] - x[i][0], x[j][1] - x[i][1], x[j][2] - x[i][2]};
+            real R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+            real inv_R_norm_cube = softened_inv_r3(R_norm_square);
+            real temp_value = G * m[j] * inv_R_norm_cube;
+            a_i[0] += temp_value * R[0];
+            a_i[1] += temp_value * R[1];
+            a_i[2] += temp_value * R[2];
+
+            real free_fall_square = 1.0 / (G * (m[i] + m[j]) * inv_R_norm_cube);
+            if (free_fall_square < min_time_square)
+            {
+                min_time_square = free_fall_square;
+            }
+            real V[3] = {v[j][0] - v[i][0], v[j][1] - v[i][1], v[j][2] - v[i][2]};
+            real V_norm_square = V[0] * V[0] + V[1] * V[1] + V[2] * V[2];
+            real flyby_R_norm_square = R_norm_square + softening_length * softening_length;
+            if (flyby_R_norm_square < min_time_square * V_norm_square)
+            {
+                min_time_square = flyby_R_norm_square / V_norm_square;
+            }
+        }
+
+        a[i][0] = a_i[0];
+        a[i][1] = a_i[1];
+        a[i][2] = a_i[2];
+        timestep[n] = eta * sqrt(min_time_square);
+    }
+}
+
+// Smallest level whose time step dt / 2^level is at most timestep
+static int block_level(real dt, real timestep)
+{
+    if (!(timestep < dt))
+    {
+        return 0;
+    }
+    int level = (int) ceil(log2(dt / timestep));
+    return level < BLOCK_MAX_LEVEL ? level : BLOCK_MAX_LEVEL;
+}
+
+/*
+ * Kick-drift-kick leapfrog with hierarchical block time steps. Object i
+ * steps with dt / 2^levels[i] and only the objects at the end of their
+ * step get a force evaluation, while every object drifts. A level
+ * increases as soon as the time step criterion of block_acceleration()
+ * asks for it, and decreases by one at most per step when the object is
+ * synchronized with the longer step. Negative levels are initialized.
+ * Every call advances time_speed steps dt, at whose end all objects are
+ * synchronized, and returns the number of force evaluations of one object.
+ */
+WIN32DLL_API long long block_leapfrog(
+    int objects_count,
+    real (*restrict x)[3],
+    real (*restrict v)[3],
+    real (*restrict a)[3],
+    const real *restrict m,
+    real G,
+    real dt,
+    int time_speed,
+    int *restrict levels,
+    real eta,
+    Workspace *workspace
+)
+{
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, 2 * objects_count);
+    int *active = workspace_alloc(workspace, objects_count);
+    real *timestep = workspace_alloc(workspace, objects_count);
+
+    // Times are counted in ticks of dt / 2^BLOCK_MAX_LEVEL
+    const long long cycle_ticks = 1LL << BLOCK_MAX_LEVEL;
+    const real tick = dt / cycle_ticks;
+    long long active_objects_count = 0;
+
+    int active_count = 0;
+    for (int i = 0; i < objects_count; i++)
+    {
+        if (levels[i] < 0)
+        {
+            active[active_count++] = i;
+        }
+    }
+    if (active_count > 0)
+    {
+        block_acceleration(objects_count, x, v, a, m, G, active, active_count, eta, timestep);
+        active_objects_count += active_count;
+        for (int n = 0; n < active_count; n++)
+        {
+            levels[active[n]] = block_level(dt, timestep[n]);
+        }
+    }
+
+    // Main Loop
+    for (int count = 0; count < time_speed; count++)
+    {
+        // First half kick of every object
+        for (int i = 0; i < objects_count; i++)
+        {
+            real kick_dt = ldexp(0.5 * dt, -levels[i]);
+            v[i][0] += a[i][0] * kick_dt;
+            v[i][1] += a[i][1] * kick_dt;
+            v[i][2] += a[i][2] * kick_dt;
+        }
+
+        long long t = 0;
+        while (t < cycle_ticks)
+        {
+            // Drift to the end of the shortest step
+            int max_level = 0;
+            for (int i = 0; i < objects_count; i++)
+            {
+                if (levels[i] > max_level)
+                {
+                    max_level = levels[i];
+                }
+            }
+            long long min_step = 1LL << (BLOCK_MAX_LEVEL - max_level);
+            long long t_next = (t / min_step + 1) * min_step;
+            real drift_dt = (t_next - t) * tick;
+            for (int i = 0; i < objects_count; i++)
+            {
+                x[i][0] += v[i][0] * drift_dt;
+                x[i][1] += v[i][1] * drift_dt;
+                x[i][2] += v[i][2] * drift_dt;
+            }
+            t = t_next;
+
+            active_count = 0;
+            for (int i = 0; i < objects_count; i++)
+            {
+                if (t % (1LL << (BLOCK_MAX_LEVEL - levels[i])) == 0)
+                {
+                    active[active_count++] = i;
+                }
+            }
+            block_acceleration(objects_count, x, v, a, m, G, active, active_count, eta, timestep);
+            active_objects_count += active_count;
+
+            for (int n = 0; n < active_count; n++)
+            {
+                int i = active[n];
+
+                // Second half kick of the step that ends
+                real kick_dt = ldexp(0.5 * dt, -levels[i]);
+                v[i][0] += a[i][0] * kick_dt;
+                v[i][1] += a[i][1] * kick_dt;
+                v[i][2] += a[i][2] * kick_dt;
+
+                int level = block_level(dt, timestep[n]);
+                if (level < levels[i])
+                {
+                    level = levels[i] - 1;
+                    if (t % (1LL << (BLOCK_MAX_LEVEL - level)) != 0)
+                    {
+                        level = levels[i];
+                    }
+                }
+                levels[i] = level;
+
+                // First half kick of the next step
+                if (t < cycle_ticks)
+                {
+                    kick_dt = ldexp(0.5 * dt, -level);
+                    v[i][0] += a[i][0] * kick_dt;
+                    v[i][1] += a[i][1] * kick_dt;
+                    v[i][2] += a[i][2] * kick_dt;
+                }
+            }
+        }
+    }
+
+    free_workspace(temp_workspace);
+
+    return active_objects_count;
+}
+
+// Relative tolerance and maximum iterations of the Kepler solver of whfast()
+#define KEPLER_TOLERANCE 1e-15
+#define KEPLER_MAX_ITERATION 20
+
+// Transform positions, velocities or accelerations to Jacobi coordinates
+// relative to the center of mass of the interior objects. The first row
+// is the center of mass of all objects.
+static void inertial_to_jacobi(
+    int objects_count,
+    const real (*restrict x)[3],
+    real (*restrict jacobi_x)[3],
+    const real *restrict m,
+    const real *restrict eta
+)
+{
+    // Mass weighted sum of the interior objects
+    real sum[3] = {m[0] * x[0][0], m[0] * x[0][1], m[0] * x[0][2]};
+    for (int i = 1; i < objects_count; i++)
+    {
+        for (int k = 0; k < 3; k++)
+        {
+            jacobi_x[i][k] = x[i][k] - sum[k] / eta[i - 1];
+            sum[k] += m[i] * x[i][k];
+        }
+    }
+    for (int k = 0; k < 3; k++)
+    {
+        jacobi_x[0][k] = sum[k] / eta[objects_count - 1];
+    }
+}
+
+// Inverse of inertial_to_jacobi()
+static void jacobi_to_inertial(
+    int objects_count,
+    const real (*restrict jacobi_x)[3],
+    real (*restrict x)[3],
+    const real *restrict m,
+    const real *restrict eta
+)
+{
+    // The center of mass of the interior objects moves by
+    // m[i] / eta[i] * jacobi_x[i] when object i is added
+    real com[3] = {jacobi_x[0][0], jacobi_x[0][1], jacobi_x[0][2]};
+    for (int i = objects_count - 1; i >= 1; i--)
+    {
+        for (int k = 0; k < 3; k++)
+        {
+            com[k] -= m[i] / eta[i] * jacobi_x[i][k];
+            x[i][k] = jacobi_x[i][k] + com[k];
+        }
+    }
+    for (int k = 0; k < 3; k++)
+    {
+        x[0][k] = com[k];
+    }
+}
+
+// Functions G_k(s) = s^k c_k(beta s^2) of the universal variable for
+// k = 0 to 3, where c_k are the Stumpff functions
+static void kepler_g_functions(real beta, real s, real *restrict g)
+{
+    real z = beta * s * s;
+    real c2, c3;
+    if (fabs(z) < 1.0)
+    {
+        // Series c_k(z) = sum_n (-z)^n / (2n + k)!, since the closed forms
+        // lose precision for small |z|
+        static const real factorial[20] = {
+            1.0, 1.0, 2.0, 6.0, 24.0, 120.0, 720.0, 5040.0, 40320.0, 362880.0,
+            3628800.0, 39916800.0, 479001600.0, 6227020800.0, 87178291200.0,
+            1307674368000.0, 20922789888000.0, 355687428096000.0,
+            6402373705728000.0, 121645100408832000.0
+        };
+        c2 = 0.0;
+        c3 = 0.0;
+        for (int n = 8; n >= 0; n--)
+        {
+            c2 = 1.0 / factorial[2 * n + 2] - z * c2;
+            c3 = 1.0 / factorial[2 * n + 3] - z * c3;
+        }
+    }
+    else if (z > 0.0)
+    {
+        real sqrt_z = sqrt(z);
+        c2 = (1.0 - cos(sqrt_z)) / z;
+        c3 = (sqrt_z - sin(sqrt_z)) / (z * sqrt_z);
+    }
+    else
+    {
+        real sqrt_z = sqrt(-z);
+        c2 = (cosh(sqrt_z) - 1.0) / -z;
+        c3 = (sinh(sqrt_z) - sqrt_z) / (-z * sqrt_z);
+    }
+
+    // c0 = 1 - z c2 and c1 = 1 - z c3
+    g[2] = s * s * c2;
+    g[3] = s * s * s * c3;
+    g[0] = 1.0 - beta * g[2];
+    g[1] = s - beta * g[3];
+}
+
+/*
+ * Solve the Kepler problem x'' = -gm x / |x|^3 over dt in place with the
+ * universal variable s, for elliptic and hyperbolic orbits alike, with
+ * the Laguerre-Conway iteration
+ *
+ * Reference: Danby (1992), Fundamentals of Celestial Mechanics, Chapter 6.9;
+ * Conway (1986), Celestial Mechanics 39, 199
+ */
+static void kepler_step(real *restrict x, real *restrict v, real gm, real dt)
+{
+    real g[4];
+    real r0 = sqrt(x[0] * x[0] + x[1] * x[1] + x[2] * x[2]);
+    real eta0 = x[0] * v[0] + x[1] * v[1] + x[2] * v[2];
+    real beta = 2.0 * gm / r0 - (v[0] * v[0] + v[1] * v[1] + v[2] * v[2]);
+    real zeta0 = gm - beta * r0;
+
+    // Kepler's equation f(s) = r0 s + eta0 G2 + zeta0 G3 - dt = 0 with
+    // f'(s) = r(s) > 0. Initial guess from the Taylor series of r(t).
+    real s = dt / r0 - eta0 * dt * dt / (2.0 * r0 * r0 * r0);
+    for (int i = 0; i < KEPLER_MAX_ITERATION; i++)
+    {
+        kepler_g_functions(beta, s, g);
+        real f = r0 * s + eta0 * g[2] + zeta0 * g[3] - dt;
+        real f_prime = r0 + eta0 * g[1] + zeta0 * g[2];
+        real f_prime_2 = eta0 * g[0] + zeta0 * g[1];
+        real delta_s = -5.0 * f / (
+            f_prime + sqrt(fabs(16.0 * f_prime * f_prime - 20.0 * f * f_prime_2))
+        );
+        s += delta_s;
+        if (fabs(delta_s) <= KEPLER_TOLERANCE * fabs(s))
+        {
+            break;
+        }
+    }
+
+    kepler_g_functions(beta, s, g);
+    real r = r0 + eta0 * g[1] + zeta0 * g[2];
+    real f = 1.0 - gm * g[2] / r0;
+    real g_ = dt - gm * g[3];
+    real f_dot = -gm * g[1] / (r0 * r);
+    real g_dot = 1.0 - gm * g[2] / r;
+
+    for (int k = 0; k < 3; k++)
+    {
+        real x_k = x[k];
+        x[k] = f * x_k + g_ * v[k];
+        v[k] = f_dot * x_k + g_dot * v[k];
+    }
+}
+
+// Advance the center of mass in a straight line and every other Jacobi
+// coordinate along its Kepler orbit
+static void whfast_drift(
+    int objects_count,
+    real (*restrict jacobi_x)[3],
+    real (*restrict jacobi_v)[3],
+    const real *restrict eta,
+    real G,
+    real dt
+)
+{
+    for (int k = 0; k < 3; k++)
+    {
+        jacobi_x[0][k] += dt * jacobi_v[0][k];
+    }
+    for (int i = 1; i < objects_count; i++)
+    {
+        kepler_step(jacobi_x[i], jacobi_v[i], G * eta[i], dt);
+    }
+}
+
+/*
+ * WHFast, the Wisdom-Holman symplectic integrator in Jacobi coordinates.
+ * The objects must be ordered from the central object outwards. Every step
+ * is the composition K(d_0) D(c_0) K(d_1) ... D(c_{stages - 1}) K(d_stages)
+ * of Kepler drifts and interaction kicks with the coefficients c and d, e.g.
+ * c = {1/2, 1/2} and d = {0, 1, 0} for the standard drift-kick-drift step.
+ * Consecutive drifts, including the ones of consecutive steps, are combined
+ * and a force is reused until the next drift, so the Jacobi coordinates are
+ * only synchronized with x and v at the end.
+ *
+ * Reference: Rein & Tamayo (2015), WHFast: a fast and unbiased
+ * implementation of a symplectic Wisdom-Holman integrator for long-term
+ * gravitational simulations, MNRAS 452, 376
+ */
+WIN32DLL_API void whfast(
+    int objects_count, 
+    real (*restrict x)[3], 
+    real (*restrict v)[3], 
+    const real *restrict m, 
+    real G, 
+    real dt,
+    int time_speed,
+    int stages,
+    const real *restrict drift_coeff,
+    const real *restrict kick_coeff,
+    Workspace *workspace
+)
+{
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, 4 * objects_count * 3 + objects_count);
+    real (*jacobi_x)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*jacobi_v)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*a)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*jacobi_a)[3] = workspace_alloc(workspace, objects_count * 3);
+    real *eta = workspace_alloc(workspace, objects_count);
+
+    // Mass of the objects up to i
+    eta[0] = m[0];
+    for (int i = 1; i < objects_count; i++)
+    {
+        eta[i] = eta[i - 1] + m[i];
+    }
+
+    inertial_to_jacobi(objects_count, x, jacobi_x, m, eta);
+    inertial_to_jacobi(objects_count, v, jacobi_v, m, eta);
+
+    // Drift not applied yet, and whether jacobi_a is the force at jacobi_x
+    real drift_dt = 0.0;
+    int is_jacobi_a_valid = 0;
+    for (int count = 0; count < time_speed; count++)
+    {
+        for (int stage = 0; stage <= stages; stage++)
+        {
+            if (kick_coeff[stage] != 0.0)
+            {
+                if (drift_dt != 0.0)
+                {
+                    whfast_drift(objects_count, jacobi_x, jacobi_v, eta, G, drift_dt);
+                    drift_dt = 0.0;
+                    is_jacobi_a_valid = 0;
+                }
+                if (!is_jacobi_a_valid)
+                {
+                    jacobi_to_inertial(objects_count, jacobi_x, x, m, eta);
+                    acceleration(objects_count, x, a, m, G);
+                    inertial_to_jacobi(objects_count, a, jacobi_a, m, eta);
+                    is_jacobi_a_valid = 1;
+                }
+
+                // Kick by the interaction Hamiltonian, which is the total force
+                // without the Keplerian part of each Jacobi coordinate
+                real kick_dt = kick_coeff[stage] * dt;
+                for (int i = 1; i < objects_count; i++)
+                {
+                    real r_square = (
+                        jacobi_x[i][0] * jacobi_x[i][0]
+                        + jacobi_x[i][1] * jacobi_x[i][1]
+                        + jacobi_x[i][2] * jacobi_x[i][2]
+                    );
+                    real kepler_a = G * eta[i] / (r_square * sqrt(r_square));
+                    for (int k = 0; k < 3; k++)
+                    {
+                        jacobi_v[i][k] += kick_dt * (jacobi_a[i][k] + kepler_a * jacobi_x[i][k]);
+                    }
+                }
+            }
+
+            if (stage < stages)
+            {
+                drift_dt += drift_coeff[stage] * dt;
+            }
+        }
+    }
+    if (drift_dt != 0.0)
+    {
+        whfast_drift(objects_count, jacobi_x, jacobi_v, eta, G, drift_dt);
+    }
+
+    jacobi_to_inertial(objects_count, jacobi_x, x, m, eta);
+    jacobi_to_inertial(objects_count, jacobi_v, v, m, eta);
+
+    free_workspace(temp_workspace);
+}
+
+// Direct sum of the acceleration and its time derivative, the jerk
+WIN32DLL_API void acceleration_jerk(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real (*restrict v)[3],
+    real (*restrict a)[3],
+    real (*restrict jerk)[3],
+    const real *restrict m,
+    real G
+)
+{
+    acceleration_count++;
+
+    #pragma omp parallel for schedule(dynamic, 16) if (objects_count >= OPENMP_MIN_OBJECTS)
+    for (int i = 0; i < objects_count; i++)
+    {
+        real a_i[3] = {0.0, 0.0, 0.0};
+        real jerk_i[3] = {0.0, 0.0, 0.0};
+        for (int j = 0; j < objects_count; j++)
+        {
+            if (j == i)
+            {
+                continue;
+            }
+
+            real R[3] = {x[j][0] - x[i][0], x[j][1] - x[i][1], x[j][2] - x[i][2]};
+            real V[3] = {v[j][0] - v[i][0], v[j][1] - v[i][1], v[j][2] - v[i][2]};
+            real R_norm_square = R[0] * R[0] + R[1] * R[1] + R[2] * R[2];
+            real inv_R_norm_cube = softened_inv_r3(R_norm_square);
+            real temp_value = G * m[j] * inv_R_norm_cube;
+            // g (R . V), with g = 3 / |R|^2 without softening
+            real RV = (
+                softened_jerk_factor(R_norm_square, inv_R_norm_cube)
+                * (R[0] * V[0] + R[1] * V[1] + R[2] * V[2])
+            );
+            for (int k = 0; k < 3; k++)
+            {
+                a_i[k] += temp_value * R[k];
+                jerk_i[k] += temp_value * (V[k] - RV * R[k]);
+            }
+        }
+
+        for (int k = 0; k < 3; k++)
+        {
+            a[i][k] = a_i[k];
+            jerk[i][k] = jerk_i[k];
+        }
+    }
+}
+
+/*
+ * Fourth order Hermite predictor-corrector with the shared time step
+ * criterion of Aarseth. The forces and jerks are always summed directly,
+ * and a and jerk must be the ones at x and v.
+ *
+ * Reference: Makino & Aarseth (1992), On a Hermite integrator with
+ * Ahmad-Cohen scheme for gravitational many-body problems, PASJ 44, 141
+ */
+WIN32DLL_API void hermite(
+    int objects_count,
+    real (*restrict x)[3],
+    real (*restrict v)[3],
+    real (*restrict a)[3],
+    real (*restrict jerk)[3],
+    const real *restrict m,
+    real G,
+    real *restrict t,
+    real *restrict dt,
+    real expected_time_scale,
+    int *restrict count,
+    real eta,
+    int max_iteration,
+    int min_iteration,
+    Workspace *workspace
+)
+{
+    real t0 = *t;
+
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, 4 * objects_count * 3);
+    real (*x_1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*v_1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*a_1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*jerk_1)[3] = workspace_alloc(workspace, objects_count * 3);
+
+    *count = 0;
+    for (int i = 0; i < max_iteration; i++)
+    {
+        real h = *dt;
+
+        // Predictor
+        for (int j = 0; j < objects_count; j++)
+        {
+            for (int k = 0; k < 3; k++)
+            {
+                x_1[j][k] = x[j][k] + h * (v[j][k] + h * (0.5 * a[j][k] + h * jerk[j][k] / 6.0));
+                v_1[j][k] = v[j][k] + h * (a[j][k] + h * 0.5 * jerk[j][k]);
+            }
+        }
+
+        acceleration_jerk(objects_count, x_1, v_1, a_1, jerk_1, m, G);
+
+        // Corrector, and the time step from the second and third
+        // derivatives of the acceleration at the end of the step
+        real new_dt = 2.0 * h;
+        for (int j = 0; j < objects_count; j++)
+        {
+            real a_2[3], a_3[3];
+            for (int k = 0; k < 3; k++)
+            {
+                real delta_a = a[j][k] - a_1[j][k];
+                v_1[j][k] = v[j][k] + h * (0.5 * (a[j][k] + a_1[j][k]) + h * (jerk[j][k] - jerk_1[j][k]) / 12.0);
+                x_1[j][k] = x[j][k] + h * (0.5 * (v[j][k] + v_1[j][k]) + h * delta_a / 12.0);
+
+                a_3[k] = (12.0 * delta_a + 6.0 * h * (jerk[j][k] + jerk_1[j][k])) / (h * h * h);
+                a_2[k] = (-6.0 * delta_a - h * (4.0 * jerk[j][k] + 2.0 * jerk_1[j][k])) / (h * h) + h * a_3[k];
+            }
+
+            real a_norm = vec_norm(a_1[j], 3);
+            real jerk_norm = vec_norm(jerk_1[j], 3);
+            real a_2_norm = vec_norm(a_2, 3);
+            real a_3_norm = vec_norm(a_3, 3);
+            real denominator = jerk_norm * a_3_norm + a_2_norm * a_2_norm;
+            if (denominator > 0.0)
+            {
+                real dt_j = sqrt(eta * (a_norm * a_2_norm + jerk_norm * jerk_norm) / denominator);
+                if (dt_j < new_dt)
+                {
+                    new_dt = dt_j;
+                }
+            }
+        }
+
+        memcpy(x, x_1, objects_count * 3 * sizeof(real));
+        memcpy(v, v_1, objects_count * 3 * sizeof(real));
+        memcpy(a, a_1, objects_count * 3 * sizeof(real));
+        memcpy(jerk, jerk_1, objects_count * 3 * sizeof(real));
+        *t += h;
+        *dt = new_dt;
+
+        (*count)++;
+        if (*count >= min_iteration && *t > (t0 + expected_time_scale * 1e-5))
+        {
+            break;
+        }
+    }
+
+    free_workspace(temp_workspace);
+}
+
+// Number of columns of the extrapolation table of bulirsch_stoer(),
+// whose sequence of substeps is 2, 4, 6, ..., 2 * BS_MAX_COLUMNS
+#define BS_MAX_COLUMNS 9
+
+/*
+ * Gragg's modified midpoint method in the Stoermer form for x'' = a(x),
+ * i.e. n kick-drift-kick leapfrog steps of H / n, whose error is even
+ * in H / n. a must be the acceleration at x. Costs n force evaluations.
+ */
+static void bs_modified_midpoint(
+    int objects_count,
+    const real (*restrict x)[3],
+    const real (*restrict v)[3],
+    const real (*restrict a)[3],
+    real (*restrict x_1)[3],
+    real (*restrict v_1)[3],
+    real (*restrict a_1)[3],
+    const real *restrict m,
+    real G,
+    real H,
+    int n
+)
+{
+    real h = H / n;
+    for (int j = 0; j < objects_count; j++)
+    {
+        for (int k = 0; k < 3; k++)
+        {
+            v_1[j][k] = v[j][k] + 0.5 * h * a[j][k];
+            x_1[j][k] = x[j][k] + h * v_1[j][k];
+        }
+    }
+
+    for (int i = 1; i < n; i++)
+    {
+        acceleration(objects_count, x_1, a_1, m, G);
+        for (int j = 0; j < objects_count; j++)
+        {
+            for (int k = 0; k < 3; k++)
+            {
+                v_1[j][k] += h * a_1[j][k];
+                x_1[j][k] += h * v_1[j][k];
             }
         }
     }
 
-    return energy;
-    
-}
-
-WIN32DLL_API void acceleration(
-    int objects_count, 
-    const real (*restrict x)[3], 
-    real (*restrict a)[3], 
-    const real *restrict m, 
-    real G
-)
-{   
-    real R_norm, temp_value, temp_vec[3], R[3];
-
-    // Empty the input array
-    memset(a, 0, objects_count * 3 * sizeof(real));
-
-    for(int i = 0; i < objects_count; i++)
+    acceleration(objects_count, x_1, a_1, m, G);
+    for (int j = 0; j < objects_count; j++)
     {
-        for(int j = i + 1; j < objects_count; j++)
+        for (int k = 0; k < 3; k++)
         {
-            // Calculate \vec{R} and its norm
-            R[0] = x[i][0] - x[j][0];
-            R[1] = x[i][1] - x[j][1];
-            R[2] = x[i][2] - x[j][2];
-            R_norm = sqrt(R[0] * R[0] + R[1] * R[1] + R[2] * R[2]);
-
-            // Calculate the acceleration
-            temp_value = G / (R_norm * R_norm * R_norm);
-            temp_vec[0] = temp_value * R[0];
-            temp_vec[1] = temp_value * R[1];
-            temp_vec[2] = temp_value * R[2];
-            a[i][0] -= temp_vec[0] * m[j];
-            a[i][1] -= temp_vec[1] * m[j];
-            a[i][2] -= temp_vec[2] * m[j];
-            a[j][0] += temp_vec[0] * m[i];
-            a[j][1] += temp_vec[1] * m[i];
-            a[j][2] += temp_vec[2] * m[i];
+            v_1[j][k] += 0.5 * h * a_1[j][k];
         }
     }
 }
 
-WIN32DLL_API void euler(
-    int objects_count, 
-    real (*restrict x)[3], 
-    real (*restrict v)[3], 
-    const real *restrict m, 
-    real G, 
-    real dt,
-    int time_speed
+/*
+ * Gragg-Bulirsch-Stoer extrapolation with the order and step size control
+ * of ODEX. column is the column of the extrapolation table that is aimed
+ * for, between 2 and BS_MAX_COLUMNS - 2, and is updated with the time step.
+ * a must be the acceleration at x.
+ *
+ * Reference: Hairer, Norsett & Wanner, Solving Ordinary Differential
+ * Equations I, Section II.9
+ */
+WIN32DLL_API void bulirsch_stoer(
+    int objects_count,
+    real (*restrict x)[3],
+    real (*restrict v)[3],
+    real (*restrict a)[3],
+    const real *restrict m,
+    real G,
+    real expected_time_scale,
+    real *restrict t,
+    real *restrict dt,
+    int *restrict column,
+    int *restrict count,
+    int max_iteration,
+    int min_iteration,
+    real abs_tolerance,
+    real rel_tolerance,
+    Workspace *workspace
 )
-{   
-    real (*a)[3] = malloc(objects_count * 3 * sizeof(real));
+{
+    real t0 = *t;
+    int dim = objects_count * 3;
 
-    // Main Loop
-    for(int count = 0; count < time_speed; count++)
-    {   
-        acceleration(objects_count, x, a, m, G);
-        for (int j = 0; j < objects_count; j++)
-        {
-            // Calculation
-            x[j][0] += v[j][0] * dt;
-            x[j][1] += v[j][1] * dt;
-            x[j][2] += v[j][2] * dt;
-            v[j][0] += a[j][0] * dt;
-            v[j][1] += a[j][1] * dt;
-            v[j][2] += a[j][2] * dt;
-        }    
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
     }
+    workspace_reserve(workspace, (2 * BS_MAX_COLUMNS + 3) * dim);
 
-    free(a);
-}
+    // Row j of the table holds the state (x, v) of column j
+    real *table = workspace_alloc(workspace, BS_MAX_COLUMNS * 2 * dim);
+    real *y_1 = workspace_alloc(workspace, 2 * dim);
+    real (*x_1)[3] = (real (*)[3]) y_1;
+    real (*v_1)[3] = (real (*)[3]) (y_1 + dim);
+    real (*a_1)[3] = workspace_alloc(workspace, dim);
+    const real *y_x = (const real *) x;
+    const real *y_v = (const real *) v;
 
-WIN32DLL_API void euler_cromer(
-    int objects_count, 
-    real (*restrict x)[3], 
-    real (*restrict v)[3], 
-    const real *restrict m, 
-    real G, 
-    real dt,
-    int time_speed
-)
-{   
-    real (*a)[3] = malloc(objects_count * 3 * sizeof(real));
+    // Force evaluations of a step that ends at each column
+    int sequence[BS_MAX_COLUMNS];
+    real work[BS_MAX_COLUMNS];
+    for (int j = 0; j < BS_MAX_COLUMNS; j++)
+    {
+        sequence[j] = 2 * (j + 1);
+        work[j] = (j == 0 ? 1.0 : work[j - 1]) + sequence[j];
+    }
 
-    // Main Loop
-    for(int count = 0; count < time_speed; count++)
-    {   
-        acceleration(objects_count, x, a, m, G);
-        for (int j = 0; j < objects_count; j++)
+    real column_dt[BS_MAX_COLUMNS];
+    real work_per_time[BS_MAX_COLUMNS];
+    int is_last_rejected = 0;
+
+    *count = 0;
+    for (int i = 0; i < max_iteration; i++)
+    {
+        real H = *dt;
+        int k = *column;
+        int is_accepted = 0;
+        int j;
+        for (j = 0; j <= k + 1; j++)
         {
-            // Calculation
-            v[j][0] += a[j][0] * dt;
-            v[j][1] += a[j][1] * dt;
-            v[j][2] += a[j][2] * dt;
-            x[j][0] += v[j][0] * dt;
-            x[j][1] += v[j][1] * dt;
-            x[j][2] += v[j][2] * dt;
-        }    
-    }
-    
-    free(a);
-}
+            bs_modified_midpoint(objects_count, x, v, a, x_1, v_1, a_1, m, G, H, sequence[j]);
 
-WIN32DLL_API void rk4(
-    int objects_count, 
-    real (*restrict x)[3], 
-    real (*restrict v)[3], 
-    const real *restrict m, 
-    real G, 
-    real dt,
-    int time_speed
-)
-{
-    real (*temp_x)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*temp_v)[3] = malloc(objects_count * 3 * sizeof(real));
+            // Neville extrapolation to H = 0 in (H / n)^2
+            for (int e = 0; e < 2 * dim; e++)
+            {
+                real c = y_1[e];
+                for (int l = 1; l <= j; l++)
+                {
+                    real ratio = (real) sequence[j] / sequence[j - l];
+                    real next = c + (c - table[(l - 1) * 2 * dim + e]) / (ratio * ratio - 1.0);
+                    table[(l - 1) * 2 * dim + e] = c;
+                    c = next;
+                }
+                table[j * 2 * dim + e] = c;
+            }
 
-    real (*a)[3] = malloc(objects_count * 3 * sizeof(real));
+            if (j == 0)
+            {
+                continue;
+            }
 
-    real (*vk1)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*vk2)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*vk3)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*vk4)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*xk1)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*xk2)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*xk3)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*xk4)[3] = malloc(objects_count * 3 * sizeof(real));
+            // Error of the last two columns relative to the tolerance
+            real sum = 0.0;
+            for (int e = 0; e < 2 * dim; e++)
+            {
+                real y_0 = e < dim ? y_x[e] : y_v[e - dim];
+                real y_j = table[j * 2 * dim + e];
+                real tolerance_scale = abs_tolerance + fmax(fabs(y_0), fabs(y_j)) * rel_tolerance;
+                real delta = (y_j - table[(j - 1) * 2 * dim + e]) / tolerance_scale;
+                sum += delta * delta;
+            }
+            real error = sqrt(sum / (2 * dim));
 
-    // Main Loop
-    for(int count = 0; count < time_speed; count++)
-    {   
-        acceleration(objects_count, x, a, m, G);
-        memcpy(vk1, a, objects_count * 3 * sizeof(real));
-        memcpy(xk1, v, objects_count * 3 * sizeof(real));
+            real fac = 4.0;
+            if (error != 0.0)
+            {
+                fac = fmin(4.0, fmax(0.02, 0.94 * pow(0.65 / error, 1.0 / (2 * j + 1))));
+            }
+            column_dt[j] = H * fac;
+            work_per_time[j] = work[j] / column_dt[j];
 
-        for (int j = 0; j < objects_count; j++)
+            if (j < k - 1)
+            {
+                continue;
+            }
+            if (error <= 1.0 || H <= expected_time_scale * 1e-12)
+            {
+                is_accepted = 1;
+                break;
+            }
+
+            // Give up early if the error is not expected to converge by column k + 1
+            if (j == k - 1)
+            {
+                real ratio = (real) sequence[k] * sequence[k + 1] / (sequence[0] * sequence[0]);
+                if (error > ratio * ratio)
+                {
+                    break;
+                }
+            }
+            else if (j == k)
+            {
+                real ratio = (real) sequence[k + 1] / sequence[0];
+                if (error > ratio * ratio)
+                {
+                    break;
+                }
+            }
+        }
+        if (j > k + 1)
         {
-            temp_x[j][0] = x[j][0] + 0.5 * xk1[j][0] * dt;
-            temp_x[j][1] = x[j][1] + 0.5 * xk1[j][1] * dt;
-            temp_x[j][2] = x[j][2] + 0.5 * xk1[j][2] * dt;
-            temp_v[j][0] = v[j][0] + 0.5 * vk1[j][0] * dt;
-            temp_v[j][1] = v[j][1] + 0.5 * vk1[j][1] * dt;
-            temp_v[j][2] = v[j][2] + 0.5 * vk1[j][2] * dt;
+            j = k + 1;
         }
-        acceleration(objects_count, temp_x, a, m, G);
-        memcpy(vk2, a, objects_count * 3 * sizeof(real));
-        memcpy(xk2, temp_v, objects_count * 3 * sizeof(real));
 
-        for (int j = 0; j < objects_count; j++)
+        // Aim for the column with the least work per unit time
+        int new_column = j;
+        if (j >= 2 && work_per_time[j - 1] < 0.8 * work_per_time[j])
         {
-            temp_x[j][0] = x[j][0] + 0.5 * xk2[j][0] * dt;
-            temp_x[j][1] = x[j][1] + 0.5 * xk2[j][1] * dt;
-            temp_x[j][2] = x[j][2] + 0.5 * xk2[j][2] * dt;
-            temp_v[j][0] = v[j][0] + 0.5 * vk2[j][0] * dt;
-            temp_v[j][1] = v[j][1] + 0.5 * vk2[j][1] * dt;
-            temp_v[j][2] = v[j][2] + 0.5 * vk2[j][2] * dt;
+            new_column = j - 1;
         }
-        acceleration(objects_count, temp_x, a, m, G);
-        memcpy(vk3, a, objects_count * 3 * sizeof(real));
-        memcpy(xk3, temp_v, objects_count * 3 * sizeof(real));
-
-        for (int j = 0; j < objects_count; j++)
+        else if (is_accepted && (j == 1 || work_per_time[j] < 0.9 * work_per_time[j - 1]))
         {
-            temp_x[j][0] = x[j][0] + xk3[j][0] * dt;
-            temp_x[j][1] = x[j][1] + xk3[j][1] * dt;
-            temp_x[j][2] = x[j][2] + xk3[j][2] * dt;
-            temp_v[j][0] = v[j][0] + vk3[j][0] * dt;
-            temp_v[j][1] = v[j][1] + vk3[j][1] * dt;
-            temp_v[j][2] = v[j][2] + vk3[j][2] * dt;
+            new_column = j + 1;
         }
-        acceleration(objects_count, temp_x, a, m, G);
-        memcpy(vk4, a, objects_count * 3 * sizeof(real));
-        memcpy(xk4, temp_v, objects_count * 3 * sizeof(real));
-
-
-        for (int j = 0; j < objects_count; j++)
+        if (new_column < 2)
         {
-            // Calculation
-            v[j][0] += (vk1[j][0] + 2 * vk2[j][0] + 2 * vk3[j][0] + vk4[j][0]) * dt / 6.0;
-            v[j][1] += (vk1[j][1] + 2 * vk2[j][1] + 2 * vk3[j][1] + vk4[j][1]) * dt / 6.0;
-            v[j][2] += (vk1[j][2] + 2 * vk2[j][2] + 2 * vk3[j][2] + vk4[j][2]) * dt / 6.0;
-            x[j][0] += (xk1[j][0] + 2 * xk2[j][0] + 2 * xk3[j][0] + xk4[j][0]) * dt / 6.0;
-            x[j][1] += (xk1[j][1] + 2 * xk2[j][1] + 2 * xk3[j][1] + xk4[j][1]) * dt / 6.0;
-            x[j][2] += (xk1[j][2] + 2 * xk2[j][2] + 2 * xk3[j][2] + xk4[j][2]) * dt / 6.0;
-        }    
-    } 
+            new_column = 2;
+        }
+        else if (new_column > BS_MAX_COLUMNS - 2)
+        {
+            new_column = BS_MAX_COLUMNS - 2;
+        }
 
-    free(a);
-    free(temp_x);
-    free(temp_v);
-    free(vk1);
-    free(vk2);
-    free(vk3);
-    free(vk4);
-    free(xk1);
-    free(xk2);
-    free(xk3);
-    free(xk4);
+        real new_dt;
+        if (new_column > j)
+        {
+            new_dt = column_dt[j] * work[new_column] / work[j];
+        }
+        else
+        {
+            new_dt = column_dt[new_column];
+        }
 
-}
+        if (is_accepted)
+        {
+            memcpy(x, &table[j * 2 * dim], dim * sizeof(real));
+            memcpy(v, &table[j * 2 * dim + dim], dim * sizeof(real));
+            acceleration(objects_count, x, a, m, G);
+            *t += H;
+            (*count)++;
 
-WIN32DLL_API void leapfrog(
-    int objects_count, 
-    real (*restrict x)[3], 
-    real (*restrict v)[3], 
-    real (*restrict a)[3], 
-    const real *restrict m, 
-    real G, 
-    real dt,
-    int time_speed
-)
-{   
-    real (*a_0)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*a_1)[3] = malloc(objects_count * 3 * sizeof(real));
+            // No increase right after a rejected step
+            if (is_last_rejected)
+            {
+                new_column = new_column < k ? new_column : k;
+                new_dt = fmin(new_dt, H);
+            }
+            is_last_rejected = 0;
+        }
+        else
+        {
+            rejected_step_count++;
+            is_last_rejected = 1;
+        }
 
-    memcpy(a_1, a, objects_count * 3 * sizeof(real));
+        *column = new_column;
+        *dt = fmax(new_dt, expected_time_scale * 1e-12);
 
-    // Main Loop
-    for(int count = 0; count < time_speed; count++)
-    {       
-        // Use a_1 from last iteration as a_0
-        memcpy(a_0, a_1, objects_count * 3 * sizeof(real));
-        
-        for (int j = 0; j < objects_count; j++)
-        {
-            // Calculation
-            x[j][0] += v[j][0] * dt + 0.5 * a_0[j][0] * dt * dt;
-            x[j][1] += v[j][1] * dt + 0.5 * a_0[j][1] * dt * dt;
-            x[j][2] += v[j][2] * dt + 0.5 * a_0[j][2] * dt * dt;
-        }    
-        acceleration(objects_count, x, a_1, m, G);
-        for (int j = 0; j < objects_count; j++)
+        if (is_accepted && *count >= min_iteration && *t > (t0 + expected_time_scale * 1e-5))
         {
-            // Calculation
-            v[j][0] += 0.5 * (a_0[j][0] + a_1[j][0]) * dt;
-            v[j][1] += 0.5 * (a_0[j][1] + a_1[j][1]) * dt;
-            v[j][2] += 0.5 * (a_0[j][2] + a_1[j][2]) * dt;
-        }    
+            break;
+        }
     }
 
-    memcpy(a, a_1, objects_count * 3 * sizeof(real));
-
-    free(a_0);
-    free(a_1);
+    free_workspace(temp_workspace);
 }
 
 WIN32DLL_API void rk_embedded(
@@ -552,6 +3255,7 @@ WIN32DLL_API void rk_embedded(
     real expected_time_scale,
     real *restrict t, 
     real *restrict dt,
+    int *restrict count,
     int power,
     int power_test,
     int len_coeff,
@@ -562,7 +3266,8 @@ WIN32DLL_API void rk_embedded(
     int max_iteration,
     int min_iteration,
     real abs_tolerance,
-    real rel_tolerance
+    real rel_tolerance,
+    Workspace *workspace
 )
 {
     // Initialization
@@ -570,7 +3275,14 @@ WIN32DLL_API void rk_embedded(
     int stages = len_weights;
     int min_power = fmin(power, power_test);
 
-    real *error_estimation_delta_weights = malloc(len_weights * sizeof(real));
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, stages + (2 * stages + 9) * objects_count * 3);
+
+    real *error_estimation_delta_weights = workspace_alloc(workspace, stages);
     for (int stage = 0; stage < stages; stage++)
     {
         error_estimation_delta_weights[stage] = weights[stage] - weights_test[stage];
@@ -583,19 +3295,20 @@ WIN32DLL_API void rk_embedded(
 
     // Initialize arrays and values
     real sum, error, dt_new; 
-    real (*v_1)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*x_1)[3] = malloc(objects_count * 3 * sizeof(real));
-    real *vk = malloc(stages * objects_count * 3 * sizeof(real));
-    real *xk = malloc(stages * objects_count * 3 * sizeof(real));    
-    real (*temp_a)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*temp_v)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*temp_x)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*error_estimation_delta_v)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*error_estimation_delta_x)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*tolerance_scale_v)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*tolerance_scale_x)[3] = malloc(objects_count * 3 * sizeof(real));
+    real (*v_1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*x_1)[3] = workspace_alloc(workspace, objects_count * 3);
+    real *vk = workspace_alloc(workspace, stages * objects_count * 3);
+    real *xk = workspace_alloc(workspace, stages * objects_count * 3);
+    real (*temp_a)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*temp_v)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*temp_x)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*error_estimation_delta_v)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*error_estimation_delta_x)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*tolerance_scale_v)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*tolerance_scale_x)[3] = workspace_alloc(workspace, objects_count * 3);
 
     // Main Loop
+    *count = 0;
     for (int i = 0; i < max_iteration; i++)
     {
         // Calculate xk and vk
@@ -701,6 +3414,11 @@ WIN32DLL_API void rk_embedded(
             *t += *dt; 
             memcpy(x, x_1, objects_count * 3 * sizeof(real));
             memcpy(v, v_1, objects_count * 3 * sizeof(real));
+            (*count)++;
+        }
+        else
+        {
+            rejected_step_count++;
         }
 
         // Calculate dt
@@ -734,21 +3452,11 @@ WIN32DLL_API void rk_embedded(
         // Exit 
         if (i >= min_iteration && *t >= (t0 + expected_time_scale * 1e-5))
         {
-            free(error_estimation_delta_weights);
-            free(v_1);
-            free(x_1);
-            free(vk);
-            free(xk);
-            free(temp_a);
-            free(temp_v);
-            free(temp_x);
-            free(error_estimation_delta_v);
-            free(error_estimation_delta_x);
-            free(tolerance_scale_v);
-            free(tolerance_scale_x);
             break;
         }
     }
+
+    free_workspace(temp_workspace);
 }
 
 WIN32DLL_API void ias15(
@@ -776,7 +3484,9 @@ WIN32DLL_API void ias15(
     real exponent,
     int *restrict ias15_refine_flag,
     int max_iteration,
-    int min_iteration
+    int min_iteration,
+    real *restrict potential,
+    Workspace *workspace
 )
 {
     real t0 = *t;
@@ -784,20 +3494,29 @@ WIN32DLL_API void ias15(
     int dim_nodes_minus_1 = dim_nodes - 1;
     int dim_nodes_minus_2 = dim_nodes - 2;
 
+    Workspace *temp_workspace = NULL;
+    if (workspace == NULL)
+    {
+        workspace = temp_workspace = create_workspace(objects_count);
+    }
+    workspace_reserve(workspace, (2 * dim_nodes + 12) * objects_count * 3);
+
     // Arrays for ias15_step
-    real *aux_a = malloc(dim_nodes * objects_count * 3 * sizeof(real));
-    real (*temp_a)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*x_step)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*v_step)[3] = malloc(objects_count * 3 * sizeof(real));
-    real (*a_step)[3] = malloc(objects_count * 3 * sizeof(real));
-    real *delta_b7 = malloc(objects_count * 3 * sizeof(real));
+    real *aux_a = workspace_alloc(workspace, dim_nodes * objects_count * 3);
+    real (*temp_a)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*x_step)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*v_step)[3] = workspace_alloc(workspace, objects_count * 3);
+    real (*a_step)[3] = workspace_alloc(workspace, objects_count * 3);
+    real *delta_b7 = workspace_alloc(workspace, objects_count * 3);
 
     // Arrays for compute aux_g
-    real *F = malloc(8 * objects_count * 3 * sizeof(real));
+    real *F = workspace_alloc(workspace, 8 * objects_count * 3);
 
     // Array for refine aux_b
-    real *delta_aux_b = malloc(dim_nodes_minus_1 * objects_count * 3 * sizeof(real));
+    real *delta_aux_b = workspace_alloc(workspace, dim_nodes_minus_1 * objects_count * 3);
 
+    // Every ias15_step() is an accepted step
+    *count = 0;
     for (int i = 0; i < max_iteration; i++)
     {
         ias15_step(
@@ -832,22 +3551,19 @@ WIN32DLL_API void ias15(
             a_step,
             delta_b7,
             F,
-            delta_aux_b
+            delta_aux_b,
+            potential
         );
 
+        (*count)++;
+
         if (i >= min_iteration && *t > (t0 + expected_time_scale * 1e-5))
         {
-            free(aux_a);
-            free(temp_a);
-            free(x_step);
-            free(v_step);
-            free(a_step);
-            free(delta_b7); 
-            free(F);
-            free(delta_aux_b);
             break;
         }
     }
+
+    free_workspace(temp_workspace);
 }
 
 // Advance IAS15 for one step
@@ -883,7 +3599,8 @@ WIN32DLL_API void ias15_step(
     real (*restrict a)[3],
     real *restrict delta_b7,
     real *restrict F,
-    real *restrict delta_aux_b
+    real *restrict delta_aux_b,
+    real *restrict potential
 )
 {
     real error, error_b7, dt_new;
@@ -933,7 +3650,14 @@ WIN32DLL_API void ias15_step(
         memcpy(a, a0, objects_count * 3 * sizeof(real));
         ias15_approx_pos(objects_count, x, v, a, 1.0, aux_b, *dt);
         ias15_approx_vel(objects_count, v, a, 1.0, aux_b, *dt);
-        acceleration(objects_count, x, a, m, G);
+        if (potential != NULL)
+        {
+            *potential = acceleration_potential(objects_count, x, a, m, G);
+        }
+        else
+        {
+            acceleration(objects_count, x, a, m, G);
+        }
 
         // Estimate relative error
         error_b7 = abs_max_vec(&aux_b[dim_nodes_minus_2 * objects_count * 3], objects_count * 3) / abs_max_vec_array(a, objects_count);
@@ -959,6 +3683,10 @@ WIN32DLL_API void ias15_step(
             ias15_refine_aux_b(objects_count, dim_nodes_minus_1, aux_b, aux_e, delta_aux_b, *dt, dt_new, *ias15_refine_flag);
             *ias15_refine_flag = 1;
         }
+        else
+        {
+            rejected_step_count++;
+        }
 
         // Step size for the next iteration
         if (dt_new > (*dt / safety_fac))
@@ -0,0 +1,322 @@
+"""
+Headless batch runner for the gravity simulator
+
+Advances one of the built-in problems with the Simulator and integrators in
+main.py as fast as possible to a target simulation time, without a display,
+event loop or FPS cap.
+
+Usage:
+    python headless.py solar_system --tf 1e6 [-i ias15] [--tolerance 1e-9]
+    python headless.py figure_8 --tf 100 -i rk4 [--dt 1e-3] [--time-speed 1000]
+    python headless.py plummer -n 1000 --tf 10 -i leapfrog [--seed SEED]
+"""
+
+import argparse
+import math
+import time
+
+import pygame
+
+import main
+
+# Built-in problems and their expected time scale, as chosen by the menu
+PROBLEMS = {
+    "solar_system": (main.Grav_obj.create_solor_system, 1e5),
+    "figure_8": (main.Grav_obj.create_figure_8, 1e5),
+    "pyth_3_body": (main.Grav_obj.create_pyth_3_body, 1e2),
+}
+# Problems generated by main.INITIAL_CONDITIONS at a given N. In the units
+# of the simulator the crossing time of the clusters is about a day.
+GENERATED_PROBLEMS_EXPECTED_TIME_SCALE = 1e2
+
+INTEGRATORS = [
+    "euler",
+    "euler_cromer",
+    "rk4",
+    "leapfrog",
+    "forest_ruth",
+    "yoshida6",
+    "whfast",
+    "saba4",
+    "sbab4",
+    "block_leapfrog",
+    "rkf45",
+    "dopri",
+    "dverk",
+    "rkf78",
+    "ias15",
+    "hermite",
+    "bulirsch_stoer",
+]
+
+
+class Headless_stats:
+    """The statistics used by Simulator, without the statsboard"""
+
+    def __init__(self):
+        self.simulation_time = 0.0
+        self.total_energy = 0.0
+        self.objects_count = 0
+
+
+class Headless_grav_sim:
+    """
+    Stand-in for main.GravitySimulator with only what Simulator and Grav_obj
+    need, so that no display or event loop is required
+    """
+
+    def __init__(self, backend=None):
+        self.c_lib, self.backend = main.load_c_lib(backend)
+        self.is_c_lib = self.c_lib is not None
+        self.screen = None
+        self.camera = None
+        self.settings = main.Settings(0, 0)
+        self.stats = Headless_stats()
+        self.grav_objs = pygame.sprite.Group()
+        self.profiler = main.Profiler()
+        self.simulator = main.Simulator(self)
+
+    def load_problem(self, problem, objects_count=None, seed=0):
+        """
+        Replace the objects with one of the built-in PROBLEMS, or with
+        objects_count objects generated by one of main.INITIAL_CONDITIONS
+        """
+        if problem in PROBLEMS:
+            create_problem, expected_time_scale = PROBLEMS[problem]
+            self.grav_objs.empty()
+            create_problem(self)
+        elif problem in main.INITIAL_CONDITIONS:
+            if objects_count is None:
+                raise ValueError(f"The number of objects is required for {problem}.")
+            x, v, m = main.INITIAL_CONDITIONS[problem](objects_count, seed)
+            expected_time_scale = GENERATED_PROBLEMS_EXPECTED_TIME_SCALE
+            self.grav_objs.empty()
+            main.Grav_obj.create_from_arrays(self, x, v, m)
+        else:
+            raise ValueError(f"Unknown problem: {problem}.")
+
+        self.settings.expected_time_scale = expected_time_scale
+        self.stats.simulation_time = 0.0
+        self.stats.total_energy = 0.0
+        self.simulator.is_initialize = True
+        self.simulator.is_initialize_integrator = self.simulator.current_integrator
+
+    def set_integrator(self, integrator):
+        """Select the integrator, as clicking it on the statsboard does"""
+        if integrator not in INTEGRATORS:
+            raise ValueError(f"Unknown integrator: {integrator}.")
+
+        self.simulator.set_all_integrators_false()
+        setattr(self.simulator, f"is_{integrator}", True)
+        self.simulator.check_current_integrator()
+        self.simulator.is_initialize = True
+        self.simulator.is_initialize_integrator = integrator
+
+
+def set_batch(settings, batch):
+    """Make every call into the adaptive step size integrators take batch steps"""
+    # The setters keep min_iteration <= max_iteration
+    if batch < settings.max_iteration:
+        settings.min_iteration = batch
+        settings.max_iteration = batch
+    else:
+        settings.max_iteration = batch
+        settings.min_iteration = batch
+
+
+def run(grav_sim, tf, progress_interval=None):
+    """
+    Advance the loaded problem to the simulation time tf as fast as possible.
+    The batches of steps per call (time_speed for the fixed step size
+    integrators, see set_batch() for the adaptive ones) are shrunk towards
+    the end, so that tf is overshot by about one step at most.
+
+    :param progress_interval: Wall time in seconds between progress messages
+    :return: Summary of the run
+    :rtype: dict
+    """
+    simulator = grav_sim.simulator
+    stats = grav_sim.stats
+    settings = grav_sim.settings
+    time_speed = settings.time_speed
+    batch = settings.max_iteration
+    time_per_step = None
+
+    simulator.initialize_problem(grav_sim)
+    initial_energy = simulator.compute_total_energy()
+    initial_steps = simulator.steps
+    initial_acceleration_count = simulator.get_acceleration_count()
+    initial_rejected_step_count = simulator.get_rejected_step_count()
+    calls = 0
+
+    start = time.perf_counter()
+    last_progress = start
+    while tf - stats.simulation_time > 1e-12 * abs(tf):
+        remaining_time = tf - stats.simulation_time
+        settings.time_speed = max(
+            1, min(time_speed, math.ceil(remaining_time / settings.dt - 1e-6))
+        )
+        # The adaptive batches start from a single step and at most double,
+        # as the step size is still settling
+        if time_per_step is None:
+            set_batch(settings, 1)
+        else:
+            set_batch(
+                settings,
+                max(
+                    1,
+                    min(
+                        batch,
+                        2 * settings.max_iteration,
+                        math.ceil(remaining_time / time_per_step),
+                    ),
+                ),
+            )
+
+        simulation_time = stats.simulation_time
+        steps = simulator.steps
+        # Every call is a frame of the profiler
+        grav_sim.profiler.start_frame()
+        simulator.run_simulation(grav_sim)
+        grav_sim.profiler.end_frame()
+        calls += 1
+        if simulator.steps > steps:
+            time_per_step = (stats.simulation_time - simulation_time) / (
+                simulator.steps - steps
+            )
+
+        if not simulator.is_state_finite():
+            print("System message: stopped due to infinity energy error.")
+            break
+
+        if progress_interval is not None:
+            now = time.perf_counter()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                print(
+                    f"t = {stats.simulation_time:.6e} ({stats.simulation_time / tf:.1%}),"
+                    f" steps = {simulator.steps - initial_steps},"
+                    f" wall time = {now - start:.2f} s"
+                )
+    wall_time = time.perf_counter() - start
+    settings.time_speed = time_speed
+    set_batch(settings, batch)
+    # The energy diagnostics of the last call may be skipped
+    stats.total_energy = simulator.compute_total_energy()
+
+    steps = simulator.steps - initial_steps
+    return {
+        "backend": grav_sim.backend,
+        "integrator": simulator.current_integrator,
+        "objects_count": stats.objects_count,
+        "simulation_time": float(stats.simulation_time),
+        "steps": steps,
+        "calls": calls,
+        "acceleration_count": simulator.get_acceleration_count() - initial_acceleration_count,
+        "rejected_steps": simulator.get_rejected_step_count() - initial_rejected_step_count,
+        "wall_time": wall_time,
+        "steps_per_second": steps / wall_time if wall_time > 0 else math.inf,
+        "energy_error": float(abs((stats.total_energy - initial_energy) / initial_energy)),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("problem", choices=list(PROBLEMS) + list(main.INITIAL_CONDITIONS))
+    parser.add_argument(
+        "-n", type=int, default=1000, help="number of bodies of the generated problems"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated problems")
+    parser.add_argument(
+        "--tf", type=float, required=True, help="target simulation time (days)"
+    )
+    parser.add_argument(
+        "-i", "--integrator", choices=INTEGRATORS, default="rk4"
+    )
+    parser.add_argument(
+        "--dt", type=float, default=main.Settings.DEFAULT_DT,
+        help="time step of the fixed step size integrators",
+    )
+    parser.add_argument(
+        "--time-speed", type=int, default=1000,
+        help="fixed steps per call into the integrator",
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=main.Settings.DEFAULT_TOLERANCE,
+        help="tolerance of the adaptive step size integrators",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=100,
+        help="adaptive steps per call into the integrator",
+    )
+    parser.add_argument(
+        "--force-method", choices=main.FORCE_METHODS,
+        default=main.Settings.DEFAULT_FORCE_METHOD,
+    )
+    parser.add_argument("--theta", type=float, default=main.Settings.DEFAULT_OPENING_ANGLE)
+    parser.add_argument("--order", type=int, default=main.Settings.DEFAULT_FMM_ORDER)
+    parser.add_argument(
+        "--softening", choices=main.SOFTENING_KERNELS,
+        default=main.Settings.DEFAULT_SOFTENING_KERNEL,
+        help="softening kernel of the pair interactions",
+    )
+    parser.add_argument(
+        "--softening-length", type=float, default=main.Settings.DEFAULT_SOFTENING_LENGTH,
+        help="softening length (AU)",
+    )
+    parser.add_argument(
+        "--regularize", action="store_true",
+        help="Kustaanheimo-Stiefel regularization of the close pairs"
+        " by leapfrog, forest_ruth and yoshida6",
+    )
+    parser.add_argument(
+        "--regularization-radius", type=float,
+        default=main.Settings.DEFAULT_REGULARIZATION_RADIUS,
+        help="pairs closer than this are regularized (AU)",
+    )
+    parser.add_argument(
+        "--merge-collisions", action="store_true",
+        help="merge overlapping objects, see Simulator.merge_collisions()",
+    )
+    parser.add_argument("--threads", type=int, help="threads used by c_lib")
+    parser.add_argument("--backend", choices=["native", "wasm", "numpy"])
+    parser.add_argument(
+        "--progress", type=float, help="seconds between progress messages"
+    )
+    args = parser.parse_args()
+
+    grav_sim = Headless_grav_sim(args.backend)
+    settings = grav_sim.settings
+    settings.dt = args.dt
+    settings.time_speed = args.time_speed
+    settings.tolerance = args.tolerance
+    # Without frames to keep, every call does a full batch of steps
+    set_batch(settings, args.batch)
+    settings.force_method = args.force_method
+    settings.opening_angle = args.theta
+    settings.fmm_order = args.order
+    settings.softening_kernel = args.softening
+    settings.softening_length = args.softening_length
+    settings.is_regularizing = args.regularize
+    settings.regularization_radius = args.regularization_radius
+    settings.is_merging_collisions = args.merge_collisions
+    if args.threads is not None:
+        grav_sim.simulator.set_num_threads(args.threads)
+
+    grav_sim.set_integrator(args.integrator)
+    grav_sim.load_problem(args.problem, args.n, args.seed)
+    result = run(grav_sim, args.tf, args.progress)
+
+    print(f"Backend: {result['backend']}, threads: {grav_sim.simulator.num_threads}")
+    print(f"Problem: {args.problem} (N = {result['objects_count']}), integrator: {result['integrator']}")
+    print(f"Simulation time: {result['simulation_time']:.6e} days")
+    print(
+        f"Steps: {result['steps']} in {result['calls']} calls"
+        f" ({result['rejected_steps']} rejected), {result['acceleration_count']} force evaluations"
+    )
+    print(f"Wall time: {result['wall_time']:.3f} s ({result['steps_per_second']:.4g} steps/s)")
+    print(f"Relative energy error: {result['energy_error']:.3e}")
+
+
+if __name__ == "__main__":
+    main_cli()
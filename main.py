@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import ctypes
 import math
 from pathlib import Path
@@ -26,21 +27,13 @@ class GravitySimulator:
             camera: none
             stats: settings
             grav_objs: camera, settings
-            simulator: stats, settings
+            profiler: none
+            simulator: stats, settings, profiler
         """
-        # Use c library to perform simulation
-        self.is_c_lib = True
-        if self.is_c_lib:
-            try:
-                self.c_lib = ctypes.cdll.LoadLibrary(
-                    str(Path(__file__).parent / "c_lib.wasm")
-                )
-            except:
-                print("System message: Loading c_lib failed. Running with numpy.")
-                self.is_c_lib = False
-
-        if self.is_c_lib:
-            self.c_lib.compute_energy.restype = ctypes.c_double
+        # Use c library to perform simulation if available
+        self.c_lib, self.backend = load_c_lib()
+        self.is_c_lib = self.c_lib is not None
+        print(f"System message: Simulation backend: {self.backend}.")
 
         pygame.init()
 
@@ -58,17 +51,27 @@ class GravitySimulator:
         self.camera = Camera()
         self.stats = Stats(self)
         self.grav_objs = pygame.sprite.Group()
+        self.profiler = Profiler()
         self.simulator = Simulator(self)
 
     async def run_prog(self):
         """The main loop for the program"""
         while True:
+            self.profiler.start_frame()
             self._check_events()
+            self.profiler.lap("events")
             self._update_events()
+            self.profiler.lap("update")
+            # Simulator.run_simulation() records the simulation and energy laps,
+            # and the check of the state for infinity or NaN is an energy lap
             self._simulation()
             self._check_energy_error()
+            self.profiler.lap("energy")
             self._update_screen()
+            self.profiler.lap("screen")
             self.clock.tick(self.settings.MAX_FPS)
+            self.profiler.lap("idle")
+            self.profiler.end_frame()
             await asyncio.sleep(0)
 
     def _check_events(self):
@@ -91,16 +94,22 @@ class GravitySimulator:
 
     def _update_events(self):
         self.camera.update_movement()
+        self.simulator.remove_out_of_range_objects(self)
         self.grav_objs.update(self)
         self.stats.update(self)
 
     def _simulation(self):
         if self.grav_objs and not self.stats.is_paused:
             self.simulator.run_simulation(self)
-            self.simulator.unload_value(self)
 
     def _check_energy_error(self):
-        if math.isnan(self.stats.total_energy):
+        # The energy is not computed every frame, so the state is checked
+        # directly, see Simulator.is_energy_due()
+        if math.isnan(self.stats.total_energy) or (
+            self.grav_objs
+            and not self.stats.is_paused
+            and not self.simulator.is_state_finite()
+        ):
             self._kill_all_objects()
             print("System message: removed all objects due to infinity energy error.")
     
@@ -152,6 +161,8 @@ class GravitySimulator:
                 pygame.display.toggle_fullscreen()
             case pygame.K_h:
                 self.settings.is_hide_gui = not self.settings.is_hide_gui
+            case pygame.K_t:
+                self.settings.is_show_profiler = not self.settings.is_show_profiler
             case pygame.K_r:
                 self.settings.reset_parameters()
             case pygame.K_ESCAPE:
@@ -478,19 +489,31 @@ class Grav_obj(Sprite):
     ):
         super().__init__()
         self.screen = grav_sim.screen
-        self.screen_rect = self.screen.get_rect()
+        # There is no screen when running headless, see headless.py
+        if self.screen is not None:
+            self.screen_rect = self.screen.get_rect()
         self.camera = grav_sim.camera
         self.settings = grav_sim.settings
+        self.simulator = grav_sim.simulator
         self.params = params
         self.diameter = 2 * self.params["R"]
+
+        # The state of the object lives in the body store of the simulator
+        # once it is loaded by Simulator.initialize_problem(), which sets
+        # index to its row. Until then it is read from params.
+        self.index = None
         if name == "Sun":
-            self.img_diameter = self.diameter * self.settings.star_img_scale
+            self.img_scale = self.settings.star_img_scale
         else:
-            self.img_diameter = self.diameter * self.settings.planet_img_scale
+            self.img_scale = self.settings.planet_img_scale
+        self.img_diameter = self.diameter * self.img_scale
 
-        if img_path:
+        # Unscaled image, kept for set_radius()
+        self.original_image = None
+        if img_path and self.screen is not None:
             try:
                 load_image = pygame.image.load(img_path).convert_alpha()
+                self.original_image = load_image
                 self.image = pygame.transform.scale(
                     load_image, (self.img_diameter, self.img_diameter)
                 )
@@ -500,30 +523,52 @@ class Grav_obj(Sprite):
                     "Error: Image not found. Make sure the image path provided for Grav_obj is correct."
                 )
                 
+    @property
+    def x(self):
+        """Position of the object, as a view into the body store if loaded"""
+        if self.index is None:
+            return np.array([self.params["r1"], self.params["r2"], self.params["r3"]])
+        return self.simulator.x[self.index]
+
+    @property
+    def v(self):
+        """Velocity of the object, as a view into the body store if loaded"""
+        if self.index is None:
+            return np.array([self.params["v1"], self.params["v2"], self.params["v3"]])
+        return self.simulator.v[self.index]
+
+    @property
+    def m(self):
+        """Mass of the object"""
+        if self.index is None:
+            return self.params["m"]
+        return self.simulator.m[self.index]
+
+    def set_radius(self, R):
+        """Set the radius of the object, e.g. after a merger, and rescale its image"""
+        self.params["R"] = R
+        self.diameter = 2 * R
+        self.img_diameter = self.diameter * self.img_scale
+        if self.original_image is not None:
+            center = self.rect.center
+            self.image = pygame.transform.scale(
+                self.original_image, (self.img_diameter, self.img_diameter)
+            )
+            self.rect = self.image.get_rect(center=center)
+
     def update(self, gravity_sim):
-        if self.remove_out_of_range_objs():
-            gravity_sim.simulator.is_initialize = True   
-        else:
-            self.update_apparent_pos()
-
-    def remove_out_of_range_objs(self):
-        """Remove object when position is out of range"""
-        if abs(self.params["r1"]) > self.settings.MAX_RANGE or abs(self.params["r2"]) > self.settings.MAX_RANGE or abs(self.params["r3"]) > self.settings.MAX_RANGE:
-            self.kill()
-            print("System message: Out of range object removed.")
-            return True 
-        else:
-            return False  
-               
+        self.update_apparent_pos()
+
 
     def update_apparent_pos(self):
         """Update the apparent position of all grav_objs with camera"""
+        x = self.x
         try:
             self.rect.center = (
-                self.params["r1"] * self.settings.distance_scale
+                x[0] * self.settings.distance_scale
                 + self.screen_rect.centerx
                 - self.camera.pos[0],
-                -self.params["r2"] * self.settings.distance_scale
+                -x[1] * self.settings.distance_scale
                 + self.screen_rect.centery
                 - self.camera.pos[1],
             )
@@ -548,7 +593,8 @@ class Grav_obj(Sprite):
         # Check if two objects has the exact same position, which would causes error
         flag = True 
         for grav_obj in grav_sim.grav_objs:
-            if new_star_r1 == grav_obj.params["r1"] and new_star_r2 == grav_obj.params["r2"] and new_star_r3 == grav_obj.params["r3"]:
+            x = grav_obj.x
+            if new_star_r1 == x[0] and new_star_r2 == x[1] and new_star_r3 == x[2]:
                 flag = False
 
         if flag == True:
@@ -575,11 +621,7 @@ class Grav_obj(Sprite):
                 path_sun,
                 name="Sun",
             )
-            grav_sim.grav_objs.add(grav_obj)
-            grav_sim.simulator.is_initialize = True
-            grav_sim.simulator.is_initialize_integrator = (
-                grav_sim.simulator.current_integrator
-            )
+            grav_sim.simulator.add_objects(grav_sim, [grav_obj])
 
     @staticmethod
     def create_solor_system(grav_sim):
@@ -856,6 +898,37 @@ class Grav_obj(Sprite):
         grav_sim.grav_objs.add(object_2)
         grav_sim.grav_objs.add(object_3)
 
+    @staticmethod
+    def create_from_arrays(grav_sim, x, v, m):
+        """
+        Create an object for every row of x, v and m, e.g. from one of the
+        INITIAL_CONDITIONS generators.
+        As the generators use G = 1, the mass is converted by m / G.
+        """
+        main_dir_path = os.path.dirname(__file__)
+        path_sun = os.path.join(main_dir_path, "assets/images/sun.png")
+        m = np.asarray(m) / Grav_obj.G
+        grav_objs = []
+        for j in range(len(m)):
+            grav_objs.append(
+                Grav_obj(
+                    grav_sim,
+                    {
+                        "r1": x[j][0],
+                        "r2": x[j][1],
+                        "r3": x[j][2],
+                        "v1": v[j][0],
+                        "v2": v[j][1],
+                        "v3": v[j][2],
+                        "m": m[j],
+                        "R": Grav_obj.SOLAR_RADIUS * (m[j] ** (1.0 / 3.0)),
+                    },
+                    path_sun,
+                    name="Sun",
+                )
+            )
+        grav_sim.grav_objs.add(*grav_objs)
+
 
 class Menu:
     """A class to build the menu"""
@@ -1042,6 +1115,22 @@ class Settings:
     DEFAULT_MIN_ITERATION = 1
     DEFAULT_TOLERANCE = 1e-6
     DEFAULT_EXPECTED_TIME_SCALE = 1e4
+    DEFAULT_FORCE_METHOD = "direct"
+    DEFAULT_OPENING_ANGLE = 0.5
+    DEFAULT_FMM_ORDER = 4
+    DEFAULT_SOFTENING_KERNEL = "none"
+    DEFAULT_SOFTENING_LENGTH = 1e-3
+    # Kustaanheimo-Stiefel regularization of the close pairs, see
+    # regularized_pairs()
+    DEFAULT_IS_REGULARIZING = False
+    DEFAULT_REGULARIZATION_RADIUS = 1e-2
+    # Merge overlapping objects, see Simulator.merge_collisions()
+    DEFAULT_IS_MERGING_COLLISIONS = False
+    # The energy diagnostics run every energy_interval_frames frames or
+    # energy_interval_seconds of wall time, whichever comes first. Zero
+    # disables either, and both zero means every frame.
+    DEFAULT_ENERGY_INTERVAL_FRAMES = 0
+    DEFAULT_ENERGY_INTERVAL_SECONDS = 0.25
 
     MAX_STAR_IMG_SCALE = 100000
     MIN_STAR_IMG_SCALE = 1
@@ -1065,6 +1154,18 @@ class Settings:
     MIN_TOLERANCE = 1e-15
     MAX_EXPECTED_TIME_SCALE = 1e10
     MIN_EXPECTED_TIME_SCALE = 1
+    MAX_OPENING_ANGLE = 1.5
+    MIN_OPENING_ANGLE = 1e-2
+    MAX_FMM_ORDER = 8
+    MIN_FMM_ORDER = 1
+    MAX_SOFTENING_LENGTH = 1.0
+    MIN_SOFTENING_LENGTH = 1e-8
+    MAX_REGULARIZATION_RADIUS = 1.0
+    MIN_REGULARIZATION_RADIUS = 1e-8
+    MAX_ENERGY_INTERVAL_FRAMES = 100000
+    MIN_ENERGY_INTERVAL_FRAMES = 0
+    MAX_ENERGY_INTERVAL_SECONDS = 3600.0
+    MIN_ENERGY_INTERVAL_SECONDS = 0.0
 
     DEFAULT_CHANGE_STAR_IMG_SCALE_SPEED = 1000
     DEFAULT_CHANGE_PLANET_IMG_SCALE_SPEED = 10000
@@ -1092,9 +1193,20 @@ class Settings:
         self._min_iteration = self.DEFAULT_MIN_ITERATION
         self.tolerance = self.DEFAULT_TOLERANCE
         self.expected_time_scale = self.DEFAULT_EXPECTED_TIME_SCALE
+        self.force_method = self.DEFAULT_FORCE_METHOD
+        self.opening_angle = self.DEFAULT_OPENING_ANGLE
+        self.fmm_order = self.DEFAULT_FMM_ORDER
+        self.softening_kernel = self.DEFAULT_SOFTENING_KERNEL
+        self.softening_length = self.DEFAULT_SOFTENING_LENGTH
+        self.is_regularizing = self.DEFAULT_IS_REGULARIZING
+        self.regularization_radius = self.DEFAULT_REGULARIZATION_RADIUS
+        self.is_merging_collisions = self.DEFAULT_IS_MERGING_COLLISIONS
+        self.energy_interval_frames = self.DEFAULT_ENERGY_INTERVAL_FRAMES
+        self.energy_interval_seconds = self.DEFAULT_ENERGY_INTERVAL_SECONDS
         self.set_all_parameters_changing_false()
         self.current_changing_parameter = None
         self.is_hide_gui = False
+        self.is_show_profiler = False
 
     def scroll_change_parameters(self, magnitude):
         match self.current_changing_parameter:
@@ -1172,6 +1284,24 @@ class Settings:
             case "tolerance":
                 for _ in range(abs(magnitude)):
                     self.tolerance += self._rate_of_change(self.tolerance, magnitude)
+            case "opening_angle":
+                for _ in range(abs(magnitude)):
+                    self.opening_angle += self._rate_of_change(
+                        self.opening_angle, magnitude
+                    )
+            case "fmm_order":
+                for _ in range(abs(magnitude)):
+                    self.fmm_order += self._rate_of_change(self.fmm_order, magnitude)
+            case "softening_length":
+                for _ in range(abs(magnitude)):
+                    self.softening_length += self._rate_of_change(
+                        self.softening_length, magnitude
+                    )
+            case "regularization_radius":
+                for _ in range(abs(magnitude)):
+                    self.regularization_radius += self._rate_of_change(
+                        self.regularization_radius, magnitude
+                    )
 
     @staticmethod
     def _rate_of_change(x: float, magnitude: int) -> float:
@@ -1204,6 +1334,14 @@ class Settings:
             self.current_changing_parameter = "min_iteration"
         elif self.is_changing_tolerance == True:
             self.current_changing_parameter = "tolerance"
+        elif self.is_changing_opening_angle == True:
+            self.current_changing_parameter = "opening_angle"
+        elif self.is_changing_fmm_order == True:
+            self.current_changing_parameter = "fmm_order"
+        elif self.is_changing_softening_length == True:
+            self.current_changing_parameter = "softening_length"
+        elif self.is_changing_regularization_radius == True:
+            self.current_changing_parameter = "regularization_radius"
 
     def set_all_parameters_changing_false(self):
         self.is_changing_star_img_scale = False
@@ -1216,6 +1354,10 @@ class Settings:
         self.is_changing_max_iteration = False
         self.is_changing_min_iteration = False
         self.is_changing_tolerance = False
+        self.is_changing_opening_angle = False
+        self.is_changing_fmm_order = False
+        self.is_changing_softening_length = False
+        self.is_changing_regularization_radius = False
 
     def reset_parameters(self):
         self.star_img_scale = self.DEFAULT_STAR_IMG_SCALE
@@ -1228,6 +1370,26 @@ class Settings:
         self.max_iteration = self.DEFAULT_MAX_ITERATION
         self.min_iteration = self.DEFAULT_MIN_ITERATION
         self.tolerance = self.DEFAULT_TOLERANCE
+        self.force_method = self.DEFAULT_FORCE_METHOD
+        self.opening_angle = self.DEFAULT_OPENING_ANGLE
+        self.fmm_order = self.DEFAULT_FMM_ORDER
+        self.softening_kernel = self.DEFAULT_SOFTENING_KERNEL
+        self.softening_length = self.DEFAULT_SOFTENING_LENGTH
+        self.is_regularizing = self.DEFAULT_IS_REGULARIZING
+        self.regularization_radius = self.DEFAULT_REGULARIZATION_RADIUS
+        self.is_merging_collisions = self.DEFAULT_IS_MERGING_COLLISIONS
+
+    def switch_force_method(self):
+        """Switch to the next force evaluation method in FORCE_METHODS"""
+        self.force_method = FORCE_METHODS[
+            (FORCE_METHODS.index(self.force_method) + 1) % len(FORCE_METHODS)
+        ]
+
+    def switch_softening_kernel(self):
+        """Switch to the next softening kernel in SOFTENING_KERNELS"""
+        self.softening_kernel = SOFTENING_KERNELS[
+            (SOFTENING_KERNELS.index(self.softening_kernel) + 1) % len(SOFTENING_KERNELS)
+        ]
 
     @property
     def screen_width(self):
@@ -1400,12 +1562,102 @@ class Settings:
         else:
             self._expected_time_scale = value
 
+    @property
+    def opening_angle(self):
+        return self._opening_angle
+
+    @opening_angle.setter
+    def opening_angle(self, value):
+        if value > self.MAX_OPENING_ANGLE:
+            self._opening_angle = self.MAX_OPENING_ANGLE
+        elif value < self.MIN_OPENING_ANGLE:
+            self._opening_angle = self.MIN_OPENING_ANGLE
+        else:
+            self._opening_angle = round(value, ndigits=15)
+
+    @property
+    def fmm_order(self):
+        return self._fmm_order
+
+    @fmm_order.setter
+    def fmm_order(self, value):
+        if value > self.MAX_FMM_ORDER:
+            self._fmm_order = self.MAX_FMM_ORDER
+        elif value < self.MIN_FMM_ORDER:
+            self._fmm_order = self.MIN_FMM_ORDER
+        else:
+            self._fmm_order = int(value)
+
+    @property
+    def softening_length(self):
+        return self._softening_length
+
+    @softening_length.setter
+    def softening_length(self, value):
+        if value > self.MAX_SOFTENING_LENGTH:
+            self._softening_length = self.MAX_SOFTENING_LENGTH
+        elif value < self.MIN_SOFTENING_LENGTH:
+            self._softening_length = self.MIN_SOFTENING_LENGTH
+        else:
+            self._softening_length = round(value, ndigits=15)
+
+    @property
+    def regularization_radius(self):
+        return self._regularization_radius
+
+    @regularization_radius.setter
+    def regularization_radius(self, value):
+        if value > self.MAX_REGULARIZATION_RADIUS:
+            self._regularization_radius = self.MAX_REGULARIZATION_RADIUS
+        elif value < self.MIN_REGULARIZATION_RADIUS:
+            self._regularization_radius = self.MIN_REGULARIZATION_RADIUS
+        else:
+            self._regularization_radius = round(value, ndigits=15)
+
+    @property
+    def energy_interval_frames(self):
+        return self._energy_interval_frames
+
+    @energy_interval_frames.setter
+    def energy_interval_frames(self, value):
+        if value > self.MAX_ENERGY_INTERVAL_FRAMES:
+            self._energy_interval_frames = self.MAX_ENERGY_INTERVAL_FRAMES
+        elif value < self.MIN_ENERGY_INTERVAL_FRAMES:
+            self._energy_interval_frames = self.MIN_ENERGY_INTERVAL_FRAMES
+        else:
+            self._energy_interval_frames = int(value)
+
+    @property
+    def energy_interval_seconds(self):
+        return self._energy_interval_seconds
+
+    @energy_interval_seconds.setter
+    def energy_interval_seconds(self, value):
+        if value > self.MAX_ENERGY_INTERVAL_SECONDS:
+            self._energy_interval_seconds = self.MAX_ENERGY_INTERVAL_SECONDS
+        elif value < self.MIN_ENERGY_INTERVAL_SECONDS:
+            self._energy_interval_seconds = self.MIN_ENERGY_INTERVAL_SECONDS
+        else:
+            self._energy_interval_seconds = value
+
 
 class FIXED_STEP_SIZE_INTEGRATOR:
-    """Fixed step size integrators: Euler, Euler Cromer, RK4, Leap Frog"""
+    """
+    Fixed step size integrators: Euler, Euler Cromer, RK4, Leap Frog and
+    the Forest-Ruth and Yoshida compositions of leapfrog
+    """
+
+    def __init__(self):
+        # Potential energy returned by c_lib.leapfrog() and
+        # c_lib.leapfrog_composition()
+        self.c_potential = ctypes.c_double(0.0)
 
     def simulation(self, simulator, integrator, objects_count, m, G, dt, time_speed):
         if simulator.is_c_lib == True:
+            x_pointer = simulator.c_lib_pointer("x", simulator.x)
+            v_pointer = simulator.c_lib_pointer("v", simulator.v)
+            a_pointer = simulator.c_lib_pointer("a", simulator.a)
+            m_pointer = simulator.c_lib_pointer("m", m)
             match integrator:
                 case "euler":
                     if (
@@ -1415,13 +1667,14 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         simulator.is_initialize = False
 
                     simulator.c_lib.euler(
-                        ctypes.c_int(objects_count), 
-                        simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        ctypes.c_double(G), 
-                        ctypes.c_double(dt), 
-                        ctypes.c_int(time_speed)
+                        objects_count,
+                        x_pointer,
+                        v_pointer,
+                        m_pointer,
+                        G,
+                        dt,
+                        time_speed,
+                        simulator.c_lib_workspace,
                     )
                 
                 case "euler_cromer":
@@ -1432,13 +1685,14 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         simulator.is_initialize = False
 
                     simulator.c_lib.euler_cromer(
-                        ctypes.c_int(objects_count), 
-                        simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        ctypes.c_double(G), 
-                        ctypes.c_double(dt), 
-                        ctypes.c_int(time_speed)
+                        objects_count,
+                        x_pointer,
+                        v_pointer,
+                        m_pointer,
+                        G,
+                        dt,
+                        time_speed,
+                        simulator.c_lib_workspace,
                     )
 
                 case "rk4":
@@ -1449,13 +1703,14 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         simulator.is_initialize = False
 
                     simulator.c_lib.rk4(
-                        ctypes.c_int(objects_count), 
-                        simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        ctypes.c_double(G), 
-                        ctypes.c_double(dt), 
-                        ctypes.c_int(time_speed)
+                        objects_count,
+                        x_pointer,
+                        v_pointer,
+                        m_pointer,
+                        G,
+                        dt,
+                        time_speed,
+                        simulator.c_lib_workspace,
                     )
 
                 case "leapfrog":
@@ -1464,24 +1719,54 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         and simulator.is_initialize_integrator == "leapfrog"
                     ):
                         simulator.c_lib.acceleration(
-                            ctypes.c_int(objects_count), 
-                            simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                            simulator.a.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                            m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                            ctypes.c_double(G), 
+                            objects_count, x_pointer, a_pointer, m_pointer, G
                         )
                         simulator.is_initialize = False
 
                     simulator.c_lib.leapfrog(
-                        ctypes.c_int(objects_count), 
-                        simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        simulator.a.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                        ctypes.c_double(G), 
-                        ctypes.c_double(dt), 
-                        ctypes.c_int(time_speed)
+                        objects_count,
+                        x_pointer,
+                        v_pointer,
+                        a_pointer,
+                        m_pointer,
+                        G,
+                        dt,
+                        time_speed,
+                        ctypes.byref(self.c_potential) if simulator.is_potential_requested else None,
+                        simulator.c_lib_workspace,
+                    )
+                    if simulator.is_potential_requested:
+                        simulator.potential_energy = self.c_potential.value
+
+                case "forest_ruth" | "yoshida6":
+                    if (
+                        simulator.is_initialize == True
+                        and simulator.is_initialize_integrator == integrator
+                    ):
+                        self.drift_coeff, self.kick_coeff = (
+                            symplectic_composition_coefficients(integrator)
+                        )
+                        simulator.c_lib.acceleration(
+                            objects_count, x_pointer, a_pointer, m_pointer, G
+                        )
+                        simulator.is_initialize = False
+
+                    simulator.c_lib.leapfrog_composition(
+                        objects_count,
+                        x_pointer,
+                        v_pointer,
+                        a_pointer,
+                        m_pointer,
+                        G,
+                        dt,
+                        time_speed,
+                        len(self.drift_coeff),
+                        simulator.c_lib_pointer("drift_coeff", self.drift_coeff),
+                        simulator.c_lib_pointer("kick_coeff", self.kick_coeff),
+                        ctypes.byref(self.c_potential) if simulator.is_potential_requested else None,
                     )
+                    if simulator.is_potential_requested:
+                        simulator.potential_energy = self.c_potential.value
 
         elif simulator.is_c_lib == False:
             match integrator:
@@ -1530,7 +1815,32 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         )
                         simulator.is_initialize = False
 
-                    simulator.x, simulator.v, simulator.a = self._leapfrog(
+                    simulator.x, simulator.v, simulator.a, simulator.potential_energy = self._leapfrog(
+                        objects_count,
+                        simulator.x,
+                        simulator.v,
+                        simulator.a,
+                        m,
+                        G,
+                        dt,
+                        time_speed,
+                        simulator.is_potential_requested,
+                    )
+
+                case "forest_ruth" | "yoshida6":
+                    if (
+                        simulator.is_initialize == True
+                        and simulator.is_initialize_integrator == integrator
+                    ):
+                        self.drift_coeff, self.kick_coeff = (
+                            symplectic_composition_coefficients(integrator)
+                        )
+                        simulator.a = acceleration(
+                            objects_count, simulator.x, m, G
+                        )
+                        simulator.is_initialize = False
+
+                    simulator.x, simulator.v, simulator.a, simulator.potential_energy = self._leapfrog_composition(
                         objects_count,
                         simulator.x,
                         simulator.v,
@@ -1539,8 +1849,12 @@ class FIXED_STEP_SIZE_INTEGRATOR:
                         G,
                         dt,
                         time_speed,
+                        self.drift_coeff,
+                        self.kick_coeff,
+                        simulator.is_potential_requested,
                     )
 
+        return time_speed
 
     @staticmethod
     def _euler(objects_count, x, v, m, G, dt, time_speed):
@@ -1581,15 +1895,59 @@ class FIXED_STEP_SIZE_INTEGRATOR:
         return x, v
 
     @staticmethod
-    def _leapfrog(objects_count, x, v, a, m, G, dt, time_speed):
+    def _leapfrog(objects_count, x, v, a, m, G, dt, time_speed, is_potential=False):
+        # The regularized drifts need the kick-drift-kick form
+        if regularization_radius > 0.0 and softening_kernel == "none":
+            return FIXED_STEP_SIZE_INTEGRATOR._leapfrog_composition(
+                objects_count, x, v, a, m, G, dt, time_speed, [1.0], [0.5, 0.5], is_potential
+            )
+
         a_1 = a
-        for _ in range(time_speed):
+        potential = None
+        for i in range(time_speed):
             a_0 = a_1
             x = x + v * dt + a_0 * 0.5 * dt * dt
-            a_1 = acceleration(objects_count, x, m, G)
+            # The potential energy is a by-product of the last force evaluation
+            if is_potential and i == time_speed - 1:
+                a_1, potential = acceleration_potential(objects_count, x, m, G)
+            else:
+                a_1 = acceleration(objects_count, x, m, G)
             v = v + (a_0 + a_1) * 0.5 * dt
 
-        return x, v, a_1
+        return x, v, a_1, potential
+
+    @staticmethod
+    def _leapfrog_composition(
+        objects_count, x, v, a, m, G, dt, time_speed, drift_coeff, kick_coeff, is_potential=False
+    ):
+        """
+        Advance time_speed steps K(d_0) D(c_0) K(d_1) ... D(c_{s-1}) K(d_s)
+        of a composition of leapfrog, see symplectic_composition_coefficients().
+        The first kick of a step uses the force of the last kick of the
+        previous step (FSAL), so a must be the acceleration at x. The pairs
+        of regularized_pairs() are chosen at the start of every step, and
+        their mutual force is integrated exactly by the drifts instead of
+        the kicks.
+
+        :rtype: numpy.array, numpy.array, numpy.array, float
+        """
+        stages = len(drift_coeff)
+        potential = None
+        for i in range(time_speed):
+            pairs = regularized_pairs(x, m)
+            v = v + remove_pair_acceleration(a, x, m, G, pairs) * (kick_coeff[0] * dt)
+            for stage in range(stages):
+                x, v = regularized_drift(x, v, m, G, drift_coeff[stage] * dt, pairs)
+                # The potential energy is a by-product of the last force evaluation
+                if is_potential and i == time_speed - 1 and stage == stages - 1:
+                    a, potential = acceleration_potential(objects_count, x, m, G)
+                else:
+                    a = acceleration(objects_count, x, m, G)
+                v = v + remove_pair_acceleration(a, x, m, G, pairs) * (
+                    kick_coeff[stage + 1] * dt
+                )
+
+        return x, v, a, potential
 
 
 class IAS15:
@@ -1610,6 +1968,46 @@ class IAS15:
         self.nodes, self.dim_nodes = self._ias15_radau_spacing()
         self.aux_c = self._ias15_aux_c()    
         self.aux_r = self._ias15_aux_r()
+        self.aux_refine = self._ias15_aux_refine()
+        self.approx_coeff = self._ias15_approx_coeff(self.nodes)
+
+        # Auxiliary variables, allocated when the integrator is initialized
+        self.aux_b0 = None
+        self.aux_b = None
+        self.aux_g = None
+        self.aux_e = None
+
+        # Work buffers of the numpy path, allocated for the current objects_count
+        self.aux_a = None
+        self.aux_x = None
+        self.aux_v = None
+        self.delta_aux_b = None
+        self.delta_b7 = None
+
+        # Arguments passed by reference to c_lib.ias15()
+        self.c_count = ctypes.c_int(0)
+        self.c_simulation_time = ctypes.c_double(0.0)
+        self.c_dt = ctypes.c_double(0.0)
+        self.c_ias15_refine_flag = ctypes.c_int(0)
+        self.c_potential = ctypes.c_double(0.0)
+
+    def resize_objects(self, keep, added_count, reset_rows):
+        """
+        Keep the objects selected by the boolean mask keep in the auxiliary
+        variables and append zeros for added_count new objects, so that the
+        step size and the predictor survive adding or removing objects.
+        The rows in reset_rows are zeroed as for new objects.
+        """
+        if self.aux_b is None or self.aux_b.shape[1] != len(keep):
+            return
+
+        new_rows = np.zeros((self.dim_nodes - 1, added_count, 3))
+        self.aux_b0 = np.concatenate((self.aux_b0[:, keep], new_rows), axis=1)
+        self.aux_b = np.concatenate((self.aux_b[:, keep], new_rows), axis=1)
+        self.aux_g = np.concatenate((self.aux_g[:, keep], new_rows), axis=1)
+        self.aux_e = np.concatenate((self.aux_e[:, keep], new_rows), axis=1)
+        for aux in (self.aux_b0, self.aux_b, self.aux_g, self.aux_e):
+            aux[:, reset_rows] = 0.0
 
     def simulation(self, simulator, objects_count, m, G, tolerance, expected_time_scale, max_iteration, min_iteration):
         if simulator.is_initialize == True and simulator.is_initialize_integrator == "ias15":
@@ -1629,57 +2027,63 @@ class IAS15:
         
         # Simulation
         if simulator.is_c_lib == True:
-            count = ctypes.c_int(0)
-            temp_simulation_time = ctypes.c_double(simulator.stats.simulation_time)
-            temp_dt = ctypes.c_double(self.dt)
-            temp_ias15_refine_flag = ctypes.c_int(self.ias15_refine_flag)
+            self.c_count.value = 0
+            self.c_simulation_time.value = simulator.stats.simulation_time
+            self.c_dt.value = self.dt
+            self.c_ias15_refine_flag.value = self.ias15_refine_flag
 
             simulator.c_lib.ias15(
-                ctypes.c_int(objects_count), 
-                simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                simulator.a.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                ctypes.c_double(G), 
-                ctypes.c_int(self.dim_nodes),
-                self.nodes.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_c.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_r.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_b0.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_b.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_g.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                self.aux_e.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                ctypes.byref(temp_simulation_time), 
-                ctypes.byref(temp_dt),
-                ctypes.c_double(expected_time_scale),
-                ctypes.byref(count),
-                ctypes.c_double(tolerance),
-                ctypes.c_double(self.tolerance_pc),
-                ctypes.c_double(self.safety_fac),
-                ctypes.c_double(self.exponent),
-                ctypes.byref(temp_ias15_refine_flag),
-                ctypes.c_int(max_iteration),
-                ctypes.c_int(min_iteration),
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("a", simulator.a),
+                simulator.c_lib_pointer("m", m),
+                G,
+                self.dim_nodes,
+                simulator.c_lib_pointer("ias15_nodes", self.nodes),
+                simulator.c_lib_pointer("ias15_aux_c", self.aux_c),
+                simulator.c_lib_pointer("ias15_aux_r", self.aux_r),
+                simulator.c_lib_pointer("ias15_aux_b0", self.aux_b0),
+                simulator.c_lib_pointer("ias15_aux_b", self.aux_b),
+                simulator.c_lib_pointer("ias15_aux_g", self.aux_g),
+                simulator.c_lib_pointer("ias15_aux_e", self.aux_e),
+                self.c_simulation_time,
+                self.c_dt,
+                expected_time_scale,
+                self.c_count,
+                tolerance,
+                self.tolerance_pc,
+                self.safety_fac,
+                self.exponent,
+                self.c_ias15_refine_flag,
+                max_iteration,
+                min_iteration,
+                ctypes.byref(self.c_potential) if simulator.is_potential_requested else None,
+                simulator.c_lib_workspace,
             )
-            simulator.stats.simulation_time = temp_simulation_time.value
-            self.dt = temp_dt.value
-            self.ias15_refine_flag = temp_ias15_refine_flag.value
+            if simulator.is_potential_requested:
+                simulator.potential_energy = self.c_potential.value
+            simulator.stats.simulation_time = self.c_simulation_time.value
+            self.dt = self.c_dt.value
+            self.ias15_refine_flag = self.c_ias15_refine_flag.value
+            count = self.c_count.value
 
         elif simulator.is_c_lib == False:
+            if self.aux_a is None or self.aux_a.shape[1] != objects_count:
+                self.aux_a = np.zeros((self.dim_nodes, objects_count, 3))
+                self.aux_x = np.zeros((objects_count, 3))
+                self.aux_v = np.zeros((objects_count, 3))
+                self.delta_aux_b = np.zeros((self.dim_nodes - 1, objects_count, 3))
+                self.delta_b7 = np.zeros((objects_count, 3))
+
             count = 0
             t0 = simulator.stats.simulation_time
             for _ in range(max_iteration):
                 (
-                    simulator.x,
-                    simulator.v,
-                    simulator.a,
                     simulator.stats.simulation_time,
                     self.dt,
-                    self.aux_g,
-                    self.aux_b,
-                    self.aux_e,
-                    self.aux_b0,
                     self.ias15_refine_flag,
+                    simulator.potential_energy,
                 ) = self._ias15_step(
                     objects_count,
                     simulator.x,
@@ -1698,6 +2102,13 @@ class IAS15:
                     self.aux_e,
                     self.aux_g,
                     self.aux_r,
+                    self.aux_refine,
+                    self.approx_coeff,
+                    self.aux_a,
+                    self.aux_x,
+                    self.aux_v,
+                    self.delta_aux_b,
+                    self.delta_b7,
                     tolerance,
                     self.tolerance_pc,
                     self.exponent,
@@ -1708,11 +2119,14 @@ class IAS15:
                     self._ias15_compute_aux_b,
                     self._ias15_compute_aux_g,
                     self._ias15_refine_aux_b,
+                    simulator.is_potential_requested,
                 )
 
                 count += 1
                 if count >= min_iteration and simulator.stats.simulation_time > (t0 + expected_time_scale * 1e-5):
                     break
+
+        return count
     
     @staticmethod
     def _ias15_step(
@@ -1733,6 +2147,13 @@ class IAS15:
         aux_e,
         aux_g,
         aux_r,
+        aux_refine,
+        approx_coeff,
+        aux_a,
+        x,
+        v,
+        delta_aux_b,
+        delta_b7,
         tolerance,
         tolerance_pc,
         exponent,
@@ -1743,41 +2164,50 @@ class IAS15:
         ias15_compute_aux_b,
         ias15_compute_aux_g,
         ias15_refine_aux_b,
+        is_potential=False,
     ):
         """
-        Advance IAS15 for one step
+        Advance IAS15 for one step. x0, v0, a0 and the auxiliary variables
+        are updated in place, and aux_a, x, v, delta_aux_b and delta_b7 are
+        work buffers. The potential energy at the end of the step is
+        returned if is_potential is set, or None otherwise.
         """
+        global rejected_step_count
+
         # Main Loop
         ias15_integrate_flag = 0
-        aux_a = np.zeros((dim_nodes, objects_count, 3))
         while True:
             # Loop for predictor-corrector algorithm
             # 12 = max iterations
             for _ in range(12):
                 # Advance along the Gauss-Radau sequence
                 for i in range(dim_nodes):
-                    # Estimate position and velocity with current aux_b and nodes
-                    x = ias15_approx_pos(x0, v0, a0, nodes[i], aux_b, dt)
-                    v = ias15_approx_vel(v0, a0, nodes[i], aux_b, dt)
+                    # Estimate position with current aux_b and nodes, the
+                    # velocity is not needed by the force function
+                    ias15_approx_pos(x, x0, v0, a0, nodes[i], approx_coeff[i, 0], aux_b, dt)
 
                     # Evaluate force function and store result
                     aux_a[i] = acceleration(objects_count, x, m, G)
-                    aux_g = ias15_compute_aux_g(aux_g, aux_r, aux_a, i)
-                    aux_b = ias15_compute_aux_b(aux_b, aux_g, aux_c, i)
+                    ias15_compute_aux_g(aux_g, aux_r, aux_a, i)
+                    ias15_compute_aux_b(aux_b, aux_g, aux_c, i)
 
                 # Estimate convergence
-                delta_b7 = aux_b[-1] - aux_b0[-1]
-                aux_b0 = aux_b
-                if np.max(np.abs(delta_b7)) / np.max(np.abs(aux_a[-1])) < tolerance_pc:
+                np.subtract(aux_b[-1], aux_b0[-1], out=delta_b7)
+                aux_b0[...] = aux_b
+                if _abs_max(delta_b7) / _abs_max(aux_a[-1]) < tolerance_pc:
                     break
-                
+
             # Advance step
-            x = ias15_approx_pos(x0, v0, a0, 1.0, aux_b, dt)
-            v = ias15_approx_vel(v0, a0, 1.0, aux_b, dt)
-            a = acceleration(objects_count, x, m, G)
+            ias15_approx_pos(x, x0, v0, a0, 1.0, approx_coeff[-1, 0], aux_b, dt)
+            ias15_approx_vel(v, v0, a0, 1.0, approx_coeff[-1, 1], aux_b, dt)
+            if is_potential:
+                a, potential = acceleration_potential(objects_count, x, m, G)
+            else:
+                a = acceleration(objects_count, x, m, G)
+                potential = None
 
             # Estimate relative error
-            error_b7 = np.max(np.abs(aux_b[-1])) / np.max(np.abs(a))
+            error_b7 = _abs_max(aux_b[-1]) / _abs_max(a)
             error = (error_b7 / tolerance) ** exponent
             
             # Step-size for the next step
@@ -1791,17 +2221,15 @@ class IAS15:
                 # Report accepted step
                 ias15_integrate_flag = 1
                 t += dt
-                aux_b, aux_e = ias15_refine_aux_b(
-                    aux_b, aux_e, dt, dt_new, ias15_refine_flag
+                ias15_refine_aux_b(
+                    aux_b, aux_e, delta_aux_b, aux_refine, dt, dt_new, ias15_refine_flag
                 )
                 ias15_refine_flag = 1
-
-                if t >= tf:
-                    ias15_integrate_flag = 2
-                    break
+            else:
+                rejected_step_count += 1
 
             # Step size for the next iteration
-            if (dt_new / dt) > (1.0 / safety_fac):
+            if dt_new > dt / safety_fac:
                 dt = dt / safety_fac
             elif dt_new < dt * safety_fac:
                 dt = dt * safety_fac
@@ -1814,83 +2242,63 @@ class IAS15:
             if ias15_integrate_flag > 0:
                 break
 
-        return (
-            x,
-            v,
-            a,
-            t,
-            dt,
-            aux_g,
-            aux_b,
-            aux_e,
-            aux_b0,
-            ias15_refine_flag,
-        )
+        x0[...] = x
+        v0[...] = v
+        a0[...] = a
+
+        return t, dt, ias15_refine_flag, potential
 
     @staticmethod
-    def _ias15_approx_pos(x0, v0, a0, node, aux_b, dt):
-        x = x0 + dt * node * (
-            v0
-            + dt
-            * node
-            * (
-                a0
-                + node
-                * (
-                    aux_b[0] / 3.0
-                    + node
-                    * (
-                        aux_b[1] / 6.0
-                        + node
-                        * (
-                            aux_b[2] / 10.0
-                            + node
-                            * (
-                                aux_b[3] / 15.0
-                                + node
-                                * (
-                                    aux_b[4] / 21.0
-                                    + node * (aux_b[5] / 28.0 + node * aux_b[6] / 36.0)
-                                )
-                            )
-                        )
-                    )
-                )
-            )
-            / 2.0
-        )
+    def _ias15_approx_pos(x, x0, v0, a0, node, coeff, aux_b, dt):
+        """
+        Estimate the position at node in place, with coeff from
+        _ias15_approx_coeff()
+
+        :rtype: numpy.array
+        """
+        # x = x0 + dt * node * (v0 + dt * node * (a0 + node * (aux_b[0] / 3 + node * (aux_b[1] / 6 + ...))) / 2)
+        np.dot(coeff, aux_b.reshape(len(aux_b), -1), out=x.reshape(-1))
+        x += a0
+        x *= 0.5 * dt * node
+        x += v0
+        x *= dt * node
+        x += x0
 
         return x
 
     @staticmethod
-    def _ias15_approx_vel(v0, a0, node, aux_b, dt):
-        v = v0 + dt * node * (
-            a0
-            + node
-            * (
-                aux_b[0] / 2.0
-                + node
-                * (
-                    aux_b[1] / 3.0
-                    + node
-                    * (
-                        aux_b[2] / 4.0
-                        + node
-                        * (
-                            aux_b[3] / 5.0
-                            + node
-                            * (
-                                aux_b[4] / 6.0
-                                + node * (aux_b[5] / 7.0 + node * aux_b[6] / 8.0)
-                            )
-                        )
-                    )
-                )
-            )
-        )
+    def _ias15_approx_vel(v, v0, a0, node, coeff, aux_b, dt):
+        """
+        Estimate the velocity at node in place, with coeff from
+        _ias15_approx_coeff()
+
+        :rtype: numpy.array
+        """
+        # v = v0 + dt * node * (a0 + node * (aux_b[0] / 2 + node * (aux_b[1] / 3 + ...)))
+        np.dot(coeff, aux_b.reshape(len(aux_b), -1), out=v.reshape(-1))
+        v += a0
+        v *= dt * node
+        v += v0
 
         return v
 
+    @staticmethod
+    def _ias15_approx_coeff(nodes):
+        """
+        Return the coefficients of aux_b in the position and velocity
+        polynomials at each of the nodes and at the end of the step
+
+        :rtype: numpy.array
+        :rshape: (dim_nodes + 1, 2, dim_nodes - 1)
+        """
+        node_powers = np.append(nodes, 1.0)[:, np.newaxis] ** np.arange(1, len(nodes))
+        k = np.arange(len(nodes) - 1)
+        approx_coeff = np.zeros((len(nodes) + 1, 2, len(nodes) - 1))
+        approx_coeff[:, 0] = node_powers / ((k + 2) * (k + 3) / 2.0)
+        approx_coeff[:, 1] = node_powers / (k + 2)
+
+        return approx_coeff
+
     @staticmethod
     def _ias15_initial_time_step(
         objects_count: int,
@@ -1952,55 +2360,18 @@ class IAS15:
     @staticmethod
     def _ias15_compute_aux_b(aux_b, aux_g, aux_c, i):
         """
-        Calculate the auxiliary coefficients b for IAS15
+        Calculate the auxiliary coefficients b for IAS15 in place,
+        aux_b[k] = sum_j aux_c[j, k] * aux_g[j] for k < i
 
         :rtype: numpy.array
         """
-
         if i >= 1:
-            aux_b[0] = (
-                aux_c[0, 0] * aux_g[0]
-                + aux_c[1, 0] * aux_g[1]
-                + aux_c[2, 0] * aux_g[2]
-                + aux_c[3, 0] * aux_g[3]
-                + aux_c[4, 0] * aux_g[4]
-                + aux_c[5, 0] * aux_g[5]
-                + aux_c[6, 0] * aux_g[6]
+            np.dot(
+                aux_c[:, :i].T,
+                aux_g.reshape(len(aux_g), -1),
+                out=aux_b[:i].reshape(i, -1),
             )
 
-        if i >= 2:
-            aux_b[1] = (
-                aux_c[1, 1] * aux_g[1]
-                + aux_c[2, 1] * aux_g[2]
-                + aux_c[3, 1] * aux_g[3]
-                + aux_c[4, 1] * aux_g[4]
-                + aux_c[5, 1] * aux_g[5]
-                + aux_c[6, 1] * aux_g[6]
-            )
-        if i >= 3:
-            aux_b[2] = (
-                aux_c[2, 2] * aux_g[2]
-                + aux_c[3, 2] * aux_g[3]
-                + aux_c[4, 2] * aux_g[4]
-                + aux_c[5, 2] * aux_g[5]
-                + aux_c[6, 2] * aux_g[6]
-            )
-        if i >= 4:
-            aux_b[3] = (
-                aux_c[3, 3] * aux_g[3]
-                + aux_c[4, 3] * aux_g[4]
-                + aux_c[5, 3] * aux_g[5]
-                + aux_c[6, 3] * aux_g[6]
-            )
-        if i >= 5:
-            aux_b[4] = (
-                aux_c[4, 4] * aux_g[4] + aux_c[5, 4] * aux_g[5] + aux_c[6, 4] * aux_g[6]
-            )
-        if i >= 6:
-            aux_b[5] = aux_c[5, 5] * aux_g[5] + aux_c[6, 5] * aux_g[6]
-        if i >= 7:
-            aux_b[6] = aux_c[6, 6] * aux_g[6]
-
         return aux_b
 
     @staticmethod
@@ -2046,73 +2417,21 @@ class IAS15:
 
     @staticmethod
     def _ias15_compute_aux_g(aux_g, aux_r, aux_a, i):
-        # Retrieve required accelerations
-        F1 = aux_a[0]
-        F2 = aux_a[1]
-        F3 = aux_a[2]
-        F4 = aux_a[3]
-        F5 = aux_a[4]
-        F6 = aux_a[5]
-        F7 = aux_a[6]
-        F8 = aux_a[7]
-
-        # Update aux_g
+        """
+        Calculate the auxiliary coefficients g for IAS15 in place. Only
+        aux_g[i - 1] depends on the acceleration at node i, the others are
+        unchanged since the earlier nodes.
+
+        :rtype: numpy.array
+        """
         if i >= 1:
-            aux_g[0] = (F2 - F1) * aux_r[1, 0]
-        if i >= 2:
-            aux_g[1] = ((F3 - F1) * aux_r[2, 0] - aux_g[0]) * aux_r[2, 1]
-        if i >= 3:
-            aux_g[2] = (
-                ((F4 - F1) * aux_r[3, 0] - aux_g[0]) * aux_r[3, 1] - aux_g[1]
-            ) * aux_r[3, 2]
-        if i >= 4:
-            aux_g[3] = (
-                (((F5 - F1) * aux_r[4, 0] - aux_g[0]) * aux_r[4, 1] - aux_g[1])
-                * aux_r[4, 2]
-                - aux_g[2]
-            ) * aux_r[4, 3]
-        if i >= 5:
-            aux_g[4] = (
-                (
-                    (((F6 - F1) * aux_r[5, 0] - aux_g[0]) * aux_r[5, 1] - aux_g[1])
-                    * aux_r[5, 2]
-                    - aux_g[2]
-                )
-                * aux_r[5, 3]
-                - aux_g[3]
-            ) * aux_r[5, 4]
-        if i >= 6:
-            aux_g[5] = (
-                (
-                    (
-                        (((F7 - F1) * aux_r[6, 0] - aux_g[0]) * aux_r[6, 1] - aux_g[1])
-                        * aux_r[6, 2]
-                        - aux_g[2]
-                    )
-                    * aux_r[6, 3]
-                    - aux_g[3]
-                )
-                * aux_r[6, 4]
-                - aux_g[4]
-            ) * aux_r[6, 5]
-        if i >= 7:
-            aux_g[6] = (
-                (
-                    (
-                        (
-                            (((F8 - F1) * aux_r[7, 0] - aux_g[0]) * aux_r[7, 1] - aux_g[1])
-                            * aux_r[7, 2]
-                            - aux_g[2]
-                        )
-                        * aux_r[7, 3]
-                        - aux_g[3]
-                    )
-                    * aux_r[7, 4]
-                    - aux_g[4]
-                )
-                * aux_r[7, 5]
-                - aux_g[5]
-            ) * aux_r[7, 6]
+            # aux_g[i - 1] = ((((F[i] - F[0]) * r[i, 0] - g[0]) * r[i, 1] - g[1]) ... ) * r[i, i - 1]
+            g = aux_g[i - 1]
+            np.subtract(aux_a[i], aux_a[0], out=g)
+            g *= aux_r[i, 0]
+            for j in range(1, i):
+                g -= aux_g[j - 1]
+                g *= aux_r[i, j]
 
         return aux_g
 
@@ -2164,55 +2483,72 @@ class IAS15:
         return aux_r
 
     @staticmethod
-    def _ias15_refine_aux_b(aux_b, aux_e, dt, dt_new, ias15_refine_flag):
+    def _ias15_aux_refine():
+        """
+        Return the binomial coefficients that predict aux_b of the next step,
+        aux_e[k] = q^(k + 1) * sum_j aux_refine[k, j] * aux_b[j]
+
+        :rtype: numpy.array
+        :rshape: (7, 7)
+        """
+        aux_refine = np.array(
+            [
+                [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+                [0.0, 1.0, 3.0, 6.0, 10.0, 15.0, 21.0],
+                [0.0, 0.0, 1.0, 4.0, 10.0, 20.0, 35.0],
+                [0.0, 0.0, 0.0, 1.0, 5.0, 15.0, 35.0],
+                [0.0, 0.0, 0.0, 0.0, 1.0, 6.0, 21.0],
+                [0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 7.0],
+                [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0],
+            ]
+        )
+
+        return aux_refine
+
+    @staticmethod
+    def _ias15_refine_aux_b(aux_b, aux_e, delta_aux_b, aux_refine, dt, dt_new, ias15_refine_flag):
+        """
+        Predict aux_b and aux_e of the next step in place, delta_aux_b is a
+        work buffer
+        """
         if ias15_refine_flag != 0:
-            delta_aux_b = aux_b - aux_e
-        else:
-            delta_aux_b = aux_b * 0
+            np.subtract(aux_b, aux_e, out=delta_aux_b)
 
         # Compute q and the powers of q:
         q = dt_new / dt
-        q2 = q * q
-        q3 = q2 * q
-        q4 = q3 * q
-        q5 = q4 * q
-        q6 = q5 * q
-        q7 = q6 * q
+        q_powers = q ** np.arange(1, len(aux_refine) + 1)
 
-        aux_e[0] = q * (
-            aux_b[6] * 7.0
-            + aux_b[5] * 6.0
-            + aux_b[4] * 5.0
-            + aux_b[3] * 4.0
-            + aux_b[2] * 3.0
-            + aux_b[1] * 2.0
-            + aux_b[0]
-        )
-        aux_e[1] = q2 * (
-            aux_b[6] * 21.0
-            + aux_b[5] * 15.0
-            + aux_b[4] * 10.0
-            + aux_b[3] * 6.0
-            + aux_b[2] * 3.0
-            + aux_b[1]
-        )
-        aux_e[2] = q3 * (
-            aux_b[6] * 35.0 + aux_b[5] * 20.0 + aux_b[4] * 10.0 + aux_b[3] * 4.0 + aux_b[2]
+        np.dot(
+            q_powers[:, np.newaxis] * aux_refine,
+            aux_b.reshape(len(aux_b), -1),
+            out=aux_e.reshape(len(aux_e), -1),
         )
-        aux_e[3] = q4 * (aux_b[6] * 35.0 + aux_b[5] * 15.0 + aux_b[4] * 5.0 + aux_b[3])
-        aux_e[4] = q5 * (aux_b[6] * 21.0 + aux_b[5] * 6.0 + aux_b[4])
-        aux_e[5] = q6 * (aux_b[6] * 7.0 + aux_b[5])
-        aux_e[6] = q7 * aux_b[6]
-
-        aux_b = aux_e + delta_aux_b
-
-        return aux_b, aux_e
 
+        if ias15_refine_flag != 0:
+            np.add(aux_e, delta_aux_b, out=aux_b)
+        else:
+            aux_b[...] = aux_e
 
 
 
 class RK_EMBEDDED:
     """Embedded RK integrators: RKF45, DOPRI, DVERK, RKF78"""
+    def __init__(self):
+        # Work buffers of the numpy path, allocated for the current
+        # objects_count and number of stages
+        self.y = None
+        self.y_1 = None
+        self.y_stage = None
+        self.k = None
+        self.y_sums = None
+        self.tolerance_scale = None
+        self.abs_y_1 = None
+
+        # Arguments passed by reference to c_lib.rk_embedded()
+        self.c_simulation_time = ctypes.c_double(0.0)
+        self.c_rk_dt = ctypes.c_double(0.0)
+        self.c_count = ctypes.c_int(0)
+
     def simulation(self, simulator, objects_count, m, G, abs_tolerance, rel_tolerance, expected_time_scale, max_iteration, min_iteration):
         # Initialization
         if simulator.is_initialize == True and simulator.is_initialize_integrator == simulator.current_integrator:
@@ -2254,43 +2590,51 @@ class RK_EMBEDDED:
             simulator.is_initialize = False
 
         # Simulation
-        temp_simulation_time = ctypes.c_double(simulator.stats.simulation_time)
-        temp_rk_dt = ctypes.c_double(self.rk_dt)
         if simulator.is_c_lib == True:
+            self.c_simulation_time.value = simulator.stats.simulation_time
+            self.c_rk_dt.value = self.rk_dt
             simulator.c_lib.rk_embedded(
-                ctypes.c_int(objects_count), 
-                simulator.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                simulator.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                ctypes.c_double(G), 
-                ctypes.c_double(expected_time_scale),
-                ctypes.byref(temp_simulation_time), 
-                ctypes.byref(temp_rk_dt),
-                ctypes.c_int(self.power),
-                ctypes.c_int(self.power_test),
-                ctypes.c_int(np.shape(self.coeff)[-1]),
-                self.coeff.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
-                ctypes.c_int(len(self.weights)),
-                self.weights.ctypes.data_as(
-                    ctypes.POINTER(ctypes.c_double)
-                ),
-                self.weights_test.ctypes.data_as(
-                    ctypes.POINTER(ctypes.c_double)
-                ),
-                ctypes.c_int(max_iteration),
-                ctypes.c_int(min_iteration),
-                ctypes.c_double(abs_tolerance),
-                ctypes.c_double(rel_tolerance),
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("m", m),
+                G,
+                expected_time_scale,
+                self.c_simulation_time,
+                self.c_rk_dt,
+                self.c_count,
+                self.power,
+                self.power_test,
+                np.shape(self.coeff)[-1],
+                simulator.c_lib_pointer("rk_coeff", self.coeff),
+                len(self.weights),
+                simulator.c_lib_pointer("rk_weights", self.weights),
+                simulator.c_lib_pointer("rk_weights_test", self.weights_test),
+                max_iteration,
+                min_iteration,
+                abs_tolerance,
+                rel_tolerance,
+                simulator.c_lib_workspace,
             )
-            simulator.stats.simulation_time = temp_simulation_time.value 
-            self.rk_dt = temp_rk_dt.value
+            simulator.stats.simulation_time = self.c_simulation_time.value
+            self.rk_dt = self.c_rk_dt.value
+            count = self.c_count.value
 
         elif simulator.is_c_lib == False:
+            stages = len(self.weights)
+            if self.k is None or self.k.shape[0] != stages or self.k.shape[2] != objects_count:
+                self.y = np.zeros((2, objects_count, 3))
+                self.y_1 = np.zeros((2, objects_count, 3))
+                self.y_stage = np.zeros((2, objects_count, 3))
+                self.k = np.zeros((stages, 2, objects_count, 3))
+                self.y_sums = np.zeros((2, 2, objects_count, 3))
+                self.tolerance_scale = np.zeros((2, objects_count, 3))
+                self.abs_y_1 = np.zeros((2, objects_count, 3))
+
             (
-                simulator.x,
-                simulator.v,
                 simulator.stats.simulation_time,
                 self.rk_dt,
+                count,
             ) = self._rk_embedded(
                 objects_count,
                 simulator.x,
@@ -2309,8 +2653,16 @@ class RK_EMBEDDED:
                 min_iteration,
                 abs_tolerance,
                 rel_tolerance,
+                self.y,
+                self.y_1,
+                self.y_stage,
+                self.k,
+                self.y_sums,
+                self.tolerance_scale,
+                self.abs_y_1,
             )
 
+        return count
 
     @staticmethod
     def _rk_embedded(
@@ -2331,72 +2683,80 @@ class RK_EMBEDDED:
         min_iteration: int,
         abs_tolerance: float,
         rel_tolerance: float,
+        y,
+        y_1,
+        y_stage,
+        k,
+        y_sums,
+        tolerance_scale,
+        abs_y_1,
     ):
+        """
+        Advance the embedded RK method for up to max_iteration steps. x and v
+        are updated in place, and y, y_1, y_stage, k, y_sums,
+        tolerance_scale and abs_y_1 are work buffers.
+
+        :return: Simulation time, time step and number of accepted steps
+        :rtype: tuple
+        """
+        global rejected_step_count
+
         # Initializing
         t = simulation_time
         stages = len(weights)
         min_power = min([power, power_test])
-        error_estimation_delta_weights = weights - weights_test
 
         # Safety factors for step-size control:
         safety_fac_max = 6.0
         safety_fac_min = 0.33
         safety_fac = 0.38 ** (1.0 / (1.0 + min_power))
 
-        # Initialize vk and xk
-        vk = np.zeros((stages, objects_count, 3))
-        xk = np.zeros((stages, objects_count, 3))
+        # The state y = (v, x) and the stage derivatives k[stage] = (a, v),
+        # flattened so that the stage combinations are matrix products
+        y[0] = v
+        y[1] = x
+        k_flat = k.reshape(stages, -1)
 
+        # Rows: weights of y_1 and of the error estimation
+        combined_weights = np.stack((weights, weights - weights_test))
+        error_estimation_delta_y = y_sums[1]
+
+        # Number of accepted steps
+        count = 0
         for i in range(max_iteration):
-            # Calculate xk and vk
-            vk[0] = acceleration(objects_count, x, m, G)
-            xk[0] = np.copy(v)
+            # Calculate the stage derivatives
+            k[0, 0] = acceleration(objects_count, y[1], m, G)
+            k[0, 1] = y[0]
             for stage in range(1, stages):
-                temp_v = np.zeros((objects_count, 3))
-                temp_x = np.zeros((objects_count, 3))
-                for j in range(stage):
-                    temp_v += coeff[stage - 1][j] * vk[j]
-                    temp_x += coeff[stage - 1][j] * xk[j]
-                vk[stage] = acceleration(objects_count, x + actual_dt * temp_x, m, G)
-                xk[stage] = v + actual_dt * temp_v
-
-            # Calculate x_1, v_1 and also delta x, delta v for error estimation
-            temp_v = np.zeros((objects_count, 3))
-            temp_x = np.zeros((objects_count, 3))
-            error_estimation_delta_x = np.zeros((objects_count, 3))
-            error_estimation_delta_v = np.zeros((objects_count, 3))
-            for stage in range(stages):
-                temp_v += weights[stage] * vk[stage]
-                temp_x += weights[stage] * xk[stage]
-                error_estimation_delta_v += (
-                    error_estimation_delta_weights[stage] * vk[stage]
-                )
-                error_estimation_delta_x += (
-                    error_estimation_delta_weights[stage] * xk[stage]
-                )
-            v_1 = v + actual_dt * temp_v
-            x_1 = x + actual_dt * temp_x
-            error_estimation_delta_v *= actual_dt
-            error_estimation_delta_x *= actual_dt
+                np.dot(coeff[stage - 1, :stage], k_flat[:stage], out=y_stage.reshape(-1))
+                y_stage *= actual_dt
+                y_stage += y
+                k[stage, 0] = acceleration(objects_count, y_stage[1], m, G)
+                k[stage, 1] = y_stage[0]
+
+            # Calculate y_1 and also delta y for error estimation
+            np.dot(combined_weights, k_flat, out=y_sums.reshape(2, -1))
+            np.multiply(y_sums[0], actual_dt, out=y_1)
+            y_1 += y
+            error_estimation_delta_y *= actual_dt
 
             # Error calculation
-            tolerance_scale_v = (
-                abs_tolerance + np.maximum(np.abs(v), np.abs(v_1)) * rel_tolerance
-            )
-            tolerance_scale_x = (
-                abs_tolerance + np.maximum(np.abs(x), np.abs(x_1)) * rel_tolerance
-            )
-
-            # Sum up all the elements of x/tol and v/tol, square and divide by the total number of elements
-            sum = np.sum(np.square(error_estimation_delta_x / tolerance_scale_x)) + np.sum(
-                np.square(error_estimation_delta_v / tolerance_scale_v)
-            )
+            np.abs(y, out=tolerance_scale)
+            np.maximum(tolerance_scale, np.abs(y_1, out=abs_y_1), out=tolerance_scale)
+            tolerance_scale *= rel_tolerance
+            tolerance_scale += abs_tolerance
+
+            # Sum up all the elements of y/tol, square and divide by the total number of elements
+            error_estimation_delta_y /= tolerance_scale
+            sum = np.vdot(error_estimation_delta_y, error_estimation_delta_y)
             error = (sum / (objects_count * 3 * 2)) ** 0.5
 
             if error <= 1 or actual_dt == expected_time_scale * 1e-12:
                 t += actual_dt
-                x = x_1
-                v = v_1
+                y, y_1 = y_1, y
+                count += 1
+            else:
+                rejected_step_count += 1
 
             if error == 0.0: # Prevent extreme cases where the error is smaller than machine zero
                 dt_new = actual_dt
@@ -2414,10 +2774,13 @@ class RK_EMBEDDED:
                 actual_dt = expected_time_scale * 1e-12
 
             if i >= min_iteration and t > (simulation_time + expected_time_scale * 1e-5):
-                return x, v, t, actual_dt
+                break
+
+        # y and y_1 are swapped on every accepted step
+        x[...] = y[1]
+        v[...] = y[0]
 
-        # Return values once it reaches max iterations
-        return x, v, t, actual_dt
+        return t, actual_dt, count
 
     @staticmethod
     def _rk_embedded_initial_time_step(
@@ -2880,56 +3243,2509 @@ class RK_EMBEDDED:
 
         return power, power_test, coeff, weights, weights_test
 
-def acceleration(objects_count, x, m, G):
+
+class HERMITE:
     """
-    Calculate acceleration by a = - GM/r^3 vec{r}
+    Fourth order Hermite predictor-corrector with the shared time step
+    criterion of Aarseth. The forces and jerks are always summed directly.
+
+    Reference: Makino & Aarseth (1992), On a Hermite integrator with
+    Ahmad-Cohen scheme for gravitational many-body problems, PASJ 44, 141
     """
-    # Allocate memory
-    temp_a = np.zeros((objects_count * objects_count, 3))
 
-    # Calculations
-    for j in range(objects_count):
-        for k in range(j + 1, objects_count):
-            R = x[j] - x[k]
-            temp_value = G * R / np.linalg.norm(R) ** 3 
-            temp_a[j * objects_count + k] = -temp_value * m[k]
-            temp_a[k * objects_count + j] = temp_value * m[j]
+    # Accuracy parameter of the time step criterion for the tolerance 1e-6
+    DEFAULT_ETA = 0.02
+    # Accuracy parameter of the initial time step |a| / |jerk|
+    INITIAL_ETA = 0.01
 
-    temp_a = temp_a.reshape((objects_count, objects_count, 3))
-    a = np.sum(temp_a, axis=1)
+    def __init__(self):
+        # Arguments passed by reference to c_lib.hermite()
+        self.c_simulation_time = ctypes.c_double(0.0)
+        self.c_dt = ctypes.c_double(0.0)
+        self.c_count = ctypes.c_int(0)
+        self.jerk = None
 
-    return a
+    def resize_objects(self, keep, added_count, reset_rows):
+        """Recompute the jerk with the acceleration after adding or removing objects"""
+        self.jerk = None
 
-def compute_energy(objects_count, x, v, m, G):
-    E = 0
-    for j in range(objects_count):
-        E += 0.5 * m[j] * np.linalg.norm(v[j]) ** 2
-        for k in range(j + 1, objects_count):
-            R = x[j] - x[k]
-            norm = np.linalg.norm(R)
-            if norm != 0:
-                E -= G * m[j] * m[k] / norm 
-            else:
-                return np.nan
-    return E
+    def simulation(self, simulator, objects_count, m, G, tolerance, expected_time_scale, max_iteration, min_iteration):
+        if simulator.is_initialize == True and simulator.is_initialize_integrator == "hermite":
+            simulator.a, self.jerk = acceleration_jerk(objects_count, simulator.x, simulator.v, m, G)
+            self.dt = self._hermite_initial_time_step(simulator.a, self.jerk)
+            simulator.is_initialize = False
+        elif self.jerk is None:
+            simulator.a, self.jerk = acceleration_jerk(objects_count, simulator.x, simulator.v, m, G)
+
+        eta = self.DEFAULT_ETA * math.sqrt(tolerance / Settings.DEFAULT_TOLERANCE)
+
+        if simulator.is_c_lib == True:
+            self.c_simulation_time.value = simulator.stats.simulation_time
+            self.c_dt.value = self.dt
+            simulator.c_lib.hermite(
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("a", simulator.a),
+                simulator.c_lib_pointer("hermite_jerk", self.jerk),
+                simulator.c_lib_pointer("m", m),
+                G,
+                self.c_simulation_time,
+                self.c_dt,
+                expected_time_scale,
+                self.c_count,
+                eta,
+                max_iteration,
+                min_iteration,
+                simulator.c_lib_workspace,
+            )
+            simulator.stats.simulation_time = self.c_simulation_time.value
+            self.dt = self.c_dt.value
+            count = self.c_count.value
+
+        elif simulator.is_c_lib == False:
+            (
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                self.jerk,
+                simulator.stats.simulation_time,
+                self.dt,
+                count,
+            ) = self._hermite(
+                objects_count,
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                self.jerk,
+                m,
+                G,
+                simulator.stats.simulation_time,
+                self.dt,
+                expected_time_scale,
+                eta,
+                max_iteration,
+                min_iteration,
+            )
+
+        return count
+
+    @staticmethod
+    def _hermite(
+        objects_count,
+        x,
+        v,
+        a,
+        jerk,
+        m,
+        G,
+        t,
+        dt,
+        expected_time_scale,
+        eta,
+        max_iteration,
+        min_iteration,
+    ):
+        """
+        Advance at least min_iteration and at most max_iteration steps, until
+        the simulation time passes expected_time_scale * 1e-5. a and jerk
+        must be the ones at x and v.
+
+        :rtype: numpy.array, numpy.array, numpy.array, numpy.array, float, float, int
+        """
+        t0 = t
+        count = 0
+        for _ in range(max_iteration):
+            h = dt
+
+            # Predictor
+            x_1 = x + h * (v + h * (0.5 * a + h * jerk / 6.0))
+            v_1 = v + h * (a + h * 0.5 * jerk)
+
+            a_1, jerk_1 = acceleration_jerk(objects_count, x_1, v_1, m, G)
+
+            # Corrector
+            delta_a = a - a_1
+            v_1 = v + h * (0.5 * (a + a_1) + h * (jerk - jerk_1) / 12.0)
+            x_1 = x + h * (0.5 * (v + v_1) + h * delta_a / 12.0)
+
+            # Time step from the second and third derivatives of the
+            # acceleration at the end of the step, growing twofold at most
+            a_3 = (12.0 * delta_a + 6.0 * h * (jerk + jerk_1)) / (h * h * h)
+            a_2 = (-6.0 * delta_a - h * (4.0 * jerk + 2.0 * jerk_1)) / (h * h) + h * a_3
+            a_norm = np.linalg.norm(a_1, axis=1)
+            jerk_norm = np.linalg.norm(jerk_1, axis=1)
+            a_2_norm = np.linalg.norm(a_2, axis=1)
+            a_3_norm = np.linalg.norm(a_3, axis=1)
+            denominator = jerk_norm * a_3_norm + a_2_norm * a_2_norm
+            is_defined = denominator > 0.0
+            dt = 2.0 * h
+            if np.any(is_defined):
+                dt = min(
+                    dt,
+                    np.sqrt(
+                        eta
+                        * np.min(
+                            (a_norm * a_2_norm + jerk_norm * jerk_norm)[is_defined]
+                            / denominator[is_defined]
+                        )
+                    ),
+                )
+
+            x, v, a, jerk = x_1, v_1, a_1, jerk_1
+            t += h
+
+            count += 1
+            if count >= min_iteration and t > (t0 + expected_time_scale * 1e-5):
+                break
+
+        return x, v, a, jerk, t, dt, count
+
+    @staticmethod
+    def _hermite_initial_time_step(a, jerk):
+        """
+        Initial time step INITIAL_ETA * min |a| / |jerk| of the objects
+        with a non-zero acceleration and jerk
+
+        :rtype: float
+        """
+        a_norm = np.linalg.norm(a, axis=1)
+        jerk_norm = np.linalg.norm(jerk, axis=1)
+        is_defined = (a_norm > 0.0) & (jerk_norm > 0.0)
+        if not np.any(is_defined):
+            return Settings.DEFAULT_DT
+
+        return HERMITE.INITIAL_ETA * float(np.min(a_norm[is_defined] / jerk_norm[is_defined]))
+
+
+class BULIRSCH_STOER:
+    """
+    Gragg-Bulirsch-Stoer extrapolation with the order and step size control
+    of ODEX, built on the modified midpoint method in the Stoermer form.
+
+    Reference: Hairer, Norsett & Wanner, Solving Ordinary Differential
+    Equations I, Section II.9
+    """
+
+    # Number of columns of the extrapolation table, whose sequence of
+    # substeps is 2, 4, 6, ..., 2 * MAX_COLUMNS
+    MAX_COLUMNS = 9
+
+    def __init__(self):
+        # Arguments passed by reference to c_lib.bulirsch_stoer()
+        self.c_simulation_time = ctypes.c_double(0.0)
+        self.c_dt = ctypes.c_double(0.0)
+        self.c_column = ctypes.c_int(0)
+        self.c_count = ctypes.c_int(0)
+
+    def simulation(self, simulator, objects_count, m, G, abs_tolerance, rel_tolerance, expected_time_scale, max_iteration, min_iteration):
+        if simulator.is_initialize == True and simulator.is_initialize_integrator == "bulirsch_stoer":
+            # Initial column as in ODEX, higher for tighter tolerances
+            self.column = int(-math.log10(rel_tolerance) * 0.6 + 0.5)
+            self.column = min(max(self.column, 2), self.MAX_COLUMNS - 2)
+            simulator.a = acceleration(objects_count, simulator.x, m, G)
+            self.dt = RK_EMBEDDED._rk_embedded_initial_time_step(
+                objects_count,
+                2 * self.column + 1,
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                m,
+                G,
+                abs_tolerance,
+                rel_tolerance,
+            )
+            simulator.is_initialize = False
+
+        if simulator.is_c_lib == True:
+            self.c_simulation_time.value = simulator.stats.simulation_time
+            self.c_dt.value = self.dt
+            self.c_column.value = self.column
+            simulator.c_lib.bulirsch_stoer(
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("a", simulator.a),
+                simulator.c_lib_pointer("m", m),
+                G,
+                expected_time_scale,
+                self.c_simulation_time,
+                self.c_dt,
+                self.c_column,
+                self.c_count,
+                max_iteration,
+                min_iteration,
+                abs_tolerance,
+                rel_tolerance,
+                simulator.c_lib_workspace,
+            )
+            simulator.stats.simulation_time = self.c_simulation_time.value
+            self.dt = self.c_dt.value
+            self.column = self.c_column.value
+            count = self.c_count.value
+
+        elif simulator.is_c_lib == False:
+            (
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                simulator.stats.simulation_time,
+                self.dt,
+                self.column,
+                count,
+            ) = self._bulirsch_stoer(
+                objects_count,
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                m,
+                G,
+                expected_time_scale,
+                simulator.stats.simulation_time,
+                self.dt,
+                self.column,
+                max_iteration,
+                min_iteration,
+                abs_tolerance,
+                rel_tolerance,
+            )
+
+        return count
+
+    @staticmethod
+    def _bulirsch_stoer(
+        objects_count,
+        x,
+        v,
+        a,
+        m,
+        G,
+        expected_time_scale,
+        t,
+        dt,
+        column,
+        max_iteration,
+        min_iteration,
+        abs_tolerance,
+        rel_tolerance,
+    ):
+        """
+        Advance at least min_iteration and at most max_iteration accepted
+        steps, until the simulation time passes expected_time_scale * 1e-5.
+        column is the column of the extrapolation table that is aimed for.
+        a must be the acceleration at x.
+
+        :rtype: numpy.array, numpy.array, numpy.array, float, float, int, int
+        """
+        global rejected_step_count
+
+        max_columns = BULIRSCH_STOER.MAX_COLUMNS
+        sequence = 2 * np.arange(1, max_columns + 1)
+        # Force evaluations of a step that ends at each column
+        work = 1.0 + np.cumsum(sequence)
+
+        # Row j of the table holds the state (x, v) of column j
+        table = np.empty((max_columns, 2, objects_count, 3))
+        column_dt = np.empty(max_columns)
+        work_per_time = np.empty(max_columns)
+        is_last_rejected = False
+
+        t0 = t
+        count = 0
+        for _ in range(max_iteration):
+            H = dt
+            k = column
+            is_accepted = False
+            y = np.stack((x, v))
+            for j in range(k + 2):
+                y_1 = BULIRSCH_STOER._modified_midpoint(objects_count, x, v, a, m, G, H, sequence[j])
+
+                # Neville extrapolation to H = 0 in (H / n)^2
+                for l in range(1, j + 1):
+                    ratio = sequence[j] / sequence[j - l]
+                    next_y = y_1 + (y_1 - table[l - 1]) / (ratio * ratio - 1.0)
+                    table[l - 1] = y_1
+                    y_1 = next_y
+                table[j] = y_1
+
+                if j == 0:
+                    continue
+
+                # Error of the last two columns relative to the tolerance
+                tolerance_scale = abs_tolerance + np.maximum(np.abs(y), np.abs(table[j])) * rel_tolerance
+                error = math.sqrt(
+                    np.mean(np.square((table[j] - table[j - 1]) / tolerance_scale))
+                )
+
+                fac = 4.0
+                if error != 0.0:
+                    fac = min(4.0, max(0.02, 0.94 * (0.65 / error) ** (1.0 / (2 * j + 1))))
+                column_dt[j] = H * fac
+                work_per_time[j] = work[j] / column_dt[j]
+
+                if j < k - 1:
+                    continue
+                if error <= 1.0 or H <= expected_time_scale * 1e-12:
+                    is_accepted = True
+                    break
+
+                # Give up early if the error is not expected to converge by column k + 1
+                if j == k - 1:
+                    if error > (sequence[k] * sequence[k + 1] / sequence[0] ** 2) ** 2:
+                        break
+                elif j == k:
+                    if error > (sequence[k + 1] / sequence[0]) ** 2:
+                        break
+
+            # Aim for the column with the least work per unit time
+            new_column = j
+            if j >= 2 and work_per_time[j - 1] < 0.8 * work_per_time[j]:
+                new_column = j - 1
+            elif is_accepted and (j == 1 or work_per_time[j] < 0.9 * work_per_time[j - 1]):
+                new_column = j + 1
+            new_column = min(max(new_column, 2), max_columns - 2)
+
+            if new_column > j:
+                new_dt = column_dt[j] * work[new_column] / work[j]
+            else:
+                new_dt = column_dt[new_column]
+
+            if is_accepted:
+                x = table[j, 0].copy()
+                v = table[j, 1].copy()
+                a = acceleration(objects_count, x, m, G)
+                t += H
+                count += 1
+
+                # No increase right after a rejected step
+                if is_last_rejected:
+                    new_column = min(new_column, k)
+                    new_dt = min(new_dt, H)
+                is_last_rejected = False
+            else:
+                rejected_step_count += 1
+                is_last_rejected = True
+
+            column = new_column
+            dt = max(float(new_dt), expected_time_scale * 1e-12)
+
+            if is_accepted and count >= min_iteration and t > (t0 + expected_time_scale * 1e-5):
+                break
+
+        return x, v, a, t, dt, column, count
+
+    @staticmethod
+    def _modified_midpoint(objects_count, x, v, a, m, G, H, n):
+        """
+        Gragg's modified midpoint method in the Stoermer form for x'' = a(x),
+        i.e. n kick-drift-kick leapfrog steps of H / n. a must be the
+        acceleration at x.
+
+        :return: The state (x, v) at H
+        :rtype: numpy.array
+        """
+        h = H / n
+        v_1 = v + 0.5 * h * a
+        x_1 = x + h * v_1
+        for _ in range(1, n):
+            v_1 += h * acceleration(objects_count, x_1, m, G)
+            x_1 += h * v_1
+        v_1 += 0.5 * h * acceleration(objects_count, x_1, m, G)
+
+        return np.stack((x_1, v_1))
+
+
+class WHFAST:
+    """
+    WHFast, the Wisdom-Holman symplectic integrator in Jacobi coordinates.
+    The objects must be ordered from the central object outwards, as in
+    Grav_obj.create_solor_system().
+
+    Reference: Rein & Tamayo (2015), WHFast: a fast and unbiased
+    implementation of a symplectic Wisdom-Holman integrator for long-term
+    gravitational simulations, MNRAS 452, 376
+    """
+
+    # Relative tolerance and maximum iterations of the Kepler solver
+    KEPLER_TOLERANCE = 1e-15
+    KEPLER_MAX_ITERATION = 20
+    # 1 / n! for the series of the Stumpff functions
+    INVERSE_FACTORIALS = [1.0 / math.factorial(n) for n in range(20)]
+
+    def simulation(self, simulator, objects_count, m, G, dt, time_speed):
+        # The composition scheme is the name of the integrator, see
+        # symplectic_composition_coefficients()
+        if simulator.is_initialize == True and simulator.is_initialize_integrator == simulator.current_integrator:
+            self.drift_coeff, self.kick_coeff = symplectic_composition_coefficients(
+                simulator.current_integrator
+            )
+            simulator.is_initialize = False
+
+        if simulator.is_c_lib == True:
+            simulator.c_lib.whfast(
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("m", m),
+                G,
+                dt,
+                time_speed,
+                len(self.drift_coeff),
+                simulator.c_lib_pointer("drift_coeff", self.drift_coeff),
+                simulator.c_lib_pointer("kick_coeff", self.kick_coeff),
+                simulator.c_lib_workspace,
+            )
+
+        elif simulator.is_c_lib == False:
+            simulator.x, simulator.v = self._whfast(
+                objects_count,
+                simulator.x,
+                simulator.v,
+                m,
+                G,
+                dt,
+                time_speed,
+                self.drift_coeff,
+                self.kick_coeff,
+            )
+
+        return time_speed
+
+    @staticmethod
+    def _whfast(objects_count, x, v, m, G, dt, time_speed, drift_coeff, kick_coeff):
+        """
+        Advance time_speed steps K(d_0) D(c_0) K(d_1) ... D(c_{s-1}) K(d_s)
+        of Kepler drifts and interaction kicks, see
+        symplectic_composition_coefficients(). Consecutive drifts, including
+        the ones of consecutive steps, are combined and a force is reused
+        until the next drift, so the Jacobi coordinates are only
+        synchronized with x and v at the end.
+
+        :rtype: numpy.array, numpy.array
+        """
+        eta = np.cumsum(m)
+        # G times the mass of the Kepler problem of each Jacobi coordinate
+        gm = G * eta[1:]
+        jacobi_x = WHFAST._whfast_inertial_to_jacobi(x, m, eta)
+        jacobi_v = WHFAST._whfast_inertial_to_jacobi(v, m, eta)
+
+        # Drift not applied yet, and the force at jacobi_x if still valid
+        drift_dt = 0.0
+        jacobi_a = None
+        for _ in range(time_speed):
+            for stage in range(len(kick_coeff)):
+                if kick_coeff[stage] != 0.0:
+                    if drift_dt != 0.0:
+                        WHFAST._whfast_drift(jacobi_x, jacobi_v, gm, drift_dt)
+                        drift_dt = 0.0
+                        jacobi_a = None
+                    if jacobi_a is None:
+                        x = WHFAST._whfast_jacobi_to_inertial(jacobi_x, m, eta)
+                        jacobi_a = WHFAST._whfast_inertial_to_jacobi(
+                            acceleration(objects_count, x, m, G), m, eta
+                        )
+
+                    # Kick by the interaction Hamiltonian, which is the total
+                    # force without the Keplerian part of each Jacobi coordinate
+                    r = np.linalg.norm(jacobi_x[1:], axis=1)
+                    jacobi_v[1:] += (kick_coeff[stage] * dt) * (
+                        jacobi_a[1:] + (gm / (r * r * r))[:, np.newaxis] * jacobi_x[1:]
+                    )
+
+                if stage < len(drift_coeff):
+                    drift_dt += drift_coeff[stage] * dt
+
+        if drift_dt != 0.0:
+            WHFAST._whfast_drift(jacobi_x, jacobi_v, gm, drift_dt)
+
+        x = WHFAST._whfast_jacobi_to_inertial(jacobi_x, m, eta)
+        v = WHFAST._whfast_jacobi_to_inertial(jacobi_v, m, eta)
+
+        return x, v
+
+    @staticmethod
+    def is_hierarchical(x, m):
+        """
+        Check that every object is away from the center of mass of the
+        objects before it, as the Kepler problem of a Jacobi coordinate is
+        singular otherwise, e.g. for the figure-8 orbit
+
+        :rtype: bool
+        """
+        eta = np.cumsum(m)
+        jacobi_x = WHFAST._whfast_inertial_to_jacobi(x, m, eta)
+        r = np.linalg.norm(jacobi_x[1:], axis=1)
+        return bool(np.all(np.isfinite(r)) and np.all(r > 0.0))
+
+    @staticmethod
+    def _whfast_inertial_to_jacobi(x, m, eta):
+        """
+        Transform positions, velocities or accelerations to Jacobi
+        coordinates relative to the center of mass of the interior objects.
+        The first row is the center of mass of all objects.
+
+        :rtype: numpy.array
+        """
+        interior_com = np.cumsum(m[:, np.newaxis] * x, axis=0) / eta[:, np.newaxis]
+        jacobi_x = np.empty_like(x)
+        jacobi_x[0] = interior_com[-1]
+        jacobi_x[1:] = x[1:] - interior_com[:-1]
+
+        return jacobi_x
+
+    @staticmethod
+    def _whfast_jacobi_to_inertial(jacobi_x, m, eta):
+        """
+        Inverse of _whfast_inertial_to_jacobi()
+
+        :rtype: numpy.array
+        """
+        # The center of mass of the objects up to i moves by
+        # m[i] / eta[i] * jacobi_x[i] when object i is added
+        shift = (m[1:] / eta[1:])[:, np.newaxis] * jacobi_x[1:]
+        interior_com = np.empty_like(jacobi_x)
+        interior_com[0] = jacobi_x[0] - np.sum(shift, axis=0)
+        interior_com[1:] = interior_com[0] + np.cumsum(shift, axis=0)
+
+        x = np.empty_like(jacobi_x)
+        x[0] = interior_com[0]
+        x[1:] = jacobi_x[1:] + interior_com[:-1]
+
+        return x
+
+    @staticmethod
+    def _whfast_drift(jacobi_x, jacobi_v, gm, dt):
+        """
+        Advance the center of mass in a straight line and every other
+        Jacobi coordinate along its Kepler orbit, in place
+        """
+        jacobi_x[0] += dt * jacobi_v[0]
+        jacobi_x[1:], jacobi_v[1:] = WHFAST._whfast_kepler_step(
+            jacobi_x[1:], jacobi_v[1:], gm, dt
+        )
+
+    @staticmethod
+    def _whfast_kepler_step(x, v, gm, dt):
+        """
+        Solve the Kepler problems x'' = -gm x / |x|^3 over dt with the
+        universal variable s, for elliptic and hyperbolic orbits alike,
+        with the Laguerre-Conway iteration
+
+        Reference: Danby (1992), Fundamentals of Celestial Mechanics,
+        Chapter 6.9; Conway (1986), Celestial Mechanics 39, 199
+
+        :rtype: numpy.array, numpy.array
+        """
+        r0 = np.linalg.norm(x, axis=1)
+        eta0 = np.sum(x * v, axis=1)
+        beta = 2.0 * gm / r0 - np.sum(v * v, axis=1)
+        zeta0 = gm - beta * r0
+
+        # Kepler's equation f(s) = r0 s + eta0 G2 + zeta0 G3 - dt = 0 with
+        # f'(s) = r(s) > 0. Initial guess from the Taylor series of r(t).
+        s = dt / r0 - eta0 * dt * dt / (2.0 * r0 * r0 * r0)
+        for _ in range(WHFAST.KEPLER_MAX_ITERATION):
+            g0, g1, g2, g3 = WHFAST._whfast_g_functions(beta, s)
+            f = r0 * s + eta0 * g2 + zeta0 * g3 - dt
+            f_prime = r0 + eta0 * g1 + zeta0 * g2
+            f_prime_2 = eta0 * g0 + zeta0 * g1
+            delta_s = -5.0 * f / (
+                f_prime
+                + np.sqrt(np.abs(16.0 * f_prime * f_prime - 20.0 * f * f_prime_2))
+            )
+            s += delta_s
+            if np.all(np.abs(delta_s) <= WHFAST.KEPLER_TOLERANCE * np.abs(s)):
+                break
+
+        _, g1, g2, g3 = WHFAST._whfast_g_functions(beta, s)
+        r = r0 + eta0 * g1 + zeta0 * g2
+        f = 1.0 - gm * g2 / r0
+        g = dt - gm * g3
+        f_dot = -gm * g1 / (r0 * r)
+        g_dot = 1.0 - gm * g2 / r
+
+        x_1 = f[:, np.newaxis] * x + g[:, np.newaxis] * v
+        v_1 = f_dot[:, np.newaxis] * x + g_dot[:, np.newaxis] * v
+
+        return x_1, v_1
+
+    @staticmethod
+    def _whfast_g_functions(beta, s):
+        """
+        Return the functions G_k(s) = s^k c_k(beta s^2) of the universal
+        variable for k = 0 to 3, where c_k are the Stumpff functions
+
+        :rtype: numpy.array, numpy.array, numpy.array, numpy.array
+        """
+        z = beta * s * s
+
+        # Series c_k(z) = sum_n (-z)^n / (2n + k)!, since the closed forms
+        # below lose precision for small |z|
+        inverse_factorials = WHFAST.INVERSE_FACTORIALS
+        c2 = np.full_like(z, inverse_factorials[18])
+        c3 = np.full_like(z, inverse_factorials[19])
+        for n in range(7, -1, -1):
+            c2 = inverse_factorials[2 * n + 2] - z * c2
+            c3 = inverse_factorials[2 * n + 3] - z * c3
+
+        large = np.abs(z) >= 1.0
+        if np.any(large):
+            elliptic = z >= 1.0
+            sqrt_z = np.sqrt(z[elliptic])
+            c2[elliptic] = (1.0 - np.cos(sqrt_z)) / z[elliptic]
+            c3[elliptic] = (sqrt_z - np.sin(sqrt_z)) / (z[elliptic] * sqrt_z)
+
+            hyperbolic = z <= -1.0
+            sqrt_z = np.sqrt(-z[hyperbolic])
+            c2[hyperbolic] = (np.cosh(sqrt_z) - 1.0) / -z[hyperbolic]
+            c3[hyperbolic] = (np.sinh(sqrt_z) - sqrt_z) / (-z[hyperbolic] * sqrt_z)
+
+        # c0 = 1 - z c2 and c1 = 1 - z c3
+        g2 = s * s * c2
+        g3 = s * s * s * c3
+        g0 = 1.0 - beta * g2
+        g1 = s - beta * g3
+
+        return g0, g1, g2, g3
+
+
+def symplectic_composition_coefficients(scheme):
+    """
+    Return the drift coefficients c and the kick coefficients d of the
+    steps K(d_0) D(c_0) K(d_1) ... D(c_{s-1}) K(d_s) of a symplectic
+    composition scheme. "forest_ruth" and "yoshida6" compose leapfrog,
+    "whfast", "saba4" and "sbab4" compose the Kepler drifts and
+    interaction kicks of WHFast.
+
+    Reference: Yoshida (1990), Construction of higher order symplectic
+    integrators, Physics Letters A 150, 262; Laskar & Robutel (2001), High
+    order symplectic integrators for perturbed Hamiltonian systems,
+    Celestial Mechanics and Dynamical Astronomy 80, 39
+
+    :rtype: numpy.array, numpy.array
+    """
+    match scheme:
+        # Compositions of leapfrog steps with the substep weights w, whose
+        # adjacent half kicks are merged
+        case "forest_ruth":
+            # Yoshida's triple jump, also found by Forest & Ruth (4th order)
+            w_1 = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+            weights = [w_1, 1.0 - 2.0 * w_1, w_1]
+        case "yoshida6":
+            # Yoshida's solution A (6th order)
+            w_1 = -1.17767998417887
+            w_2 = 0.235573213359357
+            w_3 = 0.784513610477560
+            w_0 = 1.0 - 2.0 * (w_1 + w_2 + w_3)
+            weights = [w_3, w_2, w_1, w_0, w_1, w_2, w_3]
+
+        # Drift-kick-drift step of Wisdom & Holman
+        case "whfast":
+            return np.array([0.5, 0.5]), np.array([0.0, 1.0, 0.0])
+        # Drifts to the Gauss-Legendre nodes and kicks with their weights.
+        # The error is O(eps dt^8 + eps^2 dt^2) for a perturbation of
+        # relative size eps.
+        case "saba4":
+            nodes, node_weights = np.polynomial.legendre.leggauss(4)
+            nodes = 0.5 * (nodes + 1.0)
+            return (
+                np.diff(nodes, prepend=0.0, append=1.0),
+                np.concatenate(([0.0], 0.5 * node_weights, [0.0])),
+            )
+        # Kicks at the Gauss-Lobatto nodes with their weights, with the
+        # same error as SABA4
+        case "sbab4":
+            node = 0.5 - math.sqrt(21.0) / 14.0
+            return (
+                np.array([node, 0.5 - node, 0.5 - node, node]),
+                np.array([1.0 / 20.0, 49.0 / 180.0, 16.0 / 45.0, 49.0 / 180.0, 1.0 / 20.0]),
+            )
+        case _:
+            raise ValueError("Invalid composition scheme!")
+
+    weights = np.array(weights)
+    kick_coeff = np.zeros(len(weights) + 1)
+    kick_coeff[:-1] += 0.5 * weights
+    kick_coeff[1:] += 0.5 * weights
+
+    return weights, kick_coeff
+
+
+class BLOCK_LEAPFROG:
+    """
+    Kick-drift-kick leapfrog with hierarchical block time steps. Every
+    object steps with dt / 2^level, so dt is the longest time step, and
+    only the objects at the end of their step get a force evaluation.
+    The forces of the active objects are always summed directly.
+
+    Reference: Pelupessy, Janes & Portegies Zwart (2012), N-body integrators
+    with individual time steps from Hierarchical splitting, New Astronomy 17, 711
+    """
+
+    # Safety factor of the free-fall and flyby times of the pairs
+    ETA = 0.01
+    # Deepest level, i.e. shortest time step dt / 2^MAX_LEVEL
+    MAX_LEVEL = 30
+
+    def __init__(self):
+        # Level of each object, negative before its first force evaluation
+        self.levels = np.zeros(0, dtype=np.int32)
+        # Force evaluations of single objects not yet counted as a whole
+        # force evaluation in acceleration_count
+        self.active_objects_count = 0
+
+    def resize_objects(self, keep, added_count, reset_rows):
+        """
+        Keep the levels of the objects selected by the boolean mask keep and
+        append the levels of added_count new objects to be initialized, as
+        for the objects in reset_rows
+        """
+        if len(self.levels) != len(keep):
+            return
+
+        self.levels = np.concatenate(
+            (self.levels[keep], np.full(added_count, -1, dtype=np.int32))
+        )
+        self.levels[reset_rows] = -1
+
+    def simulation(self, simulator, objects_count, m, G, dt, time_speed):
+        global acceleration_count
+
+        if simulator.is_initialize == True and simulator.is_initialize_integrator == "block_leapfrog":
+            self.levels = np.full(objects_count, -1, dtype=np.int32)
+            simulator.is_initialize = False
+
+        if simulator.is_c_lib == True:
+            active_objects_count = simulator.c_lib.block_leapfrog(
+                objects_count,
+                simulator.c_lib_pointer("x", simulator.x),
+                simulator.c_lib_pointer("v", simulator.v),
+                simulator.c_lib_pointer("a", simulator.a),
+                simulator.c_lib_pointer("m", m),
+                G,
+                dt,
+                time_speed,
+                simulator.c_lib_pointer("block_levels", self.levels),
+                self.ETA,
+                simulator.c_lib_workspace,
+            )
+
+        elif simulator.is_c_lib == False:
+            active_objects_count = self._block_leapfrog(
+                objects_count,
+                simulator.x,
+                simulator.v,
+                simulator.a,
+                m,
+                G,
+                dt,
+                time_speed,
+                self.levels,
+                self.ETA,
+            )
+
+        if objects_count > 0:
+            self.active_objects_count += active_objects_count
+            acceleration_count += self.active_objects_count // objects_count
+            self.active_objects_count %= objects_count
+
+        return time_speed
+
+    @staticmethod
+    def _block_leapfrog(objects_count, x, v, a, m, G, dt, time_speed, levels, eta):
+        """
+        Advance time_speed steps dt in place, at whose end all objects are
+        synchronized. A level increases as soon as the time step criterion
+        asks for it, and decreases by one at most per step when the object
+        is synchronized with the longer step.
+
+        :return: Number of force evaluations of single objects
+        :rtype: int
+        """
+        max_level = BLOCK_LEAPFROG.MAX_LEVEL
+        # Times are counted in ticks of dt / 2^MAX_LEVEL
+        cycle_ticks = 1 << max_level
+        tick = dt / cycle_ticks
+        active_objects_count = 0
+
+        active = np.flatnonzero(levels < 0)
+        if len(active) > 0:
+            a[active], timestep = BLOCK_LEAPFROG._block_acceleration(
+                objects_count, x, v, m, G, active, eta
+            )
+            levels[active] = BLOCK_LEAPFROG._block_level(dt, timestep)
+            active_objects_count += len(active)
+
+        for _ in range(time_speed):
+            # First half kick of every object
+            v += a * np.ldexp(0.5 * dt, -levels)[:, np.newaxis]
+
+            t = 0
+            while t < cycle_ticks:
+                # Drift to the end of the shortest step
+                min_step = 1 << (max_level - int(levels.max()))
+                t_next = (t // min_step + 1) * min_step
+                x += v * ((t_next - t) * tick)
+                t = t_next
+
+                active = np.flatnonzero(t % np.left_shift(1, max_level - levels.astype(np.int64)) == 0)
+                a_active, timestep = BLOCK_LEAPFROG._block_acceleration(
+                    objects_count, x, v, m, G, active, eta
+                )
+                a[active] = a_active
+                active_objects_count += len(active)
+
+                # Second half kick of the step that ends
+                old_levels = levels[active]
+                v[active] += a_active * np.ldexp(0.5 * dt, -old_levels)[:, np.newaxis]
+
+                new_levels = BLOCK_LEAPFROG._block_level(dt, timestep)
+                is_longer = new_levels < old_levels
+                new_levels[is_longer] = old_levels[is_longer] - 1
+                # A longer step must start at a multiple of itself
+                is_misaligned = (
+                    t % np.left_shift(1, max_level - new_levels.astype(np.int64)) != 0
+                )
+                new_levels[is_misaligned] = old_levels[is_misaligned]
+                levels[active] = new_levels
+
+                # First half kick of the next step
+                if t < cycle_ticks:
+                    v[active] += a_active * np.ldexp(0.5 * dt, -new_levels)[:, np.newaxis]
+
+        return active_objects_count
+
+    @staticmethod
+    def _block_acceleration(objects_count, x, v, m, G, active, eta):
+        """
+        Direct sum of the acceleration of the active objects, and their time
+        steps eta * min_j min(sqrt(r^3 / G (m_i + m_j)), r / |v_i - v_j|)
+        from the free-fall and flyby times of every pair. With softening,
+        r^3 is 1 / _softened_inv_r3() and r^2 in the flyby time is
+        r^2 + softening_length^2.
+
+        :rtype: numpy.array, numpy.array
+        """
+        a = np.empty((len(active), 3))
+        timestep = np.empty(len(active))
+        # Blocks of about ACCELERATION_TILE_SIZE^2 pairs
+        chunk_size = max(1, ACCELERATION_TILE_SIZE * ACCELERATION_TILE_SIZE // max(1, objects_count))
+        for start in range(0, len(active), chunk_size):
+            end = min(start + chunk_size, len(active))
+            targets = active[start:end]
+
+            # R[j, k] = x[k] - x[targets[j]]
+            R = x[np.newaxis, :, :] - x[targets, np.newaxis, :]
+            R_norm_square = np.sum(R * R, axis=2)
+            # Exclude self-interaction
+            R_norm_square[np.arange(end - start), targets] = np.inf
+            inv_R_norm_cube = _softened_inv_r3(R_norm_square)
+            a[start:end] = G * np.einsum("jk,jkl->jl", m * inv_R_norm_cube, R)
+
+            V = v[np.newaxis, :, :] - v[targets, np.newaxis, :]
+            V_norm_square = np.sum(V * V, axis=2)
+            with np.errstate(divide="ignore"):
+                free_fall_square = 1.0 / (G * (m[targets, np.newaxis] + m) * inv_R_norm_cube)
+            min_time_square = np.minimum(
+                free_fall_square,
+                np.divide(
+                    R_norm_square + softening_length * softening_length,
+                    V_norm_square,
+                    out=np.full_like(R_norm_square, np.inf),
+                    where=V_norm_square > 0.0,
+                ),
+            )
+            timestep[start:end] = eta * np.sqrt(np.min(min_time_square, axis=1, initial=np.inf))
+
+        return a, timestep
+
+    @staticmethod
+    def _block_level(dt, timestep):
+        """
+        Smallest levels whose time steps dt / 2^level are at most timestep
+
+        :rtype: numpy.array
+        """
+        with np.errstate(divide="ignore"):
+            levels = np.ceil(np.log2(dt / timestep))
+        return np.clip(levels, 0, BLOCK_LEAPFROG.MAX_LEVEL).astype(np.int32)
+
+
+# Force evaluation method used by acceleration(), see set_force_method()
+FORCE_METHODS = ["direct", "barnes_hut", "fmm"]
+force_method = "direct"
+# Opening angle of the tree methods ("barnes_hut" and "fmm")
+opening_angle = 0.5
+# Expansion order of the fast multipole method
+fmm_order = 4
+# Softening of the pair interactions, see set_softening()
+SOFTENING_KERNELS = ["none", "plummer", "spline"]
+softening_kernel = "none"
+softening_length = 0.0
+# The spline kernel is Newtonian beyond SPLINE_SOFTENING_RATIO times the
+# softening length, and then has the Plummer potential at zero separation
+SPLINE_SOFTENING_RATIO = 2.8
+# Kustaanheimo-Stiefel regularization of the close pairs by leapfrog
+# and its compositions, see set_regularization()
+REGULARIZED_INTEGRATORS = ["leapfrog", "forest_ruth", "yoshida6"]
+regularization_radius = 0.0
+# Newton iterations of the regularized time of ks_kepler_step()
+KS_MAX_ITERATION = 64
+# Number of calls to acceleration(), for benchmarks
+acceleration_count = 0
+# Number of steps rejected by the adaptive step size integrators
+rejected_step_count = 0
+
+# Side length of the square blocks of the pairwise separation matrix evaluated
+# at once by direct_acceleration(). The scratch memory is bounded by
+# ACCELERATION_TILE_SIZE ** 2 * 3 doubles, independent of objects_count.
+ACCELERATION_TILE_SIZE = 128
+
+# Maximum number of objects in a leaf of the octree. The FMM leaves are
+# larger since its near field is cheap compared to the M2L translations.
+BARNES_HUT_LEAF_SIZE = 8
+FMM_LEAF_SIZE = 16
+# Maximum depth of the octree. Deeper nodes are turned into leaves, which
+# protects the tree build against (nearly) coincident objects.
+OCTREE_MAX_DEPTH = 64
+
+MAX_FMM_ORDER = 8
+
+# Spatial hash of the grid cells of find_collisions(), with the primes of
+# Teschner et al. (2003). The cell coordinates are clipped to
+# COLLISION_MAX_CELL so that they fit in int64.
+COLLISION_HASH_PRIMES = (73856093, 19349663, 83492791)
+COLLISION_MAX_CELL = 2.0**52
+# The cell itself and 13 of its neighbours, one of each opposite pair
+COLLISION_NEIGHBOUR_OFFSETS = np.array(
+    [
+        (i, j, k)
+        for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)
+        if (i, j, k) >= (0, 0, 0)
+    ],
+    dtype=np.int64,
+)
+
+# Number of cell pairs processed at once by the FMM kernels, which bounds the
+# scratch memory of fmm_acceleration()
+FMM_CHUNK_SIZE = 2048
+
+
+def set_force_method(method, theta=None, order=None):
+    """
+    Select the force evaluation method used by acceleration()
+
+    :param method: "direct", "barnes_hut" or "fmm"
+    :param theta: Opening angle of the tree methods
+    :param order: Expansion order of the fast multipole method
+    :raise ValueError: If method is not in FORCE_METHODS or order is out of range
+    """
+    global force_method, opening_angle, fmm_order
+
+    if method not in FORCE_METHODS:
+        raise ValueError(f"Invalid force method: {method}")
+    if order is not None and not 1 <= order <= MAX_FMM_ORDER:
+        raise ValueError(f"FMM order must be between 1 and {MAX_FMM_ORDER}")
+    force_method = method
+    if theta is not None:
+        opening_angle = theta
+    if order is not None:
+        fmm_order = order
+
+
+def set_softening(kernel, length):
+    """
+    Select the softening of the pair interactions of every force and energy
+    kernel, so that close encounters stay finite. The multipole expansions
+    of the fast multipole method and the Kepler drifts of WHFast are not
+    softened. A zero length turns the softening off.
+
+    :param kernel: "none", "plummer" or "spline". The Plummer kernel replaces
+        r^2 by r^2 + length^2, the cubic spline kernel of Monaghan &
+        Lattanzio (1985) is exactly Newtonian beyond 2.8 length.
+    :param length: Softening length
+    :raise ValueError: If kernel is not in SOFTENING_KERNELS or length is negative
+    """
+    global softening_kernel, softening_length
+
+    if kernel not in SOFTENING_KERNELS:
+        raise ValueError(f"Invalid softening kernel: {kernel}")
+    if length < 0.0:
+        raise ValueError("Softening length must not be negative")
+    softening_kernel = kernel if length > 0.0 else "none"
+    softening_length = length
+
+
+def set_regularization(radius):
+    """
+    Select the radius of the Kustaanheimo-Stiefel regularization of the
+    REGULARIZED_INTEGRATORS, see regularized_pairs(). It is off with
+    softening or a zero radius.
+
+    :param radius: Pairs closer than radius are regularized
+    :raise ValueError: If radius is negative
+    """
+    global regularization_radius
+
+    if radius < 0.0:
+        raise ValueError("Regularization radius must not be negative")
+    regularization_radius = radius
+
+
+def _softened_inv_r3(R_norm_square):
+    """
+    Softened 1 / r^3 of the pairs at the squared separations R_norm_square,
+    so that the acceleration is - G m vec{r} / r^3. Infinite separations
+    give zero.
+
+    :rtype: numpy.ndarray
+    """
+    match softening_kernel:
+        case "plummer":
+            return (R_norm_square + softening_length * softening_length) ** -1.5
+        case "spline":
+            h = SPLINE_SOFTENING_RATIO * softening_length
+            is_inside = R_norm_square < h * h
+            with np.errstate(divide="ignore"):
+                inv_r3 = R_norm_square ** -1.5
+                if np.any(is_inside):
+                    u = np.sqrt(R_norm_square[is_inside]) / h
+                    inv_r3[is_inside] = np.where(
+                        u < 0.5,
+                        32.0 / 3.0 + u * u * (32.0 * u - 38.4),
+                        64.0 / 3.0 - 48.0 * u + 38.4 * u * u - 32.0 / 3.0 * u * u * u
+                        - 1.0 / (15.0 * u * u * u),
+                    ) / (h * h * h)
+            return inv_r3
+        case _:
+            return R_norm_square ** -1.5
+
+
+def _softened_inv_r(R_norm_square):
+    """
+    Softened 1 / r of the pairs, so that the potential energy is
+    - G m_1 m_2 / r. Infinite separations give zero.
+
+    :rtype: numpy.ndarray
+    """
+    match softening_kernel:
+        case "plummer":
+            return (R_norm_square + softening_length * softening_length) ** -0.5
+        case "spline":
+            h = SPLINE_SOFTENING_RATIO * softening_length
+            is_inside = R_norm_square < h * h
+            with np.errstate(divide="ignore"):
+                inv_r = R_norm_square ** -0.5
+                if np.any(is_inside):
+                    u = np.sqrt(R_norm_square[is_inside]) / h
+                    inv_r[is_inside] = np.where(
+                        u < 0.5,
+                        2.8 - u * u * (16.0 / 3.0 + u * u * (6.4 * u - 9.6)),
+                        3.2 - 1.0 / (15.0 * u)
+                        - u * u * (32.0 / 3.0 + u * (-16.0 + u * (9.6 - 32.0 / 15.0 * u))),
+                    ) / h
+            return inv_r
+        case _:
+            return R_norm_square ** -0.5
+
+
+def _softened_jerk_factor(R_norm_square, inv_r3):
+    """
+    Factor g of the jerk - G m / r^3 (vec{v} - g (vec{r} . vec{v}) vec{r})
+    of the pairs, given inv_r3 = _softened_inv_r3(R_norm_square). It is
+    3 / r^2 without softening.
+
+    :rtype: numpy.ndarray
+    """
+    match softening_kernel:
+        case "plummer":
+            return 3.0 / (R_norm_square + softening_length * softening_length)
+        case "spline":
+            h = SPLINE_SOFTENING_RATIO * softening_length
+            is_inside = R_norm_square < h * h
+            with np.errstate(divide="ignore", invalid="ignore"):
+                factor = 3.0 / R_norm_square
+                if np.any(is_inside):
+                    u = np.sqrt(R_norm_square[is_inside]) / h
+                    factor[is_inside] = np.where(
+                        u < 0.5,
+                        76.8 - 96.0 * u,
+                        (48.0 - 76.8 * u + 32.0 * u * u - 0.2 / (u * u * u * u)) / u,
+                    ) / (h**5 * inv_r3[is_inside])
+            return factor
+        case _:
+            return 3.0 / R_norm_square
+
+
+def acceleration(objects_count, x, m, G):
+    """
+    Calculate acceleration with the force evaluation method chosen by
+    set_force_method()
+    """
+    global acceleration_count
+    acceleration_count += 1
+
+    match force_method:
+        case "barnes_hut":
+            return barnes_hut_acceleration(objects_count, x, m, G, opening_angle)
+        case "fmm":
+            return fmm_acceleration(
+                objects_count, x, m, G, opening_angle, fmm_order
+            )
+        case _:
+            return direct_acceleration(objects_count, x, m, G)
+
+
+def acceleration_potential(objects_count, x, m, G):
+    """
+    Calculate acceleration as acceleration() and also return the potential
+    energy. The direct sum computes both in one pass over the pairs, the
+    tree methods need a separate pass for the potential energy.
+
+    :rtype: tuple(numpy.ndarray, float)
+    """
+    global acceleration_count
+
+    if force_method == "direct":
+        acceleration_count += 1
+        return _direct_acceleration(objects_count, x, m, G, is_potential=True)
+
+    return acceleration(objects_count, x, m, G), potential_energy(objects_count, x, m, G)
+
+
+def acceleration_jerk(objects_count, x, v, m, G, tile_size=ACCELERATION_TILE_SIZE):
+    """
+    Direct sum of the acceleration and its time derivative, the jerk
+    j = - GM/r^3 (vec{v} - 3 (vec{r} . vec{v}) / r^2 vec{r}), on blocks of
+    about tile_size x tile_size pairs
+
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    global acceleration_count
+    acceleration_count += 1
+
+    a = np.empty((objects_count, 3))
+    jerk = np.empty((objects_count, 3))
+    chunk_size = max(1, tile_size * tile_size // max(1, objects_count))
+    for start in range(0, objects_count, chunk_size):
+        end = min(start + chunk_size, objects_count)
+
+        # R[j, k] = x[k] - x[start + j]
+        R = x[np.newaxis, :, :] - x[start:end, np.newaxis, :]
+        V = v[np.newaxis, :, :] - v[start:end, np.newaxis, :]
+        R_norm_square = np.sum(R * R, axis=2)
+        # Exclude self-interaction
+        R_norm_square[np.arange(end - start), np.arange(start, end)] = np.inf
+        inv_R_norm_cube = _softened_inv_r3(R_norm_square)
+        temp_value = G * m * inv_R_norm_cube
+        # g (vec{r} . vec{v}), with g = 3 / r^2 without softening
+        RV = _softened_jerk_factor(R_norm_square, inv_R_norm_cube) * np.sum(R * V, axis=2)
+
+        a[start:end] = np.einsum("jk,jkl->jl", temp_value, R)
+        jerk[start:end] = np.einsum("jk,jkl->jl", temp_value, V) - np.einsum(
+            "jk,jkl->jl", temp_value * RV, R
+        )
+
+    return a, jerk
+
+
+def direct_acceleration(objects_count, x, m, G, tile_size=ACCELERATION_TILE_SIZE):
+    """
+    Calculate acceleration by a = - GM/r^3 vec{r}
+
+    The pairwise interactions are evaluated with NumPy broadcasting on blocks
+    of tile_size x tile_size pairs. Only the blocks on and above the diagonal
+    are computed, and each off-diagonal block is applied to both sides.
+    """
+    return _direct_acceleration(objects_count, x, m, G, tile_size)[0]
+
+
+def _direct_acceleration(
+    objects_count, x, m, G, tile_size=ACCELERATION_TILE_SIZE, is_potential=False
+):
+    """
+    direct_acceleration() that also returns the potential energy if
+    is_potential is set, from the same separations, or None otherwise
+
+    :rtype: tuple(numpy.ndarray, float)
+    """
+    a = np.zeros((objects_count, 3))
+    potential = 0.0 if is_potential else None
+
+    for start_j in range(0, objects_count, tile_size):
+        end_j = min(start_j + tile_size, objects_count)
+        for start_k in range(start_j, objects_count, tile_size):
+            end_k = min(start_k + tile_size, objects_count)
+
+            # R[j, k] = x[start_j + j] - x[start_k + k]
+            R = x[start_j:end_j, np.newaxis, :] - x[np.newaxis, start_k:end_k, :]
+            R_norm_square = np.sum(R * R, axis=2)
+            if start_j == start_k:
+                # Exclude self-interaction
+                np.fill_diagonal(R_norm_square, np.inf)
+            inv_R_norm_cube = _softened_inv_r3(R_norm_square)
+
+            a[start_j:end_j] -= np.einsum(
+                "jk,jkl->jl", inv_R_norm_cube * m[start_k:end_k], R
+            )
+            if start_j != start_k:
+                a[start_k:end_k] += np.einsum(
+                    "jk,jkl->kl", inv_R_norm_cube * m[start_j:end_j, np.newaxis], R
+                )
+
+            if is_potential:
+                inv_R_norm = _softened_inv_r(R_norm_square)
+                if start_j == start_k:
+                    # Every pair appears twice in the diagonal blocks
+                    inv_R_norm *= 0.5
+                potential -= m[start_j:end_j] @ inv_R_norm @ m[start_k:end_k]
+
+    if is_potential:
+        potential *= G
+    return G * a, potential
+
+
+def barnes_hut_acceleration(objects_count, x, m, G, theta):
+    """
+    Calculate acceleration with the Barnes-Hut tree code
+
+    A node of side length s at distance d from the center of mass is treated
+    as a point mass if s / d < theta. The tree walk is vectorized over the
+    objects: every node is visited once, together with the array of objects
+    that still need to open it.
+
+    Reference: Barnes & Hut (1986), Nature 324, 446
+    """
+    a = np.zeros((objects_count, 3))
+    if objects_count < 2:
+        return a
+
+    index, nodes = _build_octree(objects_count, x, m, BARNES_HUT_LEAF_SIZE)
+
+    # Position of each object in the tree ordering, used to check whether
+    # an object lies inside a node
+    rank = np.empty(objects_count, dtype=int)
+    rank[index] = np.arange(objects_count)
+
+    theta_square = theta * theta
+    stack = [(0, np.arange(objects_count))]
+    while stack:
+        node, targets = stack.pop()
+        start, end, node_mass, com, size, children = nodes[node]
+
+        # Leaf: direct summation
+        if not children:
+            sources = index[start:end]
+            R = x[targets, np.newaxis, :] - x[np.newaxis, sources, :]
+            R_norm_square = np.sum(R * R, axis=2)
+            R_norm_square[targets[:, np.newaxis] == sources[np.newaxis, :]] = np.inf
+            a[targets] -= G * np.einsum(
+                "jk,jkl->jl", m[sources] * _softened_inv_r3(R_norm_square), R
+            )
+            continue
+
+        R = x[targets] - com
+        R_norm_square = np.sum(R * R, axis=1)
+        is_inside = (rank[targets] >= start) & (rank[targets] < end)
+        is_accepted = (size * size < theta_square * R_norm_square) & ~is_inside
+
+        accepted = is_accepted.nonzero()[0]
+        a[targets[accepted]] -= (
+            G * node_mass * R[accepted] * _softened_inv_r3(R_norm_square[accepted])[:, np.newaxis]
+        )
+
+        rest = targets[~is_accepted]
+        if rest.size > 0:
+            for child in children:
+                stack.append((child, rest))
+
+    return a
+
+
+def _build_octree(objects_count, x, m, leaf_size):
+    """
+    Build the octree for the tree methods, with at most leaf_size objects
+    per leaf unless OCTREE_MAX_DEPTH is reached
+
+    :return: index, nodes
+        index: Permutation of the objects such that every node covers the
+            contiguous range index[start:end]
+        nodes: List of (start, end, mass, center of mass, side length, children)
+            with the root at nodes[0]
+    """
+    index = np.arange(objects_count)
+    nodes = []
+
+    x_min = np.min(x, axis=0)
+    x_max = np.max(x, axis=0)
+    center = 0.5 * (x_min + x_max)
+    half = 0.5 * np.max(x_max - x_min) * (1.0 + 1e-10) + 1e-300
+
+    stack = [(0, objects_count, center, half, 0, None)]
+    while stack:
+        start, end, center, half, depth, parent = stack.pop()
+        objs = index[start:end]
+        node_mass = np.sum(m[objs])
+        if node_mass > 0.0:
+            com = np.sum(m[objs, np.newaxis] * x[objs], axis=0) / node_mass
+        else:
+            com = center
+
+        node = len(nodes)
+        nodes.append((start, end, node_mass, com, 2.0 * half, []))
+        if parent is not None:
+            nodes[parent][5].append(node)
+
+        if end - start <= leaf_size or depth >= OCTREE_MAX_DEPTH:
+            continue
+
+        # Sort the objects by octant
+        octant = (
+            (x[objs, 0] >= center[0]).astype(int)
+            + 2 * (x[objs, 1] >= center[1])
+            + 4 * (x[objs, 2] >= center[2])
+        )
+        order = np.argsort(octant, kind="stable")
+        index[start:end] = objs[order]
+        counts = np.bincount(octant, minlength=8)
+
+        child_start = start
+        for i in range(8):
+            if counts[i] == 0:
+                continue
+            offset = np.array([i & 1, (i >> 1) & 1, (i >> 2) & 1]) - 0.5
+            stack.append(
+                (
+                    child_start,
+                    child_start + counts[i],
+                    center + offset * half,
+                    0.5 * half,
+                    depth + 1,
+                    node,
+                )
+            )
+            child_start += counts[i]
+
+    return index, nodes
+
+
+def fmm_acceleration(objects_count, x, m, G, theta, order):
+    """
+    Calculate acceleration with the fast multipole method
+
+    Multipole and local expansions of 1/r are Cartesian Taylor series of the
+    given order about the center of mass of each octree node. Two nodes with
+    expansion radii r_A, r_B interact through their expansions if
+    r_A + r_B < theta * d, otherwise the larger one is opened, and pairs of
+    leaves are summed directly. The interactions are processed in batches of
+    node pairs, so the cost is O(N) for fixed theta and order.
+
+    Reference: Dehnen (2002), J. Comput. Phys. 179, 27
+    """
+    a = np.zeros((objects_count, 3))
+    if objects_count < 2:
+        return a
+
+    tables = _fmm_tables(order)
+    index, nodes = _build_octree(objects_count, x, m, FMM_LEAF_SIZE)
+    nodes_count = len(nodes)
+
+    start = np.array([node[0] for node in nodes])
+    end = np.array([node[1] for node in nodes])
+    center = np.array([node[3] for node in nodes])
+    children = np.full((nodes_count, 8), -1)
+    parent = np.full(nodes_count, -1)
+    for i, node in enumerate(nodes):
+        children[i, : len(node[5])] = node[5]
+        parent[node[5]] = i
+    is_leaf = children[:, 0] < 0
+
+    # Parents are created before their children, so the depth can be filled
+    # in a single pass
+    depth = np.zeros(nodes_count, dtype=int)
+    for i in range(1, nodes_count):
+        depth[i] = depth[parent[i]] + 1
+    levels = [
+        (depth == level).nonzero()[0] for level in range(1, np.max(depth) + 1)
+    ]
+
+    leaves = is_leaf.nonzero()[0]
+    leaves = leaves[np.argsort(start[leaves])]
+    leaf_of_objects = np.empty(objects_count, dtype=int)
+    leaf_of_objects[index] = np.repeat(leaves, end[leaves] - start[leaves])
+
+    # P2M and expansion radius of the leaves
+    y = x - center[leaf_of_objects]
+    multipoles = np.zeros((nodes_count, tables["size"]))
+    np.add.at(
+        multipoles,
+        leaf_of_objects,
+        m[:, np.newaxis] * _fmm_powers(y, tables["indices"]),
+    )
+    radius = np.zeros(nodes_count)
+    np.maximum.at(radius, leaf_of_objects, np.sqrt(np.sum(y * y, axis=1)))
+
+    # M2M, from the deepest level upwards
+    for level in reversed(levels):
+        shift = center[level] - center[parent[level]]
+        np.add.at(
+            multipoles,
+            parent[level],
+            _fmm_translate(multipoles[level], shift, tables, "m2m"),
+        )
+        np.maximum.at(
+            radius,
+            parent[level],
+            np.sqrt(np.sum(shift * shift, axis=1)) + radius[level],
+        )
+
+    # Dual tree walk over the unordered node pairs (first, second). Every
+    # accepted pair interacts in both directions.
+    locals_ = np.zeros((nodes_count, tables["size"]))
+    near_field = []
+    first = np.array([0])
+    second = np.array([0])
+    upper_first, upper_second = np.triu_indices(8)
+    while first.size > 0:
+        R = center[first] - center[second]
+        is_self = first == second
+        is_accepted = ~is_self & (
+            radius[first] + radius[second] < theta * np.sqrt(np.sum(R * R, axis=1))
+        )
+
+        # M2L, using T_n(-R) = (-1)^|n| T_n(R) for the opposite direction
+        accepted_pairs = is_accepted.nonzero()[0]
+        for i in range(0, accepted_pairs.size, FMM_CHUNK_SIZE):
+            accepted = accepted_pairs[i : i + FMM_CHUNK_SIZE]
+            T = _fmm_derivatives(R[accepted], tables)
+            np.add.at(
+                locals_,
+                first[accepted],
+                _fmm_m2l(multipoles[second[accepted]], T, tables),
+            )
+            np.add.at(
+                locals_,
+                second[accepted],
+                _fmm_m2l(multipoles[first[accepted]], T * tables["parity"], tables),
+            )
+
+        is_leaf_pair = ~is_accepted & is_leaf[first] & is_leaf[second]
+        near_field.append((first[is_leaf_pair], second[is_leaf_pair]))
+
+        # Open a node on itself into the pairs of its children, otherwise
+        # open the larger node of the pair
+        is_opened = ~is_accepted & ~is_leaf_pair
+        is_split_self = is_opened & is_self
+        is_split_first = (
+            is_opened
+            & ~is_self
+            & ~is_leaf[first]
+            & (is_leaf[second] | (radius[first] >= radius[second]))
+        )
+        is_split_second = is_opened & ~is_self & ~is_split_first
+
+        split_self = children[first[is_split_self]]
+        new_first = np.concatenate(
+            (
+                split_self[:, upper_first].ravel(),
+                children[first[is_split_first]].ravel(),
+                np.repeat(first[is_split_second], 8),
+            )
+        )
+        new_second = np.concatenate(
+            (
+                split_self[:, upper_second].ravel(),
+                np.repeat(second[is_split_first], 8),
+                children[second[is_split_second]].ravel(),
+            )
+        )
+        is_valid = (new_first >= 0) & (new_second >= 0)
+        first = new_first[is_valid]
+        second = new_second[is_valid]
+
+    # L2L, from the root downwards
+    for level in levels:
+        shift = center[level] - center[parent[level]]
+        locals_[level] += _fmm_translate(
+            locals_[parent[level]], shift, tables, "l2l"
+        )
+
+    # L2P
+    a += _fmm_gradient(locals_[leaf_of_objects], y, tables)
+
+    # P2P between the leaves of the near field, in both directions
+    first = np.concatenate([pair[0] for pair in near_field])
+    second = np.concatenate([pair[1] for pair in near_field])
+    is_self = first == second
+    a += _fmm_near_field(
+        objects_count,
+        x,
+        m,
+        index,
+        start,
+        end,
+        np.concatenate((first, second[~is_self])),
+        np.concatenate((second, first[~is_self])),
+    )
+
+    return G * a
+
+
+def _fmm_tables(order):
+    """
+    Index tables of the Cartesian multi-indices n = (n1, n2, n3), |n| <= order,
+    used by fmm_acceleration(). The tables are cached per order.
+
+    Each translation table lists the terms out[out_idx] += coef * in[in_idx]
+    * power[power_idx] together with a 0/1 matrix summing the terms into out.
+    """
+    if order in _FMM_TABLES:
+        return _FMM_TABLES[order]
+
+    indices = [
+        (i, j, n - i - j)
+        for n in range(order + 1)
+        for i in range(n, -1, -1)
+        for j in range(n - i, -1, -1)
+    ]
+    lookup = {n: idx for idx, n in enumerate(indices)}
+    size = len(indices)
+
+    def binomial(n, k):
+        return math.prod(math.comb(n[i], k[i]) for i in range(3))
+
+    def table(terms):
+        out_idx, in_idx, power_idx, coef = (np.array(column) for column in zip(*terms))
+        sum_matrix = np.zeros((len(terms), size))
+        sum_matrix[np.arange(len(terms)), out_idx] = 1.0
+        return in_idx, power_idx, coef, sum_matrix
+
+    m2m_terms = []
+    m2l_terms = []
+    l2l_terms = []
+    # The expansions are centered at the center of mass, so the dipole terms
+    # of the multipoles vanish and are skipped
+    for n in indices:
+        for k in indices:
+            if all(k[i] <= n[i] for i in range(3)):
+                n_minus_k = tuple(n[i] - k[i] for i in range(3))
+                # Q_n += C(n, k) Q_k d^(n - k)
+                if sum(k) != 1:
+                    m2m_terms.append(
+                        (lookup[n], lookup[k], lookup[n_minus_k], binomial(n, k))
+                    )
+                # L_k += C(n, k) L_n d^(n - k)
+                l2l_terms.append((lookup[k], lookup[n], lookup[n_minus_k], binomial(n, k)))
+            if sum(n) + sum(k) <= order and sum(n) != 1:
+                n_plus_k = tuple(n[i] + k[i] for i in range(3))
+                # L_k += (-1)^|n| C(n + k, k) Q_n T_(n + k)
+                m2l_terms.append(
+                    (lookup[k], lookup[n], lookup[n_plus_k], (-1) ** sum(n) * binomial(n_plus_k, k))
+                )
+
+    # Recurrence of the Taylor coefficients T_n = D^n (1 / r) / n!
+    #     |n| r^2 T_n = -(2|n| - 1) sum_i R_i T_(n - e_i) - (|n| - 1) sum_i T_(n - 2 e_i)
+    recurrence = []
+    for n in indices[1:]:
+        first = [(i, lookup[n[:i] + (n[i] - 1,) + n[i + 1 :]]) for i in range(3) if n[i] >= 1]
+        second = [lookup[n[:i] + (n[i] - 2,) + n[i + 1 :]] for i in range(3) if n[i] >= 2]
+        recurrence.append((sum(n), first, second))
+
+    # Gradient of the local expansion: dL/dy_i = sum_k k_i L_k y^(k - e_i)
+    gradient = []
+    for i in range(3):
+        terms = [
+            (lookup[k], lookup[k[:i] + (k[i] - 1,) + k[i + 1 :]], k[i])
+            for k in indices
+            if k[i] >= 1
+        ]
+        gradient.append(tuple(np.array(column) for column in zip(*terms)))
+
+    _FMM_TABLES[order] = {
+        "order": order,
+        "size": size,
+        "indices": np.array(indices),
+        "parity": np.array([(-1.0) ** sum(n) for n in indices]),
+        "m2m": table(m2m_terms),
+        "m2l": table(m2l_terms),
+        "l2l": table(l2l_terms),
+        "recurrence": recurrence,
+        "gradient": gradient,
+    }
+    return _FMM_TABLES[order]
+
+
+_FMM_TABLES = {}
+
+
+def _fmm_powers(y, indices):
+    """
+    Compute the monomials y^n for the multi-indices n, row by row
+
+    :rtype: numpy.ndarray
+    """
+    order = np.max(indices)
+    powers = y[:, np.newaxis, :] ** np.arange(order + 1)[np.newaxis, :, np.newaxis]
+    return (
+        powers[:, indices[:, 0], 0]
+        * powers[:, indices[:, 1], 1]
+        * powers[:, indices[:, 2], 2]
+    )
+
+
+def _fmm_translate(expansions, shift, tables, kind):
+    """
+    Shift the center of multipole (kind="m2m") or local (kind="l2l") expansions
+
+    :rtype: numpy.ndarray
+    """
+    in_idx, power_idx, coef, sum_matrix = tables[kind]
+    shift_powers = _fmm_powers(shift, tables["indices"])
+    return (expansions[:, in_idx] * shift_powers[:, power_idx] * coef) @ sum_matrix
+
+
+def _fmm_m2l(multipoles, T, tables):
+    """
+    Convert multipole expansions into local expansions, where T are the
+    Taylor coefficients at the separation of the local centers from the
+    multipole centers
+
+    :rtype: numpy.ndarray
+    """
+    in_idx, power_idx, coef, sum_matrix = tables["m2l"]
+    return (multipoles[:, in_idx] * T[:, power_idx] * coef) @ sum_matrix
+
+
+def _fmm_derivatives(R, tables):
+    """
+    Compute the Taylor coefficients T_n = D^n (1 / r) / n! at R, row by row
+
+    :rtype: numpy.ndarray
+    """
+    R_norm_square = np.sum(R * R, axis=1)
+    T = np.empty((R.shape[0], tables["size"]))
+    T[:, 0] = R_norm_square**-0.5
+    for idx, (n_norm, first, second) in enumerate(tables["recurrence"], start=1):
+        value = np.zeros(R.shape[0])
+        for i, j in first:
+            value += R[:, i] * T[:, j]
+        value *= 2 * n_norm - 1
+        for j in second:
+            value += (n_norm - 1) * T[:, j]
+        T[:, idx] = -value / (n_norm * R_norm_square)
+    return T
+
+
+def _fmm_gradient(locals_, y, tables):
+    """
+    Evaluate the gradient of local expansions at the offsets y (L2P)
+
+    :rtype: numpy.ndarray
+    """
+    powers = _fmm_powers(y, tables["indices"])
+    gradient = np.empty((y.shape[0], 3))
+    for i, (k_idx, power_idx, coef) in enumerate(tables["gradient"]):
+        gradient[:, i] = np.sum(locals_[:, k_idx] * powers[:, power_idx] * coef, axis=1)
+    return gradient
+
+
+def _fmm_near_field(objects_count, x, m, index, start, end, targets, sources):
+    """
+    Direct summation between pairs of leaves (P2P), without the factor G
+
+    The objects of each leaf are padded to the size of the largest leaf, so
+    a batch of leaf pairs is evaluated with a single broadcast.
+
+    :rtype: numpy.ndarray
+    """
+    a = np.zeros((objects_count + 1, 3))
+    if targets.size == 0:
+        return a[:-1]
+
+    # objects[node] lists the objects of the leaf, padded with objects_count
+    nodes = np.unique(np.concatenate((targets, sources)))
+    counts = end[nodes] - start[nodes]
+    leaf_size = np.max(counts)
+    slot = np.zeros(len(start), dtype=int)
+    slot[nodes] = np.arange(nodes.size)
+    objects = np.full((nodes.size, leaf_size), objects_count)
+    column = np.arange(leaf_size)
+    is_filled = column[np.newaxis, :] < counts[:, np.newaxis]
+    objects[is_filled] = index[(start[nodes][:, np.newaxis] + column)[is_filled]]
+
+    x_padded = np.vstack((x, np.zeros(3)))
+    m_padded = np.append(m, 0.0)
+
+    chunk_size = max(1, FMM_CHUNK_SIZE * 64 // (leaf_size * leaf_size))
+    for i in range(0, targets.size, chunk_size):
+        target_objects = objects[slot[targets[i : i + chunk_size]]]
+        source_objects = objects[slot[sources[i : i + chunk_size]]]
+
+        R = x_padded[target_objects][:, :, np.newaxis, :] - x_padded[source_objects][:, np.newaxis, :, :]
+        R_norm_square = np.sum(R * R, axis=3)
+        # Exclude padding and self-interaction
+        R_norm_square[
+            (source_objects == objects_count)[:, np.newaxis, :]
+            | (target_objects[:, :, np.newaxis] == source_objects[:, np.newaxis, :])
+        ] = np.inf
+
+        np.add.at(
+            a,
+            target_objects.ravel(),
+            -np.einsum(
+                "pjk,pjkl->pjl", m_padded[source_objects][:, np.newaxis, :] * _softened_inv_r3(R_norm_square), R
+            ).reshape(-1, 3),
+        )
+
+    return a[:-1]
+
+def compute_energy(objects_count, x, v, m, G):
+    return 0.5 * np.sum(m * np.sum(v * v, axis=1)) + potential_energy(
+        objects_count, x, m, G
+    )
+
+
+def potential_energy(objects_count, x, m, G, tile_size=ACCELERATION_TILE_SIZE):
+    """
+    Calculate the potential energy in blocks of tile_size x tile_size pairs
+    as direct_acceleration(). Return NaN if two objects have the same
+    position without softening.
+
+    :rtype: float
+    """
+    potential = 0.0
+    for start_j in range(0, objects_count, tile_size):
+        end_j = min(start_j + tile_size, objects_count)
+        for start_k in range(start_j, objects_count, tile_size):
+            end_k = min(start_k + tile_size, objects_count)
+
+            R = x[start_j:end_j, np.newaxis, :] - x[np.newaxis, start_k:end_k, :]
+            R_norm_square = np.sum(R * R, axis=2)
+            if start_j == start_k:
+                # Count every pair once
+                R_norm_square[np.tril_indices(end_j - start_j)] = np.inf
+            if softening_kernel == "none" and np.any(R_norm_square == 0.0):
+                return np.nan
+
+            potential -= m[start_j:end_j] @ _softened_inv_r(R_norm_square) @ m[start_k:end_k]
+
+    return G * potential
+
+
+def _abs_max(array):
+    """
+    Return the maximum absolute value of array without allocating a
+    temporary for np.abs()
+
+    :rtype: float
+    """
+    return max(array.max(), -array.min())
+
+def find_collisions(x, R):
+    """
+    Find the pairs of overlapping objects, |x_i - x_j| < R_i + R_j. The
+    objects are binned into a uniform grid of cells as large as the largest
+    diameter, whose hashed keys are sorted, so that only the objects in
+    neighbouring cells are compared.
+
+    :return: Indices i < j of the overlapping pairs
+    :rtype: tuple of numpy.ndarray
+    """
+    objects_count = len(R)
+    cell_size = 2.0 * R.max() if objects_count > 1 else 0.0
+    if not cell_size > 0.0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    cells = np.floor(
+        np.clip(x / cell_size, -COLLISION_MAX_CELL, COLLISION_MAX_CELL)
+    ).astype(np.int64)
+    order = np.argsort(_collision_cell_keys(cells))
+    sorted_keys = _collision_cell_keys(cells[order])
+
+    pairs_i = []
+    pairs_j = []
+    for offset in COLLISION_NEIGHBOUR_OFFSETS:
+        neighbour_cells = cells + offset
+        keys = _collision_cell_keys(neighbour_cells)
+        start = np.searchsorted(sorted_keys, keys, side="left")
+        counts = np.searchsorted(sorted_keys, keys, side="right") - start
+        total = counts.sum()
+        if total == 0:
+            continue
+
+        # Every object i against the run of objects with the neighbour key
+        i = np.repeat(np.arange(objects_count), counts)
+        j = order[
+            np.arange(total) + np.repeat(start - (np.cumsum(counts) - counts), counts)
+        ]
+        # Other cells may share the key, and the pairs in the same cell are
+        # found from both sides
+        is_candidate = np.all(cells[j] == neighbour_cells[i], axis=1)
+        if not offset.any():
+            is_candidate &= i < j
+        i = i[is_candidate]
+        j = j[is_candidate]
+        R_ij = x[j] - x[i]
+        is_overlapping = np.sum(R_ij * R_ij, axis=1) < (R[i] + R[j]) ** 2
+        pairs_i.append(np.minimum(i, j)[is_overlapping])
+        pairs_j.append(np.maximum(i, j)[is_overlapping])
+
+    if not pairs_i:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def _collision_cell_keys(cells):
+    """
+    Spatial hash of integer grid cells. Collisions of the hash only add
+    candidate pairs, which are rejected by the distance test.
+
+    :rtype: numpy.ndarray
+    """
+    return (
+        (cells[:, 0] * COLLISION_HASH_PRIMES[0])
+        ^ (cells[:, 1] * COLLISION_HASH_PRIMES[1])
+        ^ (cells[:, 2] * COLLISION_HASH_PRIMES[2])
+    )
+
+
+def regularized_pairs(x, m):
+    """
+    Select the pairs whose relative motion is integrated exactly by
+    regularized_drift(): the pairs closer than regularization_radius,
+    closest first, with every object in at most one pair. The pairs are
+    found with find_collisions().
+
+    :return: Indices i < j of the pairs, or None if the regularization is off
+    :rtype: tuple of numpy.ndarray
+    """
+    if not regularization_radius > 0.0 or softening_kernel != "none":
+        return None
+
+    i, j = find_collisions(x, np.full(len(m), 0.5 * regularization_radius))
+    R = x[i] - x[j]
+    r = np.sqrt(np.sum(R * R, axis=1))
+    i, j, r = i[r > 0.0], j[r > 0.0], r[r > 0.0]
+
+    is_paired = np.zeros(len(m), dtype=bool)
+    selected = []
+    for k in np.argsort(r):
+        if not is_paired[i[k]] and not is_paired[j[k]]:
+            is_paired[i[k]] = is_paired[j[k]] = True
+            selected.append(k)
+    return i[selected], j[selected]
+
+
+def remove_pair_acceleration(a, x, m, G, pairs):
+    """
+    Remove the mutual acceleration of the regularized pairs from a, which
+    leaves the perturbations of the other objects for the kicks
+
+    :rtype: numpy.ndarray
+    """
+    if pairs is None or len(pairs[0]) == 0:
+        return a
+
+    i, j = pairs
+    R = x[i] - x[j]
+    temp_value = G * R * (np.sum(R * R, axis=1) ** -1.5)[:, np.newaxis]
+    a = a.copy()
+    a[i] += m[j, np.newaxis] * temp_value
+    a[j] -= m[i, np.newaxis] * temp_value
+    return a
+
+
+def regularized_drift(x, v, m, G, dt, pairs):
+    """
+    Drift the objects by dt. The regularized pairs move along their exact
+    two-body orbits around their center of mass, see ks_kepler_step().
+
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    x_1 = x + v * dt
+    if pairs is None or len(pairs[0]) == 0:
+        return x_1, v
+
+    i, j = pairs
+    m_i = m[i, np.newaxis]
+    m_j = m[j, np.newaxis]
+    pair_mass = m_i + m_j
+    x_cm = (m_i * x[i] + m_j * x[j]) / pair_mass
+    v_cm = (m_i * v[i] + m_j * v[j]) / pair_mass
+    R, V = ks_kepler_step(x[i] - x[j], v[i] - v[j], G * pair_mass[:, 0], dt)
+
+    v_1 = v.copy()
+    x_1[i] = x_cm + v_cm * dt + (m_j / pair_mass) * R
+    x_1[j] = x_cm + v_cm * dt - (m_i / pair_mass) * R
+    v_1[i] = v_cm + (m_j / pair_mass) * V
+    v_1[j] = v_cm - (m_i / pair_mass) * V
+    return x_1, v_1
+
+
+def ks_kepler_step(R, V, gm, dt):
+    """
+    Advance the relative positions R and velocities V of pairs with
+    G (m_i + m_j) = gm by dt. In the Kustaanheimo-Stiefel variables u, with
+    R = L(u) u and dt = r ds, the two-body motion is u'' = h u / 2 in the
+    time s, which stays regular through r = 0. It is solved with the
+    functions G_k of WHFAST, and the time s of dt from the closed form of t(s).
+
+    Reference: Stiefel & Scheifele (1971), Linear and Regular Celestial
+    Mechanics
+
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    r = np.sqrt(np.sum(R * R, axis=1))
+
+    # u with L(u) u = R, from the larger of r + x and r - x
+    is_positive = R[:, 0] >= 0.0
+    u_max = np.sqrt(0.5 * (r + np.abs(R[:, 0])))
+    u = np.zeros((len(r), 4))
+    u[:, 0] = np.where(is_positive, u_max, 0.5 * R[:, 1] / u_max)
+    u[:, 1] = np.where(is_positive, 0.5 * R[:, 1] / u_max, u_max)
+    u[:, 2] = np.where(is_positive, 0.5 * R[:, 2] / u_max, 0.0)
+    u[:, 3] = np.where(is_positive, 0.0, 0.5 * R[:, 2] / u_max)
+    # du / ds = L(u)^T V / 2
+    du = 0.5 * np.stack(
+        (
+            u[:, 0] * V[:, 0] + u[:, 1] * V[:, 1] + u[:, 2] * V[:, 2],
+            -u[:, 1] * V[:, 0] + u[:, 0] * V[:, 1] + u[:, 3] * V[:, 2],
+            -u[:, 2] * V[:, 0] - u[:, 3] * V[:, 1] + u[:, 0] * V[:, 2],
+            u[:, 3] * V[:, 0] - u[:, 2] * V[:, 1] + u[:, 1] * V[:, 2],
+        ),
+        axis=1,
+    )
+
+    # u'' = -beta u with beta = -h / 2, for bound and unbound pairs alike
+    beta = 0.5 * gm / r - 0.25 * np.sum(V * V, axis=1)
+    A = np.sum(u * u, axis=1)
+    B = np.sum(du * du, axis=1)
+    C = np.sum(u * du, axis=1)
+
+    # t(s) = (A (2s + G_1) + 2 C G_2 + B G_3) / 4 with G_k(2s), and t is
+    # within D of r_mean s for beta > 0. Otherwise r'' = gm - 4 beta r >= gm
+    # gives t(s) >= gm s^3 / 24.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        is_elliptic = beta > 0.0
+        omega = np.sqrt(np.where(is_elliptic, beta, 1.0))
+        r_mean = 0.5 * (A + B / (omega * omega))
+        D = np.abs(A - B / (omega * omega)) / (4.0 * omega) + np.abs(C) / (omega * omega)
+        s_bound = np.cbrt(24.0 * np.abs(dt) / gm)
+    s_min = np.where(is_elliptic, (dt - D) / r_mean, np.minimum(0.0, np.sign(dt) * s_bound))
+    s_max = np.where(is_elliptic, (dt + D) / r_mean, np.maximum(0.0, np.sign(dt) * s_bound))
+    s = np.clip(np.where(is_elliptic, dt / r_mean, dt / A), s_min, s_max)
+    ds = ds_old = s_max - s_min
+    for _ in range(KS_MAX_ITERATION):
+        g0, g1, g2, g3 = WHFAST._whfast_g_functions(beta, 2.0 * s)
+        t = 0.25 * (A * (2.0 * s + g1) + 2.0 * C * g2 + B * g3)
+        # dt / ds = r(s)
+        r_s = 0.5 * (A * (1.0 + g0) + 2.0 * C * g1 + B * g2)
+        s_min = np.where(t < dt, s, s_min)
+        s_max = np.where(t > dt, s, s_max)
+        s_new = s - (t - dt) / r_s
+        # Bisection when Newton leaves the bracket or converges slower than
+        # it, e.g. down the exponential t(s) of a hyperbolic pair
+        is_newton = (
+            (s_new > s_min) & (s_new < s_max) & (np.abs(s_new - s) < 0.5 * ds_old)
+        )
+        s_new = np.where(is_newton, s_new, 0.5 * (s_min + s_max))
+        ds_old, ds = ds, np.abs(s_new - s)
+        is_converged = ds <= 4.0 * np.finfo(float).eps * np.abs(s_new)
+        s = s_new
+        if np.all(is_converged):
+            break
+
+    g0, g1, _, _ = WHFAST._whfast_g_functions(beta, s)
+    u, du = (
+        g0[:, np.newaxis] * u + g1[:, np.newaxis] * du,
+        g0[:, np.newaxis] * du - (beta * g1)[:, np.newaxis] * u,
+    )
+
+    # R = L(u) u and V = 2 L(u) du / r
+    r = np.sum(u * u, axis=1)
+    R = np.stack(
+        (
+            u[:, 0] ** 2 - u[:, 1] ** 2 - u[:, 2] ** 2 + u[:, 3] ** 2,
+            2.0 * (u[:, 0] * u[:, 1] - u[:, 2] * u[:, 3]),
+            2.0 * (u[:, 0] * u[:, 2] + u[:, 1] * u[:, 3]),
+        ),
+        axis=1,
+    )
+    V = (2.0 / r)[:, np.newaxis] * np.stack(
+        (
+            u[:, 0] * du[:, 0] - u[:, 1] * du[:, 1] - u[:, 2] * du[:, 2] + u[:, 3] * du[:, 3],
+            u[:, 1] * du[:, 0] + u[:, 0] * du[:, 1] - u[:, 3] * du[:, 2] - u[:, 2] * du[:, 3],
+            u[:, 2] * du[:, 0] + u[:, 3] * du[:, 1] + u[:, 0] * du[:, 2] + u[:, 1] * du[:, 3],
+        ),
+        axis=1,
+    )
+    return R, V
+
+
+# Synthetic initial conditions for large N, in N-body units (G = 1, total
+# mass 1). Load them with Grav_obj.create_from_arrays().
+def uniform_sphere(objects_count, seed=0):
+    """
+    Generate a uniform sphere of equal masses in virial equilibrium, with
+    isotropic Gaussian velocities and virial radius 1
+
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+    # W = -3 G M^2 / (5 R) = -1 / 2 for R = 6 / 5
+    radius = 1.2
+    x = _random_directions(rng, objects_count) * (
+        radius * rng.random(objects_count) ** (1.0 / 3.0)
+    )[:, np.newaxis]
+    # 2K = -W gives a one dimensional velocity dispersion of G M / (5 R)
+    v = rng.normal(scale=(1.0 / (5.0 * radius)) ** 0.5, size=(objects_count, 3))
+    m = np.full(objects_count, 1.0 / objects_count)
+    return _to_center_of_mass_frame(x, v, m)
+
+
+def plummer_sphere(objects_count, seed=0):
+    """
+    Generate a Plummer sphere of equal masses in virial equilibrium, in
+    Henon units (virial radius 1, total energy -1/4). Sampled as in
+    Aarseth, Henon & Wielen (1974), with the radius truncated at 10 scale
+    lengths.
+
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+    r = np.full(objects_count, np.inf)
+    while (mask := r > 10.0).any():
+        r[mask] = (rng.random(mask.sum()) ** (-2.0 / 3.0) - 1.0) ** -0.5
+
+    # Speed in units of the escape velocity by rejection sampling of
+    # g(q) = q^2 (1 - q^2)^3.5, whose maximum is below 0.1
+    q = np.zeros(objects_count)
+    mask = np.ones(objects_count, dtype=bool)
+    while mask.any():
+        q[mask] = rng.random(mask.sum())
+        mask[mask] = 0.1 * rng.random(mask.sum()) > q[mask] ** 2 * (1.0 - q[mask] ** 2) ** 3.5
+    speed = q * 2.0**0.5 * (1.0 + r**2) ** -0.25
+
+    x = _random_directions(rng, objects_count) * r[:, np.newaxis]
+    v = _random_directions(rng, objects_count) * speed[:, np.newaxis]
+    m = np.full(objects_count, 1.0 / objects_count)
+    x, v, m = _to_center_of_mass_frame(x, v, m)
+
+    # From a Plummer scale length of 1 to Henon units
+    scale_length = 3.0 * np.pi / 16.0
+    return x * scale_length, v / scale_length**0.5, m
+
+
+def keplerian_disk(objects_count, seed=0, disk_mass=1e-2, inner_radius=1.0, outer_radius=10.0):
+    """
+    Generate a central star with a thin disk of objects_count - 1 equal
+    mass particles on nearly circular orbits, with the surface density
+    proportional to 1 / r between inner_radius and outer_radius
+
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    rng = np.random.default_rng(seed)
+    disk_count = objects_count - 1
+    m = np.full(objects_count, disk_mass / max(disk_count, 1))
+    m[0] = 1.0 - disk_mass if disk_count > 0 else 1.0
+
+    r = np.sort(inner_radius + (outer_radius - inner_radius) * rng.random(disk_count))
+    phi = 2.0 * np.pi * rng.random(disk_count)
+    # Circular speed around the star and the disk mass inside r
+    speed = ((m[0] + m[1:] * np.arange(disk_count)) / r) ** 0.5
+
+    x = np.zeros((objects_count, 3))
+    v = np.zeros((objects_count, 3))
+    x[1:, 0] = r * np.cos(phi)
+    x[1:, 1] = r * np.sin(phi)
+    x[1:, 2] = rng.normal(scale=0.01 * r)
+    v[1:, 0] = -speed * np.sin(phi)
+    v[1:, 1] = speed * np.cos(phi)
+    v[1:] += rng.normal(scale=0.01 * speed[:, np.newaxis], size=(disk_count, 3))
+    return _to_center_of_mass_frame(x, v, m)
+
+
+def _random_directions(rng, objects_count):
+    direction = rng.normal(size=(objects_count, 3))
+    return direction / np.linalg.norm(direction, axis=1)[:, np.newaxis]
+
+
+def _to_center_of_mass_frame(x, v, m):
+    x -= np.average(x, axis=0, weights=m)
+    v -= np.average(v, axis=0, weights=m)
+    return x, v, m
+
+
+INITIAL_CONDITIONS = {
+    "uniform_sphere": uniform_sphere,
+    "plummer": plummer_sphere,
+    "disk": keplerian_disk,
+}
+
+# Signatures (restype, argtypes) of the c_lib functions used by the
+# simulator. Arrays are passed as raw data pointers, see
+# Simulator.c_lib_pointer()
+_C_ARRAY = ctypes.c_void_p
+_C_INT = ctypes.c_int
+_C_REAL = ctypes.c_double
+_C_INT_REF = ctypes.POINTER(ctypes.c_int)
+_C_REAL_REF = ctypes.POINTER(ctypes.c_double)
+_C_WORKSPACE = ctypes.c_void_p
+_C_FIXED_STEP_SIZE_ARGTYPES = [
+    _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT, _C_WORKSPACE
+]
+C_LIB_SIGNATURES = {
+    "acceleration": (None, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "acceleration_potential": (_C_REAL, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "compute_energy": (_C_REAL, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "potential_energy": (_C_REAL, [_C_INT, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "find_collisions": (
+        _C_INT, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_INT, _C_WORKSPACE]
+    ),
+    "create_workspace": (_C_WORKSPACE, [_C_INT]),
+    "free_workspace": (None, [_C_WORKSPACE]),
+    "set_force_method": (None, [_C_INT, _C_REAL, _C_INT]),
+    "set_softening": (None, [_C_INT, _C_REAL]),
+    "set_regularization": (None, [_C_REAL]),
+    "get_acceleration_count": (ctypes.c_longlong, []),
+    "get_rejected_step_count": (ctypes.c_longlong, []),
+    "set_num_threads": (None, [_C_INT]),
+    "get_num_threads": (_C_INT, []),
+    "euler": (None, _C_FIXED_STEP_SIZE_ARGTYPES),
+    "euler_cromer": (None, _C_FIXED_STEP_SIZE_ARGTYPES),
+    "rk4": (None, _C_FIXED_STEP_SIZE_ARGTYPES),
+    "leapfrog": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT,
+            _C_REAL_REF, _C_WORKSPACE,
+        ],
+    ),
+    "leapfrog_composition": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT,
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_REAL_REF,
+        ],
+    ),
+    "block_leapfrog": (
+        ctypes.c_longlong,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT,
+            _C_ARRAY, _C_REAL, _C_WORKSPACE,
+        ],
+    ),
+    "acceleration_jerk": (
+        None, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]
+    ),
+    "hermite": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL,
+            _C_REAL_REF, _C_REAL_REF, _C_REAL, _C_INT_REF, _C_REAL, _C_INT, _C_INT,
+            _C_WORKSPACE,
+        ],
+    ),
+    "bulirsch_stoer": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL,
+            _C_REAL_REF, _C_REAL_REF, _C_INT_REF, _C_INT_REF, _C_INT, _C_INT,
+            _C_REAL, _C_REAL, _C_WORKSPACE,
+        ],
+    ),
+    "whfast": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT,
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_WORKSPACE,
+        ],
+    ),
+    "rk_embedded": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_REAL_REF,
+            _C_REAL_REF, _C_INT_REF, _C_INT, _C_INT, _C_INT, _C_ARRAY, _C_INT,
+            _C_ARRAY, _C_ARRAY, _C_INT, _C_INT, _C_REAL, _C_REAL, _C_WORKSPACE,
+        ],
+    ),
+    "ias15": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_INT,
+            _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY,
+            _C_REAL_REF, _C_REAL_REF, _C_REAL, _C_INT_REF, _C_REAL, _C_REAL,
+            _C_REAL, _C_REAL, _C_INT_REF, _C_INT, _C_INT, _C_REAL_REF, _C_WORKSPACE,
+        ],
+    ),
+}
+# Signatures of the first builds of c_lib (e.g. the committed c_lib.wasm
+# when no Emscripten is at hand), without the workspace, the force methods,
+# the softening and the potential, see Legacy_c_lib
+C_LIB_LEGACY_SIGNATURES = {
+    "acceleration": (None, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "compute_energy": (_C_REAL, [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL]),
+    "euler": (None, _C_FIXED_STEP_SIZE_ARGTYPES[:-1]),
+    "euler_cromer": (None, _C_FIXED_STEP_SIZE_ARGTYPES[:-1]),
+    "rk4": (None, _C_FIXED_STEP_SIZE_ARGTYPES[:-1]),
+    "leapfrog": (
+        None,
+        [_C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_INT],
+    ),
+    "rk_embedded": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_REAL, _C_REAL_REF,
+            _C_REAL_REF, _C_INT, _C_INT, _C_INT, _C_ARRAY, _C_INT, _C_ARRAY,
+            _C_ARRAY, _C_INT, _C_INT, _C_REAL, _C_REAL,
+        ],
+    ),
+    "ias15": (
+        None,
+        [
+            _C_INT, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_REAL, _C_INT,
+            _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY, _C_ARRAY,
+            _C_REAL_REF, _C_REAL_REF, _C_REAL, _C_INT_REF, _C_REAL, _C_REAL,
+            _C_REAL, _C_REAL, _C_INT_REF, _C_INT, _C_INT,
+        ],
+    ),
+}
+
+class Legacy_c_lib:
+    """
+    Call a legacy build of c_lib (see C_LIB_LEGACY_SIGNATURES) with the
+    current signatures. It only has the direct sum without softening and
+    the integrators in INTEGRATORS, so Simulator.update_backend() runs
+    everything else with numpy. It does not count the force evaluations,
+    the rejected steps or the steps of rk_embedded() and ias15().
+    """
+
+    INTEGRATORS = [
+        "euler", "euler_cromer", "rk4", "leapfrog",
+        "rkf45", "dopri", "dverk", "rkf78", "ias15",
+    ]
+
+    def __init__(self, c_lib):
+        self.c_lib = c_lib
+
+    def create_workspace(self, objects_count):
+        return None
+
+    def free_workspace(self, workspace):
+        pass
+
+    def set_force_method(self, method_id, opening_angle, fmm_order):
+        pass
+
+    def set_softening(self, kernel_id, length):
+        pass
+
+    def set_regularization(self, radius):
+        pass
+
+    def set_num_threads(self, num_threads):
+        pass
+
+    def get_num_threads(self):
+        return 1
+
+    def get_acceleration_count(self):
+        return 0
+
+    def get_rejected_step_count(self):
+        return 0
+
+    def acceleration(self, objects_count, x, a, m, G):
+        self.c_lib.acceleration(objects_count, x, a, m, G)
+
+    def compute_energy(self, objects_count, x, v, m, G):
+        return self.c_lib.compute_energy(objects_count, x, v, m, G)
+
+    def euler(self, *args):
+        # Without the workspace
+        self.c_lib.euler(*args[:-1])
+
+    def euler_cromer(self, *args):
+        self.c_lib.euler_cromer(*args[:-1])
+
+    def rk4(self, *args):
+        self.c_lib.rk4(*args[:-1])
+
+    def leapfrog(self, *args):
+        # Without the potential and the workspace
+        self.c_lib.leapfrog(*args[:-2])
+
+    def rk_embedded(self, *args):
+        # Without the step count and the workspace
+        count = args[8]
+        count.value = 0
+        self.c_lib.rk_embedded(*args[:8], *args[9:-1])
+
+    def ias15(self, *args):
+        # Without the potential and the workspace. The step count is not
+        # written by the legacy build.
+        count = args[17]
+        count.value = 0
+        self.c_lib.ias15(*args[:-2])
+
+def c_lib_candidates():
+    """
+    Return the c_lib artifacts to try in order of preference as a list of
+    (backend, file name). Build them with the Makefile.
+
+    :rtype: list
+    """
+    if sys.platform == "emscripten":
+        return [("wasm", "c_lib.wasm")]
+    elif sys.platform == "win32":
+        return [("native", "c_lib.dll")]
+    elif sys.platform == "darwin":
+        return [("native", "c_lib.dylib"), ("native", "c_lib.so")]
+    else:
+        return [("native", "c_lib.so")]
+
+def load_c_lib(backend=None):
+    """
+    Load the best available build of c_lib. The backend can be forced with
+    the argument or the GRAVITY_SIM_BACKEND environment variable
+    ("native", "wasm" or "numpy").
+
+    :return: The library, or None when falling back to numpy, and the
+             name of the active backend
+    :rtype: tuple
+    """
+    if backend is None:
+        backend = os.environ.get("GRAVITY_SIM_BACKEND")
+    if backend not in [None, "native", "wasm", "numpy"]:
+        raise ValueError(f"Unknown backend: {backend}.")
+    if backend == "numpy":
+        return None, "numpy"
+
+    for candidate_backend, file_name in c_lib_candidates():
+        if backend is not None and backend != candidate_backend:
+            continue
+
+        path = Path(__file__).parent / file_name
+        if not path.is_file():
+            continue
+
+        try:
+            c_lib = ctypes.cdll.LoadLibrary(str(path))
+        except OSError:
+            print(f"System message: Loading {file_name} failed.")
+            continue
+
+        # An outdated build would crash on the new call signatures
+        missing_symbols = [
+            symbol for symbol in C_LIB_SIGNATURES if not hasattr(c_lib, symbol)
+        ]
+        if missing_symbols and all(
+            hasattr(c_lib, symbol) for symbol in C_LIB_LEGACY_SIGNATURES
+        ):
+            print(
+                f"System message: {file_name} is a legacy build. Running the "
+                f"integrators it has with the direct sum and numpy for the rest. "
+                f"Please rebuild it with \"make {candidate_backend}\"."
+            )
+            for symbol, (restype, argtypes) in C_LIB_LEGACY_SIGNATURES.items():
+                function = getattr(c_lib, symbol)
+                function.restype = restype
+                function.argtypes = argtypes
+            return Legacy_c_lib(c_lib), f"{candidate_backend} ({file_name}, legacy)"
+
+        if missing_symbols:
+            print(
+                f"System message: {file_name} is outdated (missing "
+                f"{', '.join(missing_symbols)}). Please rebuild it with "
+                f"\"make {candidate_backend}\"."
+            )
+            continue
+
+        # Declare the signatures once so that ctypes converts the
+        # arguments itself instead of building wrappers on every call
+        for symbol, (restype, argtypes) in C_LIB_SIGNATURES.items():
+            function = getattr(c_lib, symbol)
+            function.restype = restype
+            function.argtypes = argtypes
+        return c_lib, f"{candidate_backend} ({file_name})"
+
+    print("System message: c_lib is not available. Running with numpy.")
+    return None, "numpy"
+
+class Simulator:
+    # Force method ids of set_force_method() in c_lib
+    C_LIB_FORCE_METHODS = {"direct": 0, "barnes_hut": 1, "fmm": 2}
+    # Softening kernel ids of set_softening() in c_lib
+    C_LIB_SOFTENING_KERNELS = {"none": 0, "plummer": 1, "spline": 2}
 
-class Simulator:
     def __init__(self, grav_sim):
         self.is_c_lib = grav_sim.is_c_lib
         if self.is_c_lib == True:
             self.c_lib = grav_sim.c_lib
+        # A legacy c_lib only runs some of the integrators and settings,
+        # see update_backend()
+        self.is_c_lib_available = self.is_c_lib
+        self.is_c_lib_legacy = isinstance(grav_sim.c_lib, Legacy_c_lib)
 
         self.stats = grav_sim.stats
         self.settings = grav_sim.settings
+        self.profiler = grav_sim.profiler
 
         self.m = np.array([])
         self.x = np.array([])
         self.v = np.array([])
         self.a = np.array([])
+        # Radii of the objects, for merge_collisions()
+        self.R = np.array([])
+        # Pairs of overlapping objects written by c_lib.find_collisions()
+        self.collision_pairs = np.empty((16, 2), dtype=np.int32)
+
+        # Scratch memory of the c_lib integrators, see initialize_problem()
+        self.c_lib_workspace = None
+        self.c_lib_workspace_objects_count = 0
+
+        # Data pointers of the arrays passed to c_lib, see c_lib_pointer()
+        self.c_lib_arrays = {}
+        self.c_lib_pointers = {}
+
+        self.force_method = None
+        self.opening_angle = None
+        self.fmm_order = None
+        self.update_force_method()
+        self.softening_kernel = None
+        self.softening_length = None
+        self.update_softening()
+        self.regularization_radius = None
+        self.update_regularization()
+
+        # Number of threads used by the c_lib force and energy kernels
+        if self.is_c_lib == True:
+            self.num_threads = self.c_lib.get_num_threads()
+        else:
+            self.num_threads = 1
 
         self.fixed_step_size_integrator = FIXED_STEP_SIZE_INTEGRATOR()
         self.rk_embedded_integrator = RK_EMBEDDED()
         self.ias15_integrator = IAS15()
+        self.whfast_integrator = WHFAST()
+        self.block_leapfrog_integrator = BLOCK_LEAPFROG()
+        self.hermite_integrator = HERMITE()
+        self.bulirsch_stoer_integrator = BULIRSCH_STOER()
+
+        # Number of integration steps done by run_simulation()
+        self.steps = 0
+
+        # Frames and wall time of the last energy diagnostics, see
+        # is_energy_due()
+        self.energy_frames = 0
+        self.energy_time = None
+
+        # When the energy diagnostics are due, the integrators whose last
+        # force evaluation is at the final positions (leapfrog, its
+        # compositions and ias15)
+        # return the potential energy as a by-product of it
+        self.is_potential_requested = False
+        self.potential_energy = None
 
         self.is_initialize = True
         self.set_all_integrators_false()
@@ -2938,12 +5754,94 @@ class Simulator:
         self.is_initialize_integrator = "rk4"
 
     def run_simulation(self, grav_sim):
+        self.update_backend()
+
+        # Objects added or removed without add_objects() / remove_objects()
+        # need a full initialization
+        if len(self.m) != self.stats.objects_count:
+            self.is_initialize = True
+            self.is_initialize_integrator = self.current_integrator
+
         if self.is_initialize == True:
             self.initialize_problem(grav_sim)
 
+        if self.settings.is_merging_collisions == True:
+            self.merge_collisions(grav_sim)
+
+        acceleration_count = self.get_acceleration_count()
+        rejected_step_count = self.get_rejected_step_count()
+        self.energy_frames += 1
+        is_energy_due = self.is_energy_due()
+        # A legacy c_lib does not return the potential
+        self.is_potential_requested = is_energy_due and not (
+            self.is_c_lib == True and self.is_c_lib_legacy == True
+        )
+        self.potential_energy = None
+        steps = self.integrate()
+        self.is_potential_requested = False
+        self.steps += steps
+        self.profiler.lap("simulation")
+        self.profiler.count("steps", steps)
+        self.profiler.count(
+            "force_evaluations", self.get_acceleration_count() - acceleration_count
+        )
+        self.profiler.count(
+            "rejected_steps", self.get_rejected_step_count() - rejected_step_count
+        )
+
+        if is_energy_due:
+            if self.potential_energy is not None:
+                self.stats.total_energy = self.compute_kinetic_energy() + self.potential_energy
+            else:
+                self.stats.total_energy = self.compute_total_energy()
+            self.energy_frames = 0
+            self.energy_time = time.perf_counter()
+            self.profiler.lap("energy")
+
+    def is_energy_due(self):
+        """
+        Return whether the energy diagnostics are due, as set by
+        energy_interval_frames and energy_interval_seconds in settings.
+        They are always due after the problem is initialized.
+
+        :rtype: bool
+        """
+        interval_frames = self.settings.energy_interval_frames
+        interval_seconds = self.settings.energy_interval_seconds
+        if self.energy_time is None or (interval_frames == 0 and interval_seconds == 0):
+            return True
+        if interval_frames > 0 and self.energy_frames >= interval_frames:
+            return True
+        return (
+            interval_seconds > 0
+            and time.perf_counter() - self.energy_time >= interval_seconds
+        )
+
+    def is_state_finite(self):
+        """
+        Check the body store for infinity or NaN, which is much cheaper than
+        computing the energy
+
+        :rtype: bool
+        """
+        return bool(np.isfinite(self.x).all() and np.isfinite(self.v).all())
+
+    def integrate(self):
+        """
+        Advance the body store by one call into the current integrator,
+        without the energy diagnostics of run_simulation()
+
+        :return: Number of steps taken
+        :rtype: int
+        """
+        self.update_force_method()
+        self.update_softening()
+        self.update_regularization()
+
+        steps = 0
         # Simple euler is enough when there is no interaction
         if self.stats.objects_count == 1:
-            self.fixed_step_size_integrator.simulation(
+            steps = self.fixed_step_size_integrator.simulation(
                 self,
                 "euler",
                 self.stats.objects_count,
@@ -2958,8 +5856,8 @@ class Simulator:
         else:
             match self.current_integrator:
                 # Fixed step size integrators
-                case "euler" | "euler_cromer" | "rk4" | "leapfrog":
-                    self.fixed_step_size_integrator.simulation(
+                case "euler" | "euler_cromer" | "rk4" | "leapfrog" | "forest_ruth" | "yoshida6":
+                    steps = self.fixed_step_size_integrator.simulation(
                         self,
                         self.current_integrator,
                         self.stats.objects_count,
@@ -2972,9 +5870,85 @@ class Simulator:
                     self.stats.simulation_time += (
                         self.settings.dt * self.settings.time_speed
                     )
+
+                case "whfast" | "saba4" | "sbab4":
+                    if self.is_initialize == True and not WHFAST.is_hierarchical(self.x, self.m):
+                        print(
+                            f"System message: {self.current_integrator} needs a central "
+                            "object and every other object away from the center of mass "
+                            "of the objects before it. Switched to leapfrog."
+                        )
+                        self.set_all_integrators_false()
+                        self.is_leapfrog = True
+                        self.check_current_integrator()
+                        self.is_initialize_integrator = "leapfrog"
+                        return self.integrate()
+
+                    steps = self.whfast_integrator.simulation(
+                        self,
+                        self.stats.objects_count,
+                        self.m,
+                        Grav_obj.G,
+                        self.settings.dt,
+                        self.settings.time_speed,
+                    )
+                    self.stats.simulation_time += (
+                        self.settings.dt * self.settings.time_speed
+                    )
+
+                case "block_leapfrog":
+                    steps = self.block_leapfrog_integrator.simulation(
+                        self,
+                        self.stats.objects_count,
+                        self.m,
+                        Grav_obj.G,
+                        self.settings.dt,
+                        self.settings.time_speed,
+                    )
+                    self.stats.simulation_time += (
+                        self.settings.dt * self.settings.time_speed
+                    )
+
                 # Embedded RK methods
                 case "rkf45" | "dopri" | "dverk" | "rkf78":
-                    self.rk_embedded_integrator.simulation(
+                    steps = self.rk_embedded_integrator.simulation(
+                        self,
+                        self.stats.objects_count,
+                        self.m,
+                        Grav_obj.G,
+                        self.settings.tolerance,
+                        self.settings.tolerance,
+                        self.settings.expected_time_scale,
+                        self.settings.max_iteration,
+                        self.settings.min_iteration,
+                    )
+
+                case "ias15":
+                    steps = self.ias15_integrator.simulation(
+                        self,
+                        self.stats.objects_count,
+                        self.m,
+                        Grav_obj.G,
+                        self.settings.tolerance,
+                        self.settings.expected_time_scale,
+                        self.settings.max_iteration,
+                        self.settings.min_iteration,
+                    )
+
+                case "hermite":
+                    steps = self.hermite_integrator.simulation(
+                        self,
+                        self.stats.objects_count,
+                        self.m,
+                        Grav_obj.G,
+                        self.settings.tolerance,
+                        self.settings.expected_time_scale,
+                        self.settings.max_iteration,
+                        self.settings.min_iteration,
+                    )
+
+                case "bulirsch_stoer":
+                    steps = self.bulirsch_stoer_integrator.simulation(
                         self,
                         self.stats.objects_count,
                         self.m,
@@ -2986,75 +5960,416 @@ class Simulator:
                         self.settings.min_iteration,
                     )
 
-                case "ias15":
-                    self.ias15_integrator.simulation(
-                        self,
-                        self.stats.objects_count,
-                        self.m,
-                        Grav_obj.G,
-                        self.settings.tolerance,
-                        self.settings.expected_time_scale,
-                        self.settings.max_iteration,
-                        self.settings.min_iteration,
-                    )
+        return steps
+
+    def compute_kinetic_energy(self):
+        """
+        Compute the kinetic energy of the body store
+
+        :rtype: float
+        """
+        return 0.5 * np.sum(self.m * np.sum(self.v * self.v, axis=1))
+
+    def compute_total_energy(self):
+        """
+        Compute the total energy of the body store, with the softening
+        chosen in settings
+
+        :rtype: float
+        """
+        self.update_backend()
+        self.update_softening()
+        if self.is_c_lib == True:
+            return self.c_lib.compute_energy(
+                self.stats.objects_count,
+                self.c_lib_pointer("x", self.x),
+                self.c_lib_pointer("v", self.v),
+                self.c_lib_pointer("m", self.m),
+                Grav_obj.G,
+            )
+
+        return compute_energy(
+            self.stats.objects_count, self.x, self.v, self.m, Grav_obj.G
+        )
+
+    def update_backend(self):
+        """
+        Run with numpy instead of a legacy c_lib when the current integrator
+        or the settings need a function that it does not have, see
+        Legacy_c_lib. The integrator is initialized again on a switch.
+        """
+        if self.is_c_lib_legacy == False:
+            return
+
+        is_c_lib = (
+            self.current_integrator in Legacy_c_lib.INTEGRATORS
+            and self.settings.force_method == "direct"
+            and self.settings.softening_kernel == "none"
+            and not (
+                self.settings.is_regularizing == True
+                and self.current_integrator in REGULARIZED_INTEGRATORS
+            )
+        )
+        if is_c_lib != self.is_c_lib:
+            self.is_c_lib = is_c_lib
+            self.is_initialize = True
+            self.is_initialize_integrator = self.current_integrator
+
+    def update_force_method(self):
+        """
+        Apply the force evaluation method chosen in settings to acceleration()
+        """
+        if (
+            self.force_method != self.settings.force_method
+            or self.opening_angle != self.settings.opening_angle
+            or self.fmm_order != self.settings.fmm_order
+        ):
+            self.force_method = self.settings.force_method
+            self.opening_angle = self.settings.opening_angle
+            self.fmm_order = self.settings.fmm_order
+            set_force_method(self.force_method, self.opening_angle, self.fmm_order)
+            if self.is_c_lib == True:
+                self.c_lib.set_force_method(
+                    self.C_LIB_FORCE_METHODS[self.force_method],
+                    self.opening_angle,
+                    self.fmm_order,
+                )
+
+    def update_softening(self):
+        """
+        Apply the softening chosen in settings to every force and energy kernel
+        """
+        if (
+            self.softening_kernel != self.settings.softening_kernel
+            or self.softening_length != self.settings.softening_length
+        ):
+            self.softening_kernel = self.settings.softening_kernel
+            self.softening_length = self.settings.softening_length
+            set_softening(self.softening_kernel, self.softening_length)
+            if self.is_c_lib == True:
+                self.c_lib.set_softening(
+                    self.C_LIB_SOFTENING_KERNELS[self.softening_kernel],
+                    self.softening_length,
+                )
+
+    def update_regularization(self):
+        """
+        Apply the Kustaanheimo-Stiefel regularization chosen in settings to
+        the REGULARIZED_INTEGRATORS
+        """
+        if self.settings.is_regularizing == True:
+            regularization_radius = self.settings.regularization_radius
+        else:
+            regularization_radius = 0.0
+
+        if self.regularization_radius != regularization_radius:
+            self.regularization_radius = regularization_radius
+            set_regularization(self.regularization_radius)
+            if self.is_c_lib_available == True:
+                self.c_lib.set_regularization(self.regularization_radius)
+
+    def set_num_threads(self, num_threads):
+        """
+        Set the number of threads used by the c_lib force and energy kernels.
+        Has no effect if c_lib is not compiled with OpenMP.
+        """
+        num_threads = int(num_threads)
+        if num_threads < 1:
+            raise ValueError("num_threads must be a positive integer.")
+
+        if self.is_c_lib == True:
+            self.c_lib.set_num_threads(num_threads)
+            self.num_threads = self.c_lib.get_num_threads()
+
+    def get_acceleration_count(self):
+        """
+        Return the number of force evaluations so far, in c_lib and numpy
+
+        :rtype: int
+        """
+        count = acceleration_count
+        if self.is_c_lib == True:
+            count += self.c_lib.get_acceleration_count()
+        return count
+
+    def get_rejected_step_count(self):
+        """
+        Return the number of steps rejected by the adaptive step size
+        integrators so far, in c_lib and numpy
+
+        :rtype: int
+        """
+        count = rejected_step_count
+        if self.is_c_lib == True:
+            count += self.c_lib.get_rejected_step_count()
+        return count
+
+    def c_lib_pointer(self, name, array):
+        """
+        Return the data pointer of a C contiguous float64 array to be passed
+        to c_lib. The pointer is cached under name until the array is
+        replaced by another one.
+
+        :rtype: int
+        """
+        if self.c_lib_arrays.get(name) is not array:
+            self.c_lib_arrays[name] = array
+            self.c_lib_pointers[name] = array.ctypes.data
+        return self.c_lib_pointers[name]
+
+    def initialize_problem(self, grav_sim):
+        """
+        Build the body store x, v, a and m from the objects. Loaded objects
+        keep their current state and every object is pointed to its new row.
+        """
+        grav_objs = grav_sim.grav_objs.sprites()
+        objects_count = len(grav_objs)
+        x = np.zeros((objects_count, 3))
+        v = np.zeros((objects_count, 3))
+        m = np.zeros(objects_count)
+        R = np.zeros(objects_count)
+        for j, grav_obj in enumerate(grav_objs):
+            x[j] = grav_obj.x
+            v[j] = grav_obj.v
+            m[j] = grav_obj.m
+            R[j] = grav_obj.params["R"]
+
+        self.x = x
+        self.v = v
+        self.a = np.zeros((objects_count, 3))
+        self.m = m
+        self.R = R
+        for j, grav_obj in enumerate(grav_objs):
+            grav_obj.index = j
+        self.stats.objects_count = objects_count
+        self.energy_time = None
+
+        # The workspace is reused by the c_lib integrators until the number
+        # of objects changes
+        if (
+            self.is_c_lib == True
+            and self.c_lib_workspace_objects_count != objects_count
+        ):
+            self.c_lib.free_workspace(self.c_lib_workspace)
+            self.c_lib_workspace = self.c_lib.create_workspace(objects_count)
+            self.c_lib_workspace_objects_count = objects_count
+
+    def add_objects(self, grav_sim, grav_objs):
+        """
+        Add objects to the simulation. The new objects are appended to the
+        body store without re-initializing the integrator.
+        """
+        grav_sim.grav_objs.add(*grav_objs)
+
+        # Nothing to keep if the store is going to be rebuilt anyway
+        if self.is_initialize == True or len(self.m) == 0:
+            self.is_initialize = True
+            self.is_initialize_integrator = self.current_integrator
+            return
+
+        objects_count = len(self.m)
+        self.x = np.concatenate((self.x, [grav_obj.x for grav_obj in grav_objs]))
+        self.v = np.concatenate((self.v, [grav_obj.v for grav_obj in grav_objs]))
+        self.m = np.concatenate((self.m, [grav_obj.m for grav_obj in grav_objs]))
+        self.R = np.concatenate((self.R, [grav_obj.params["R"] for grav_obj in grav_objs]))
+        for j, grav_obj in enumerate(grav_objs):
+            grav_obj.index = objects_count + j
+
+        self._resize_objects(np.ones(objects_count, dtype=bool), len(grav_objs))
+
+    def remove_objects(self, grav_sim, grav_objs):
+        """
+        Remove objects from the simulation. Their rows are deleted from the
+        body store without re-initializing the integrator.
+        """
+        keep = np.ones(len(self.m), dtype=bool)
+        for grav_obj in grav_objs:
+            if grav_obj.alive() and grav_obj.index is not None:
+                keep[grav_obj.index] = False
+            grav_obj.kill()
+            grav_obj.index = None
+
+        if self.is_initialize == True:
+            return
+
+        self.x = self.x[keep]
+        self.v = self.v[keep]
+        self.m = self.m[keep]
+        self.R = self.R[keep]
+        new_index = np.cumsum(keep) - 1
+        for grav_obj in grav_sim.grav_objs:
+            grav_obj.index = int(new_index[grav_obj.index])
+
+        self._resize_objects(keep, 0)
+
+    def remove_out_of_range_objects(self, grav_sim):
+        """
+        Remove the objects further than Settings.MAX_RANGE from the origin in
+        any coordinate, with one check of the whole body store and one call
+        to remove_objects() for all of them
+
+        :return: Number of objects removed
+        :rtype: int
+        """
+        # Objects not in the body store yet are checked once it is built
+        if self.is_initialize == True or len(self.m) != len(grav_sim.grav_objs):
+            return 0
+        if len(self.m) == 0 or _abs_max(self.x) <= self.settings.MAX_RANGE:
+            return 0
+
+        is_out_of_range = np.any(np.abs(self.x) > self.settings.MAX_RANGE, axis=1)
+        # NaN positions are left to GravitySimulator._check_energy_error()
+        if not is_out_of_range.any():
+            return 0
+        out_of_range_objs = [
+            grav_obj for grav_obj in grav_sim.grav_objs if is_out_of_range[grav_obj.index]
+        ]
+        self.remove_objects(grav_sim, out_of_range_objs)
+        print("System message: Out of range objects removed.")
+        return len(out_of_range_objs)
+
+    def find_collisions(self):
+        """
+        Find the pairs of overlapping objects in the body store, see
+        find_collisions()
+
+        :return: Indices i < j of the overlapping pairs
+        :rtype: tuple of numpy.ndarray
+        """
+        if self.is_c_lib == False or self.is_c_lib_legacy == True:
+            return find_collisions(self.x, self.R)
 
-        if self.is_c_lib == True:
-            try:
-                self.stats.total_energy = self.c_lib.compute_energy(
-                    ctypes.c_int(self.stats.objects_count),
-                    self.x.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                    self.v.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                    self.m.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), 
-                    ctypes.c_double(Grav_obj.G),
-                )
-            except:
-                self.stats.total_energy = compute_energy(
-                    self.stats.objects_count, self.x, self.v, self.m, Grav_obj.G
-                )
-        elif self.is_c_lib == False:
-            self.stats.total_energy = compute_energy(
-                self.stats.objects_count, self.x, self.v, self.m, Grav_obj.G
+        objects_count = len(self.m)
+        while True:
+            count = self.c_lib.find_collisions(
+                objects_count,
+                self.c_lib_pointer("x", self.x),
+                self.c_lib_pointer("R", self.R),
+                self.c_lib_pointer("collision_pairs", self.collision_pairs),
+                len(self.collision_pairs),
+                self.c_lib_workspace,
             )
+            if count <= len(self.collision_pairs):
+                return self.collision_pairs[:count, 0], self.collision_pairs[:count, 1]
+            self.collision_pairs = np.empty((count, 2), dtype=np.int32)
 
-    def initialize_problem(self, grav_sim):
+    def merge_collisions(self, grav_sim):
         """
-        Initialize x, v and m
+        Merge every group of overlapping objects into one object at their
+        center of mass, with their total mass and momentum and the radius of
+        their total volume. The merged object keeps the sprite of the most
+        massive one. The merged object takes the row of the member with the
+        lowest index, so that the central object of WHFast stays in row 0,
+        and the rows of the other members are deleted from the body store
+        without re-initializing the integrator, as in remove_objects().
+
+        :return: Number of objects removed
+        :rtype: int
         """
-        objects_count = grav_sim.stats.objects_count
-        self.x = np.zeros((objects_count, 3))
-        self.v = np.zeros((objects_count, 3))
-        self.m = np.zeros(objects_count)
-        for j in range(objects_count):
-            self.x[j] = np.array(
-                [grav_sim.grav_objs.sprites()[j].params[f"r{i + 1}"] for i in range(3)]
-            )
-            self.v[j] = np.array(
-                [grav_sim.grav_objs.sprites()[j].params[f"v{i + 1}"] for i in range(3)]
-            )
-            self.m[j] = grav_sim.grav_objs.sprites()[j].params["m"]
+        pairs_i, pairs_j = self.find_collisions()
+        if len(pairs_i) == 0:
+            return 0
+
+        # Union-find of the groups, e.g. three objects in a row
+        parent = {}
+
+        def find_root(i):
+            while parent.setdefault(i, i) != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in zip(pairs_i.tolist(), pairs_j.tolist()):
+            root_i, root_j = find_root(i), find_root(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        groups = {}
+        for i in parent:
+            groups.setdefault(find_root(i), []).append(i)
+
+        grav_objs = {grav_obj.index: grav_obj for grav_obj in grav_sim.grav_objs}
+        objects_count = len(self.m)
+        keep = np.ones(objects_count, dtype=bool)
+        merged_rows = []
+        for members in groups.values():
+            m = self.m[members]
+            total_m = np.sum(m)
+            row = min(members)
+            self.x[row] = m @ self.x[members] / total_m
+            self.v[row] = m @ self.v[members] / total_m
+            self.R[row] = np.cbrt(np.sum(self.R[members] ** 3))
+            self.m[row] = total_m
+            keep[members] = False
+            keep[row] = True
+            merged_rows.append(row)
+
+            merged_obj = grav_objs[members[int(np.argmax(m))]]
+            for i in members:
+                if grav_objs[i] is not merged_obj:
+                    grav_objs[i].kill()
+                    grav_objs[i].index = None
+            merged_obj.index = row
+            merged_obj.set_radius(self.R[row])
+
+        self.x = self.x[keep]
+        self.v = self.v[keep]
+        self.m = self.m[keep]
+        self.R = self.R[keep]
+        new_index = np.cumsum(keep) - 1
+        for grav_obj in grav_sim.grav_objs:
+            grav_obj.index = int(new_index[grav_obj.index])
 
-    def unload_value(self, grav_sim):
+        self._resize_objects(keep, 0, new_index[merged_rows])
+        removed_count = objects_count - len(self.m)
+        print("System message: Colliding objects merged.")
+        return removed_count
+
+    def _resize_objects(self, keep, added_count, reset_rows=()):
         """
-        Unload the position and velocity values back the to main system
+        Resize the integrator buffers after adding or removing objects and
+        recompute the acceleration. The integrator state of the kept rows in
+        reset_rows, e.g. merged objects, is reset as for new objects. The
+        c_lib workspace grows by itself.
         """
-        for j in range(self.stats.objects_count):
-            grav_sim.grav_objs.sprites()[j].params["r1"] = self.x[j][0]
-            grav_sim.grav_objs.sprites()[j].params["r2"] = self.x[j][1]
-            grav_sim.grav_objs.sprites()[j].params["r3"] = self.x[j][2]
-            grav_sim.grav_objs.sprites()[j].params["v1"] = self.v[j][0]
-            grav_sim.grav_objs.sprites()[j].params["v2"] = self.v[j][1]
-            grav_sim.grav_objs.sprites()[j].params["v3"] = self.v[j][2]
+        objects_count = len(self.m)
+        self.stats.objects_count = objects_count
+        self.energy_time = None
+        self.update_backend()
+        reset_rows = np.asarray(reset_rows, dtype=np.intp)
+        self.ias15_integrator.resize_objects(keep, added_count, reset_rows)
+        self.block_leapfrog_integrator.resize_objects(keep, added_count, reset_rows)
+        self.hermite_integrator.resize_objects(keep, added_count, reset_rows)
+
+        if self.is_c_lib == True:
+            self.a = np.zeros((objects_count, 3))
+            self.c_lib.acceleration(
+                objects_count,
+                self.c_lib_pointer("x", self.x),
+                self.c_lib_pointer("a", self.a),
+                self.c_lib_pointer("m", self.m),
+                Grav_obj.G,
+            )
+        else:
+            self.a = acceleration(objects_count, self.x, self.m, Grav_obj.G)
 
     def set_all_integrators_false(self):
         self.is_euler = False
         self.is_euler_cromer = False
         self.is_rk4 = False
         self.is_leapfrog = False
+        self.is_forest_ruth = False
+        self.is_yoshida6 = False
+        self.is_whfast = False
+        self.is_saba4 = False
+        self.is_sbab4 = False
+        self.is_block_leapfrog = False
         self.is_rkf45 = False
         self.is_dopri = False
         self.is_dverk = False
         self.is_rkf78 = False
         self.is_ias15 = False
+        self.is_hermite = False
+        self.is_bulirsch_stoer = False
 
     def check_current_integrator(self):
         """
@@ -3068,6 +6383,18 @@ class Simulator:
             self.current_integrator = "rk4"
         elif self.is_leapfrog == True:
             self.current_integrator = "leapfrog"
+        elif self.is_forest_ruth == True:
+            self.current_integrator = "forest_ruth"
+        elif self.is_yoshida6 == True:
+            self.current_integrator = "yoshida6"
+        elif self.is_whfast == True:
+            self.current_integrator = "whfast"
+        elif self.is_saba4 == True:
+            self.current_integrator = "saba4"
+        elif self.is_sbab4 == True:
+            self.current_integrator = "sbab4"
+        elif self.is_block_leapfrog == True:
+            self.current_integrator = "block_leapfrog"
         elif self.is_rkf45 == True:
             self.current_integrator = "rkf45"
         elif self.is_dopri == True:
@@ -3078,8 +6405,81 @@ class Simulator:
             self.current_integrator = "rkf78"
         elif self.is_ias15 == True:
             self.current_integrator = "ias15"
+        elif self.is_hermite == True:
+            self.current_integrator = "hermite"
+        elif self.is_bulirsch_stoer == True:
+            self.current_integrator = "bulirsch_stoer"
+
+
+
 
+class Profiler:
+    """
+    Time the phases of each frame and count the work of the simulator per
+    frame, keeping rolling histories of the last history_length frames
+    """
+
+    DEFAULT_HISTORY_LENGTH = 120
+    # Phases of the main loop in order, in seconds per frame
+    PHASES = ["events", "update", "simulation", "energy", "screen", "idle"]
+    # Counters per frame
+    COUNTERS = ["steps", "force_evaluations", "rejected_steps"]
+
+    def __init__(self, history_length=DEFAULT_HISTORY_LENGTH):
+        self.history = {
+            name: collections.deque(maxlen=history_length)
+            for name in self.PHASES + self.COUNTERS
+        }
+        self.frame = dict.fromkeys(self.PHASES + self.COUNTERS, 0)
+        self.last_lap_time = time.perf_counter()
+
+    def start_frame(self):
+        """Start timing a frame"""
+        self.last_lap_time = time.perf_counter()
+
+    def lap(self, phase):
+        """Add the time since the last lap to phase"""
+        now = time.perf_counter()
+        self.frame[phase] += now - self.last_lap_time
+        self.last_lap_time = now
+
+    def count(self, counter, value):
+        """Add value to counter"""
+        self.frame[counter] += value
+
+    def end_frame(self):
+        """Push the frame into the histories and reset it"""
+        for name, value in self.frame.items():
+            self.history[name].append(value)
+            self.frame[name] = 0
+
+    def mean(self, name):
+        """
+        Return the mean per frame over the history
+
+        :rtype: float
+        """
+        if not self.history[name]:
+            return 0.0
+        return sum(self.history[name]) / len(self.history[name])
+
+    def max(self, name):
+        """
+        Return the maximum per frame over the history
 
+        :rtype: float
+        """
+        if not self.history[name]:
+            return 0.0
+        return max(self.history[name])
+
+    def histogram(self, name, bins=10):
+        """
+        Return the histogram of the history as in numpy.histogram()
+
+        :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        return np.histogram(np.array(self.history[name]), bins=bins)
 
 
 class Stats:
@@ -3090,6 +6490,17 @@ class Stats:
     STATSBOARD_SIZE_Y = 23
     FIXED_STEP_SIZE_INTEGRATORS_COLOR = (120, 233, 250)
     ADAPTIVE_STEP_SIZE_INTEGRATORS_COLOR = (173, 255, 47)
+    PROFILER_LABELS = {
+        "events": "Events",
+        "update": "Sprite update",
+        "simulation": "Simulation",
+        "energy": "Energy",
+        "screen": "Screen",
+        "idle": "Idle",
+        "steps": "Steps",
+        "force_evaluations": "Force evaluations",
+        "rejected_steps": "Rejected steps",
+    }
 
     def __init__(self, grav_sim) -> None:
         self.simulation_time = 0
@@ -3099,6 +6510,7 @@ class Stats:
         self.is_paused = False
         self.is_holding_rclick = False
         self._create_statsboard(grav_sim)
+        self._create_profiler_board(grav_sim)
         self._statsboard_init_print_msg()
 
     def update(self, grav_sim) -> None:
@@ -3173,6 +6585,50 @@ class Stats:
             f"Min iterations / frame = {self.settings.min_iteration}"
         )
         self.tolerance_board.print_msg(f"Tolerance = {self.settings.tolerance:g}")
+        match self.settings.force_method:
+            case "direct":
+                self.force_method_board.print_msg("Force = Direct sum")
+            case "barnes_hut":
+                self.force_method_board.print_msg("Force = Barnes-Hut")
+            case "fmm":
+                self.force_method_board.print_msg("Force = FMM")
+        self.opening_angle_board.print_msg(
+            f"Opening angle = {self.settings.opening_angle:g}"
+        )
+        self.fmm_order_board.print_msg(f"FMM order = {self.settings.fmm_order}")
+        match self.settings.softening_kernel:
+            case "none":
+                self.softening_kernel_board.print_msg("Softening = None")
+            case "plummer":
+                self.softening_kernel_board.print_msg("Softening = Plummer")
+            case "spline":
+                self.softening_kernel_board.print_msg("Softening = Spline")
+        self.softening_length_board.print_msg(
+            f"Softening length = {self.settings.softening_length:g} AU"
+        )
+        if self.settings.is_merging_collisions == True:
+            self.collisions_board.print_msg("Collisions = Merge")
+        else:
+            self.collisions_board.print_msg("Collisions = Ignore")
+        if self.settings.is_regularizing == True:
+            self.regularization_board.print_msg("Regularization = KS")
+        else:
+            self.regularization_board.print_msg("Regularization = None")
+        self.regularization_radius_board.print_msg(
+            f"KS radius = {self.settings.regularization_radius:g} AU"
+        )
+
+    def print_profiler_msg(self, profiler) -> None:
+        for name in Profiler.PHASES:
+            self.profiler_boards[name].print_msg(
+                f"{self.PROFILER_LABELS[name]} = {profiler.mean(name) * 1000:.2f}"
+                f" / {profiler.max(name) * 1000:.2f} ms"
+            )
+        for name in Profiler.COUNTERS:
+            self.profiler_boards[name].print_msg(
+                f"{self.PROFILER_LABELS[name]} = {profiler.mean(name):.1f}"
+                f" / {profiler.max(name):.0f}"
+            )
 
     def draw(self, grav_sim) -> None:
         self.print_msg()
@@ -3193,6 +6649,14 @@ class Stats:
         self.max_iteration_board.draw()
         self.min_iteration_board.draw()
         self.tolerance_board.draw()
+        self.force_method_board.draw()
+        self.opening_angle_board.draw()
+        self.fmm_order_board.draw()
+        self.softening_kernel_board.draw()
+        self.softening_length_board.draw()
+        self.collisions_board.draw()
+        self.regularization_board.draw()
+        self.regularization_radius_board.draw()
 
         self.integrators_board.draw()
         self.fixed_step_size_board.draw()
@@ -3200,6 +6664,12 @@ class Stats:
         self.euler_cromer_board.draw()
         self.rk4_board.draw()
         self.leapfrog_board.draw()
+        self.forest_ruth_board.draw()
+        self.yoshida6_board.draw()
+        self.whfast_board.draw()
+        self.saba4_board.draw()
+        self.sbab4_board.draw()
+        self.block_leapfrog_board.draw()
 
         self.adaptive_step_size_board.draw()
         self.rkf45_board.draw()
@@ -3207,6 +6677,14 @@ class Stats:
         self.dverk_board.draw()
         self.rkf78_board.draw()
         self.ias15_board.draw()
+        self.hermite_board.draw()
+        self.bulirsch_stoer_board.draw()
+
+        if self.settings.is_show_profiler == True:
+            self.print_profiler_msg(grav_sim.profiler)
+            self.profiler_header_board.draw()
+            for board in self.profiler_boards.values():
+                board.draw()
 
         # Visual indicator for currently changing parameter
         match self.settings.current_changing_parameter:
@@ -3277,6 +6755,34 @@ class Stats:
                     (290, self.tolerance_board.rect.centery + 5),
                     4,
                 )
+            case "opening_angle":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "yellow",
+                    (590, self.opening_angle_board.rect.centery + 5),
+                    4,
+                )
+            case "fmm_order":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "yellow",
+                    (590, self.fmm_order_board.rect.centery + 5),
+                    4,
+                )
+            case "softening_length":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "yellow",
+                    (590, self.softening_length_board.rect.centery + 5),
+                    4,
+                )
+            case "regularization_radius":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "yellow",
+                    (590, self.regularization_radius_board.rect.centery + 5),
+                    4,
+                )
 
         # Visual indicator for currently selected integrator
         match grav_sim.simulator.current_integrator:
@@ -3305,6 +6811,48 @@ class Stats:
                     (290, self.leapfrog_board.rect.centery + 5),
                     4,
                 )
+            case "forest_ruth":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.forest_ruth_board.rect.centery + 5),
+                    4,
+                )
+            case "yoshida6":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.yoshida6_board.rect.centery + 5),
+                    4,
+                )
+            case "whfast":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.whfast_board.rect.centery + 5),
+                    4,
+                )
+            case "saba4":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.saba4_board.rect.centery + 5),
+                    4,
+                )
+            case "sbab4":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.sbab4_board.rect.centery + 5),
+                    4,
+                )
+            case "block_leapfrog":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.block_leapfrog_board.rect.centery + 5),
+                    4,
+                )
             case "rkf45":
                 pygame.draw.circle(
                     grav_sim.screen,
@@ -3340,6 +6888,20 @@ class Stats:
                     (290, self.ias15_board.rect.centery + 5),
                     4,
                 )
+            case "hermite":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.hermite_board.rect.centery + 5),
+                    4,
+                )
+            case "bulirsch_stoer":
+                pygame.draw.circle(
+                    grav_sim.screen,
+                    "green",
+                    (290, self.bulirsch_stoer_board.rect.centery + 5),
+                    4,
+                )
             
     def check_button(self, grav_sim, mouse_pos) -> None:
         """Check if there is any click on the buttons"""
@@ -3374,6 +6936,26 @@ class Stats:
             if self.tolerance_board.rect.collidepoint(mouse_pos):
                 self.settings.set_all_parameters_changing_false()
                 self.settings.is_changing_tolerance = True
+            if self.force_method_board.rect.collidepoint(mouse_pos):
+                self.settings.switch_force_method()
+            if self.opening_angle_board.rect.collidepoint(mouse_pos):
+                self.settings.set_all_parameters_changing_false()
+                self.settings.is_changing_opening_angle = True
+            if self.fmm_order_board.rect.collidepoint(mouse_pos):
+                self.settings.set_all_parameters_changing_false()
+                self.settings.is_changing_fmm_order = True
+            if self.softening_kernel_board.rect.collidepoint(mouse_pos):
+                self.settings.switch_softening_kernel()
+            if self.softening_length_board.rect.collidepoint(mouse_pos):
+                self.settings.set_all_parameters_changing_false()
+                self.settings.is_changing_softening_length = True
+            if self.collisions_board.rect.collidepoint(mouse_pos):
+                self.settings.is_merging_collisions = not self.settings.is_merging_collisions
+            if self.regularization_board.rect.collidepoint(mouse_pos):
+                self.settings.is_regularizing = not self.settings.is_regularizing
+            if self.regularization_radius_board.rect.collidepoint(mouse_pos):
+                self.settings.set_all_parameters_changing_false()
+                self.settings.is_changing_regularization_radius = True
 
             if self.euler_board.rect.collidepoint(mouse_pos):
                 grav_sim.simulator.set_all_integrators_false()
@@ -3395,6 +6977,36 @@ class Stats:
                 grav_sim.simulator.is_leapfrog = True
                 grav_sim.simulator.is_initialize = True
                 grav_sim.simulator.is_initialize_integrator = "leapfrog"
+            if self.forest_ruth_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_forest_ruth = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "forest_ruth"
+            if self.yoshida6_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_yoshida6 = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "yoshida6"
+            if self.whfast_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_whfast = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "whfast"
+            if self.saba4_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_saba4 = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "saba4"
+            if self.sbab4_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_sbab4 = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "sbab4"
+            if self.block_leapfrog_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_block_leapfrog = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "block_leapfrog"
 
             if self.rkf45_board.rect.collidepoint(mouse_pos):
                 grav_sim.simulator.set_all_integrators_false()
@@ -3421,6 +7033,16 @@ class Stats:
                 grav_sim.simulator.is_ias15 = True
                 grav_sim.simulator.is_initialize = True
                 grav_sim.simulator.is_initialize_integrator = "ias15"
+            if self.hermite_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_hermite = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "hermite"
+            if self.bulirsch_stoer_board.rect.collidepoint(mouse_pos):
+                grav_sim.simulator.set_all_integrators_false()
+                grav_sim.simulator.is_bulirsch_stoer = True
+                grav_sim.simulator.is_initialize = True
+                grav_sim.simulator.is_initialize_integrator = "bulirsch_stoer"
 
     def _statsboard_init_print_msg(self) -> None:
         self.parameters_board.print_msg("Parameters: (Click below to select)")
@@ -3430,12 +7052,21 @@ class Stats:
         self.euler_cromer_board.print_msg("Euler-Cromer")
         self.rk4_board.print_msg("4th order Runge-Kutta")
         self.leapfrog_board.print_msg("Leapfrog (Verlet)")
+        self.forest_ruth_board.print_msg("Forest-Ruth (4th order)")
+        self.yoshida6_board.print_msg("Yoshida (6th order)")
+        self.whfast_board.print_msg("WHFast (Wisdom-Holman)")
+        self.saba4_board.print_msg("WHFast SABA4")
+        self.sbab4_board.print_msg("WHFast SBAB4")
+        self.block_leapfrog_board.print_msg("Block time step leapfrog")
         self.adaptive_step_size_board.print_msg("(Adaptive Step Size)")
         self.rkf45_board.print_msg("Runge-Kutta-Fehleberg 4(5)")
         self.dopri_board.print_msg("Dormand-Prince 5(4)")
         self.dverk_board.print_msg("Verner's method 6(5) DVERK")
         self.rkf78_board.print_msg("Runge-Kutta-Fehlberg 7(8)")
         self.ias15_board.print_msg("IAS15")
+        self.hermite_board.print_msg("Hermite (4th order)")
+        self.bulirsch_stoer_board.print_msg("Bulirsch-Stoer")
+        self.profiler_header_board.print_msg("Per frame: (mean / max)")
 
     @classmethod
     def _create_statsboard(self, grav_sim) -> None:
@@ -3575,6 +7206,74 @@ class Stats:
             text_color=self.ADAPTIVE_STEP_SIZE_INTEGRATORS_COLOR,
         )
 
+        self.force_method_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 161),
+        )
+        self.opening_angle_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 184),
+        )
+
+        self.fmm_order_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 207),
+        )
+        self.softening_kernel_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 230),
+        )
+        self.softening_length_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 253),
+        )
+
+        self.collisions_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 276),
+        )
+
+        self.regularization_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 299),
+        )
+        self.regularization_radius_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(310, 322),
+        )
+
         self.integrators_board = Text_box(
             grav_sim,
             self.STATSBOARD_FONT_SIZE,
@@ -3624,13 +7323,61 @@ class Stats:
             font="Manrope",
             text_box_left_top=(10, 529),
         )
-        self.adaptive_step_size_board = Text_box(
+        self.forest_ruth_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 552),
+        )
+        self.yoshida6_board = Text_box(
             grav_sim,
             self.STATSBOARD_FONT_SIZE,
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
             text_box_left_top=(10, 575),
+        )
+        self.whfast_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 598),
+        )
+        self.saba4_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 621),
+        )
+        self.sbab4_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 644),
+        )
+        self.block_leapfrog_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 667),
+        )
+        self.adaptive_step_size_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 713),
             text_color=self.ADAPTIVE_STEP_SIZE_INTEGRATORS_COLOR,
         )
         self.rkf45_board = Text_box(
@@ -3639,7 +7386,7 @@ class Stats:
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
-            text_box_left_top=(10, 598),
+            text_box_left_top=(10, 736),
         )
         self.dopri_board = Text_box(
             grav_sim,
@@ -3647,7 +7394,7 @@ class Stats:
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
-            text_box_left_top=(10, 621),
+            text_box_left_top=(10, 759),
         )
         self.dverk_board = Text_box(
             grav_sim,
@@ -3655,7 +7402,7 @@ class Stats:
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
-            text_box_left_top=(10, 644),
+            text_box_left_top=(10, 782),
         )
         self.rkf78_board = Text_box(
             grav_sim,
@@ -3663,7 +7410,7 @@ class Stats:
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
-            text_box_left_top=(10, 667),
+            text_box_left_top=(10, 805),
         )
         self.ias15_board = Text_box(
             grav_sim,
@@ -3671,8 +7418,46 @@ class Stats:
             size_x=self.STATSBOARD_SIZE_X,
             size_y=self.STATSBOARD_SIZE_Y,
             font="Manrope",
-            text_box_left_top=(10, 713),
+            text_box_left_top=(10, 851),
+        )
+        self.hermite_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 874),
+        )
+        self.bulirsch_stoer_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(10, 897),
+        )
+
+    def _create_profiler_board(self, grav_sim) -> None:
+        """Create the performance panel on the right, toggled with T"""
+        left = self.settings.screen_width - 300
+        self.profiler_header_board = Text_box(
+            grav_sim,
+            self.STATSBOARD_FONT_SIZE,
+            size_x=self.STATSBOARD_SIZE_X,
+            size_y=self.STATSBOARD_SIZE_Y,
+            font="Manrope",
+            text_box_left_top=(left, 0),
         )
+        self.profiler_boards = {}
+        for i, name in enumerate(Profiler.PHASES + Profiler.COUNTERS):
+            self.profiler_boards[name] = Text_box(
+                grav_sim,
+                self.STATSBOARD_FONT_SIZE,
+                size_x=self.STATSBOARD_SIZE_X,
+                size_y=self.STATSBOARD_SIZE_Y,
+                font="Manrope",
+                text_box_left_top=(left, 23 * (i + 1)),
+            )
 
 if __name__ == "__main__":
     grav_sim = GravitySimulator()